@@ -0,0 +1,65 @@
+# benchmarks/bench_events.py
+#
+# Copyright (c) 2012 Marco Scopesi <marco.scopesi@gmail.com>
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+''' Throughput of post() and process_queue() '''
+
+import collections
+
+from yaranullin.event_system import EventQueue, connect, post, \
+        process_queue
+
+from benchmarks.common import best_of
+
+
+class _Handler(object):
+
+    def __init__(self):
+        self.calls = 0
+
+    def handle(self, event_dict):
+        self.calls += 1
+
+
+def _dispatch(num_events, num_handlers):
+    ''' Post and process num_events with num_handlers connected '''
+    queue = EventQueue()
+    events = collections.defaultdict(set)
+    handlers = [_Handler() for _ in xrange(num_handlers)]
+    for handler in handlers:
+        connect('bench', handler.handle, events)
+
+    def run():
+        for i in xrange(num_events):
+            post('bench', queue=queue, events=events, index=i)
+        process_queue(queue, events)
+
+    elapsed = best_of(run)
+    return dict(events=num_events, handlers=num_handlers,
+            seconds=elapsed, events_per_second=num_events / elapsed,
+            calls_per_second=num_events * num_handlers / elapsed)
+
+
+def run(quick=False):
+    ''' Run the benchmarks of the event system '''
+    num_events = 2000 if quick else 20000
+    results = {}
+    for num_handlers in (1, 10, 100):
+        if num_handlers > 10:
+            # Keep the number of calls, and the time, reasonable
+            num_events //= 10
+        results['dispatch-%d-handlers' % num_handlers] = _dispatch(
+                num_events, num_handlers)
+    return results
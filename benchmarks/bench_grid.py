@@ -0,0 +1,106 @@
+# benchmarks/bench_grid.py
+#
+# Copyright (c) 2012 Marco Scopesi <marco.scopesi@gmail.com>
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+''' Grid and Board operations on large boards '''
+
+import random
+
+from yaranullin.game.grid import Grid
+from yaranullin.game.board import Board
+
+from benchmarks.common import best_of
+
+
+class _Content(object):
+
+    def __init__(self):
+        self.pos = None
+        self.size = None
+
+
+def _grid_ops(size, count):
+    ''' Add, query and remove count 2x2 contents '''
+    rand = random.Random(0)
+    positions = [(rand.randrange(size - 2), rand.randrange(size - 2))
+            for _ in xrange(count)]
+    contents = [_Content() for _ in xrange(count)]
+    grid = Grid((size, size))
+    results = {}
+
+    def add():
+        grid.clear()
+        for content, pos in zip(contents, positions):
+            grid.add(content, pos, (2, 2))
+
+    def get():
+        for pos in positions:
+            grid.get(pos, (2, 2))
+
+    def remove():
+        for content in contents:
+            grid.remove(content)
+
+    # The contents are added again before every removal, out of the timing
+    for name, func, setup in (('add', add, None), ('get', get, add),
+            ('remove', remove, add)):
+        elapsed = best_of(func, setup=setup)
+        results[name] = dict(ops=count, seconds=elapsed,
+                ops_per_second=count / elapsed)
+    return results
+
+
+def _create_pawns(size, count):
+    ''' Create count pawns with random initiatives on a board '''
+    rand = random.Random(0)
+    pawns = [('pawn-%d' % i, rand.randrange(30), (i % size, i // size))
+            for i in xrange(count)]
+
+    def run():
+        board = Board('bench', (size, size))
+        for name, initiative, pos in pawns:
+            board.create_pawn(name, initiative, pos, (1, 1))
+
+    elapsed = best_of(run)
+    return dict(pawns=count, seconds=elapsed, pawns_per_second=count /
+            elapsed)
+
+
+def _spawn_pawns(size, count, wave):
+    ''' Drop a wave of 3x3 pawns on a crowded board '''
+    rand = random.Random(0)
+    pawns = [('pawn-%d' % i, 0, (rand.randrange(size), rand.randrange(size)))
+            for i in xrange(count)]
+    monsters = [('monster-%d' % i, 10, (3, 3)) for i in xrange(wave)]
+
+    def run():
+        board = Board('bench', (size, size))
+        for name, initiative, pos in pawns:
+            board.create_pawn(name, initiative, pos, (1, 1))
+        board.spawn_pawns((size // 2, size // 2), monsters)
+
+    elapsed = best_of(run)
+    return dict(pawns=count, wave=wave, seconds=elapsed)
+
+
+def run(quick=False):
+    ''' Run the benchmarks of the game model '''
+    count = 1000 if quick else 10000
+    results = {}
+    for name, result in _grid_ops(1000, count).iteritems():
+        results['grid-%s' % name] = result
+    results['board-create-pawn'] = _create_pawns(1000, count // 5)
+    results['board-spawn-pawns'] = _spawn_pawns(1000, count // 5, 50)
+    return results
@@ -0,0 +1,123 @@
+# benchmarks/bench_network.py
+#
+# Copyright (c) 2012 Marco Scopesi <marco.scopesi@gmail.com>
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+''' Throughput and latency of a loopback Server '''
+
+import time
+import json
+import socket
+import asyncore
+import multiprocessing
+
+from yaranullin.network.base import _EndPoint
+
+from benchmarks.common import percentiles
+
+
+def _free_port():
+    ''' Return a free TCP port on localhost '''
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def _wait_for(port, timeout=10):
+    ''' Wait until a server accepts connections on port '''
+    deadline = time.time() + timeout
+    while True:
+        try:
+            socket.create_connection(('127.0.0.1', port)).close()
+            return
+        except socket.error:
+            if time.time() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+def _serve(port):
+    ''' Run a Server answering every pawn-next request '''
+    from yaranullin.event_system import connect, post, process_queue
+    from yaranullin.network.server import Server
+
+    def echo(event_dict):
+        post('game-event-pawn-next', event_dict)
+
+    connect('game-request-pawn-next', echo)
+    Server(('127.0.0.1', port))
+    stop = False
+    while not stop:
+        post('tick')
+        stop = process_queue()
+        asyncore.poll(0.001)
+
+
+class _BenchClient(_EndPoint):
+
+    ''' A bare end point, not connected to the event system '''
+
+    def send_event(self, event_dict):
+        self._add_to_out_buffer(json.dumps(event_dict))
+
+    def receive(self, count, timeout=30):
+        ''' Wait for count messages '''
+        received = 0
+        deadline = time.time() + timeout
+        while received < count and time.time() < deadline:
+            asyncore.poll(0.001)
+            while self._get_from_in_buffer():
+                received += 1
+        return received
+
+
+def run(quick=False):
+    ''' Run the benchmarks of the network layer '''
+    count = 500 if quick else 5000
+    port = _free_port()
+    server = multiprocessing.Process(target=_serve, args=(port, ))
+    server.start()
+    try:
+        _wait_for(port)
+        client = _BenchClient()
+        client.connect(('127.0.0.1', port))
+        event_dict = dict(event='game-request-pawn-next', payload='x' * 100)
+        # Round trip latency, one message at a time
+        samples = []
+        for _ in xrange(count // 5):
+            start = time.time()
+            client.send_event(event_dict)
+            client.receive(1)
+            samples.append(time.time() - start)
+        results = {'network-round-trip': percentiles(samples)}
+        # Throughput, all messages in flight
+        start = time.time()
+        for _ in xrange(count):
+            client.send_event(event_dict)
+        received = client.receive(count)
+        elapsed = time.time() - start
+        results['network-throughput'] = dict(messages=received,
+                seconds=elapsed, messages_per_second=received / elapsed)
+        client.send_event(dict(event='quit'))
+        client.receive(0)
+        for _ in xrange(10):
+            asyncore.poll(0.01)
+        client.close()
+    finally:
+        server.join(5)
+        if server.is_alive():
+            server.terminate()
+    return results
@@ -0,0 +1,88 @@
+# benchmarks/bench_tmx.py
+#
+# Copyright (c) 2012 Marco Scopesi <marco.scopesi@gmail.com>
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+''' Load and serialization of big tmx maps '''
+
+import os
+import base64
+import zlib
+import struct
+import shutil
+import tempfile
+
+from yaranullin.event_system import _QUEUE
+from yaranullin.game.tmx_wrapper import TmxWrapper
+from yaranullin.game import binboard
+
+from benchmarks.common import best_of
+
+
+def make_tmx(size, num_pawns, tile=32):
+    ''' Return a synthetic tmx map with a tile layer and many pawns '''
+    gids = struct.pack('<%dI' % (size * size), *([1] * (size * size)))
+    data = base64.b64encode(zlib.compress(gids))
+    pawns = []
+    for i in xrange(num_pawns):
+        pawns.append('<object name="pawn-%d" x="%d" y="%d" width="%d" '
+                'height="%d"><properties><property name="initiative" '
+                'value="%d"/></properties></object>' % (i, (i % size) * tile,
+                    (i // size) * tile, tile, tile, i % 30))
+    return ('<?xml version="1.0" encoding="UTF-8"?>'
+            '<map version="1.0" orientation="orthogonal" width="%d" '
+            'height="%d" tilewidth="%d" tileheight="%d">'
+            '<layer name="bg" width="%d" height="%d">'
+            '<data encoding="base64" compression="zlib">%s</data></layer>'
+            '<objectgroup name="pawns" width="%d" height="%d">%s'
+            '</objectgroup></map>' % (size, size, tile, tile, size, size,
+                data, size, size, ''.join(pawns)))
+
+
+def run(quick=False):
+    ''' Run the benchmarks of the tmx wrapper '''
+    size = 100 if quick else 500
+    num_pawns = 200 if quick else 2000
+    tmx = make_tmx(size, num_pawns)
+    wrapper = TmxWrapper()
+
+    def load():
+        wrapper.load_board_from_tmx('bench', tmx)
+        # Drop the events posted by the wrapper
+        _QUEUE.clear()
+
+    def dump():
+        wrapper.get_tmx_board('bench')
+
+    results = {}
+    results['tmx-load'] = dict(bytes=len(tmx), pawns=num_pawns,
+            seconds=best_of(load))
+    results['tmx-serialize'] = dict(bytes=len(tmx), pawns=num_pawns,
+            seconds=best_of(dump))
+    # The same board in a binary file, opened and loaded without the tmx
+    folder = tempfile.mkdtemp()
+    try:
+        path = os.path.join(folder, 'bench' + binboard.SUFFIX)
+        binboard.write_boards(path, [('bench', tmx)])
+
+        def load_binary():
+            board_file = binboard.BinBoardFile(path)
+            wrapper.load_board_from_binboard(board_file.get('bench'))
+            _QUEUE.clear()
+
+        results['binboard-load'] = dict(bytes=os.path.getsize(path),
+                pawns=num_pawns, seconds=best_of(load_binary))
+    finally:
+        shutil.rmtree(folder)
+    return results
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+#
+# benchmarks/run.py
+#
+# Copyright (c) 2012 Marco Scopesi <marco.scopesi@gmail.com>
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+''' Run the benchmarks and print the results as JSON.
+
+Usage: benchmarks/run.py [--quick] [--only NAME] [--output FILE]
+                         [--compare BASELINE]
+
+'''
+
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+
+if __name__ == '__main__':
+    sys.path.insert(0, os.path.dirname(os.path.dirname(
+                    os.path.abspath(__file__))))
+
+from benchmarks import bench_events, bench_grid, bench_tmx, bench_network
+
+
+BENCHMARKS = (
+    ('events', bench_events),
+    ('grid', bench_grid),
+    ('tmx', bench_tmx),
+    ('network', bench_network),
+)
+
+
+def _compare(results, baseline):
+    ''' Print the ratio between the timings of two runs '''
+    for name, result in sorted(results['results'].iteritems()):
+        old = baseline['results'].get(name)
+        if not old:
+            continue
+        for key in ('seconds', 'p50', 'p99'):
+            if key in result and key in old and old[key]:
+                print >> sys.stderr, '%-30s %-8s %10.4f -> %10.4f (%+.1f%%)' % (
+                        name, key, old[key], result[key],
+                        (result[key] / old[key] - 1) * 100)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Yaranullin benchmarks')
+    parser.add_argument('--quick', action='store_true',
+                        help='Run smaller benchmarks')
+    parser.add_argument('--only', action='append', default=[],
+                        choices=[name for name, _ in BENCHMARKS],
+                        help='Run only the given benchmarks')
+    parser.add_argument('--output', '-o', action='store',
+                        help='Write the results to a file')
+    parser.add_argument('--compare', action='store',
+                        help='Compare the results with a previous run')
+    args = parser.parse_args()
+    results = dict(time=time.time(), python=platform.python_version(),
+            platform=platform.platform(), quick=args.quick, results={})
+    for name, module in BENCHMARKS:
+        if args.only and name not in args.only:
+            continue
+        print >> sys.stderr, 'Running %s benchmarks...' % name
+        results['results'].update(module.run(args.quick))
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as out:
+            out.write(output)
+    else:
+        print output
+    if args.compare:
+        with open(args.compare) as baseline:
+            _compare(results, json.load(baseline))
+
+
+if __name__ == '__main__':
+    main()
@@ -15,8 +15,16 @@
 # OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
 
 import os
+import time
+import Queue
+import base64
+import tempfile
+import threading
+import logging
 
-from yaranullin.config import YR_CACHE_DIR
+LOGGER = logging.getLogger(__name__)
+
+from yaranullin.config import CONFIG, YR_CACHE_DIR
 from yaranullin.event_system import connect, post
 
 
@@ -25,43 +33,349 @@ from yaranullin.event_system import connect, post
 #
 _CACHE = {}
 
+# Suffix of the resources that are still being received
+PARTIAL_SUFFIX = '.part'
+
+
+def _cache_path(resource_name):
+    ''' Return the path of a resource, or None if it is outside the cache '''
+    folder = os.path.realpath(YR_CACHE_DIR)
+    path = os.path.realpath(os.path.join(folder, resource_name))
+    if not path.startswith(folder + os.sep):
+        return None
+    return path
+
+
+def _partial_path(resource_name):
+    ''' Return the path of the partially received resource '''
+    return os.path.join(YR_CACHE_DIR, resource_name + PARTIAL_SUFFIX)
+
+
+def _partial_size(resource_name):
+    ''' Return the number of bytes already received for a resource '''
+    try:
+        return os.path.getsize(_partial_path(resource_name))
+    except OSError:
+        return 0
+
+
+# Names of the resources requested to the server and not received yet
+_REQUESTED = set()
+
+# Placeholders waiting for a resource, grouped by resource name
+_PENDING = {}
+
+
+class PendingResource(object):
+
+    ''' Placeholder for a resource that is being received
+
+    It is returned by a cached loader in place of a missing resource and it
+    is resolved as soon as the resource arrives from the server.
+
+    '''
+
+    def __init__(self, name):
+        self.name = name
+        self._done = False
+        self._result = None
+        self._callbacks = []
+
+    def done(self):
+        ''' Return True if the resource has arrived '''
+        return self._done
+
+    def result(self):
+        ''' Return the loaded resource or None '''
+        return self._result
+
+    def add_done_callback(self, callback):
+        ''' Call 'callback(pending)' when the resource arrives '''
+        if self._done:
+            callback(self)
+        else:
+            self._callbacks.append(callback)
+
+    def _resolve(self, result):
+        ''' Set the loaded resource and run the callbacks '''
+        self._result = result
+        self._done = True
+        callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+
+def request_resource(resource_name, force=False):
+    ''' Ask the server for a resource, unless it was already requested '''
+    if resource_name in _REQUESTED and not force:
+        return
+    _REQUESTED.add(resource_name)
+    post('resource-request', name=resource_name,
+            offset=_partial_size(resource_name))
+
+
+def prefetch(event_dict):
+    ''' Request every missing resource in the list '''
+    for resource_name in event_dict['names']:
+        if resource_name in _REQUESTED:
+            continue
+        if not os.path.exists(os.path.join(YR_CACHE_DIR, resource_name)):
+            request_resource(resource_name)
+
 
 def cache(loader):
-    ''' Cache decorator '''
+    ''' Cache decorator
+
+    If the resource is missing, the server is asked for it and a
+    PendingResource is returned instead.
+
+    '''
 
     def _cache(resource_name, *args, **kargs):
         if not isinstance(resource_name, basestring):
             raise RuntimeError('cache._cache(): invalid name for a cached '
                     'object')
+        key = hash(loader), resource_name, args, tuple(kargs.items())
+        try:
+            return _CACHE[key]
+        except KeyError:
+            pass
         try:
-            return _CACHE[hash(loader), resource_name, args,
-                tuple(kargs.items())]
+            return _PENDING[resource_name][key][0]
         except KeyError:
+            pass
+        if resource_name not in _REQUESTED:
             try:
                 cached_obj = loader(resource_name, *args, **kargs)
             except IOError as why:
-                if why.errno == 2:
-                    # There is a missing file, ask the server...
-                    post('resource-request', name=resource_name)
-                else:
+                if why.errno != 2:
                     raise
             else:
-                _CACHE[hash(loader), resource_name, args,
-                    tuple(kargs.items())] = cached_obj
+                _CACHE[key] = cached_obj
                 return cached_obj
+        # There is a missing file, ask the server...
+        pending = PendingResource(resource_name)
+        _PENDING.setdefault(resource_name, {})[key] = (pending, loader, args,
+                kargs)
+        request_resource(resource_name)
+        return pending
 
     return _cache
 
 
+def resource_ready(event_dict):
+    ''' Load a received resource and resolve its placeholders '''
+    resource_name = event_dict['name']
+    _REQUESTED.discard(resource_name)
+    waiting = _PENDING.pop(resource_name, {})
+    for key, (pending, loader, args, kargs) in waiting.iteritems():
+        try:
+            cached_obj = loader(resource_name, *args, **kargs)
+        except IOError:
+            LOGGER.exception("Unable to load received resource '%s'",
+                    resource_name)
+            cached_obj = None
+        else:
+            _CACHE[key] = cached_obj
+        pending._resolve(cached_obj)
+
+
+def resource_missing(event_dict):
+    ''' Give up on a resource the server or the disk could not provide
+
+    The placeholders resolve to None and the next lookup asks again.
+
+    '''
+    resource_name = event_dict['name']
+    LOGGER.warning("Resource '%s' is not available", resource_name)
+    _REQUESTED.discard(resource_name)
+    for pending, _, _, _ in _PENDING.pop(resource_name, {}).itervalues():
+        pending._resolve(None)
+
+
+def _replace(source, destination):
+    ''' Rename source to destination, even if it exists '''
+    if os.name == 'nt' and os.path.exists(destination):
+        # os.rename() does not replace files on Windows
+        os.remove(destination)
+    os.rename(source, destination)
+
+
+def write_durably(path, data):
+    ''' Replace the file at path with data, all at once
+
+    The data is written to a temporary file in the same folder and synced
+    to the disk before the temporary file takes the place of the old one, so
+    a crash leaves either the old file or the new one.
+
+    '''
+    folder = os.path.dirname(path)
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+    fd, temp_path = tempfile.mkstemp(dir=folder, suffix='.tmp',
+            prefix='.' + os.path.basename(path))
+    try:
+        with os.fdopen(fd, 'wb') as file_:
+            file_.write(data)
+            file_.flush()
+            os.fsync(file_.fileno())
+        _replace(temp_path, path)
+    except:
+        os.remove(temp_path)
+        raise
+
+
+class CacheWriter(object):
+
+    ''' Write the received resources from a background thread
+
+    At most max_in_flight bytes wait to be written: past that write() blocks
+    the loop, which stops reading from the network until the disk catches
+    up. A single resource bigger than the limit is still accepted when
+    nothing else is waiting. The limit is read from the configuration when
+    the first resource is written, unless it is given.
+
+    '''
+
+    def __init__(self, max_in_flight=None):
+        self.max_in_flight = max_in_flight
+        self._in_flight = 0
+        self._lock = threading.Condition(threading.Lock())
+        self._jobs = Queue.Queue()
+        self._thread = None
+
+    def write(self, resource_name, data):
+        ''' Queue a resource; 'resource-ready' is posted once it is on disk '''
+        if self.max_in_flight is None:
+            self.max_in_flight = CONFIG.getint('cache', 'max-in-flight')
+        with self._lock:
+            while self._in_flight and (self._in_flight + len(data) >
+                    self.max_in_flight):
+                self._lock.wait()
+            self._in_flight += len(data)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._work,
+                        name='cache-writer')
+                self._thread.daemon = True
+                self._thread.start()
+        self._jobs.put((resource_name, data))
+
+    def in_flight(self):
+        ''' Return the number of bytes waiting to be written '''
+        with self._lock:
+            return self._in_flight
+
+    def flush(self, timeout=None):
+        ''' Wait until every queued resource is on disk '''
+        deadline = None if timeout is None else time.time() + timeout
+        with self._lock:
+            while self._in_flight:
+                if deadline is None:
+                    self._lock.wait()
+                    continue
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self._lock.wait(remaining)
+            return not self._in_flight
+
+    def _work(self):
+        ''' Write the queued resources (writer thread) '''
+        while True:
+            resource_name, data = self._jobs.get()
+            try:
+                write_durably(os.path.join(YR_CACHE_DIR, resource_name), data)
+            except (IOError, OSError):
+                LOGGER.exception("Unable to write resource '%s' to the cache",
+                        resource_name)
+                post('resource-missing', name=resource_name)
+            else:
+                LOGGER.debug("Wrote resource '%s' to the cache",
+                        resource_name)
+                # Posted from this thread, it reaches the loop thread
+                # through the ingress queue of the bus
+                post('resource-ready', name=resource_name)
+            finally:
+                with self._lock:
+                    self._in_flight -= len(data)
+                    self._lock.notify_all()
+
+
+_WRITER = CacheWriter()
+
+
 def update_cache(event_dict):
     ''' Update the cache '''
-    resource_name = event_dict['name']
+    if _cache_path(event_dict['name']) is None:
+        LOGGER.warning("Refusing resource '%s' outside the cache",
+                event_dict['name'])
+        return
     resource = event_dict['resource']
-    with open(os.path.join(YR_CACHE_DIR, resource_name), 'w') as file_:
-        file_.write(resource)
+    if isinstance(resource, unicode):
+        # Decoded from json
+        resource = resource.encode('utf-8')
+    _WRITER.write(event_dict['name'], resource)
+
+
+def write_chunk(event_dict):
+    ''' Write a chunk of a resource straight to the disk '''
+    resource_name = event_dict['name']
+    offset = event_dict['offset']
+    size = event_dict['size']
+    path = _cache_path(resource_name)
+    if path is None:
+        LOGGER.warning("Refusing resource '%s' outside the cache",
+                resource_name)
+        return
+    data = base64.b64decode(event_dict['data'])
+    partial = path + PARTIAL_SUFFIX
+    complete = offset + len(data) >= size
+    try:
+        folder = os.path.dirname(partial)
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        mode = 'r+b' if os.path.exists(partial) else 'wb'
+        with open(partial, mode) as file_:
+            file_.seek(offset)
+            file_.write(data)
+            if complete:
+                # Drop the leftovers of an older, longer version
+                file_.truncate(size)
+                # The resource is announced only once it is on the disk
+                file_.flush()
+                os.fsync(file_.fileno())
+        if complete:
+            _replace(partial, path)
+    except (IOError, OSError):
+        LOGGER.exception("Unable to write resource '%s' to the cache",
+                resource_name)
+        post('resource-missing', name=resource_name)
+        return
+    if complete:
+        LOGGER.debug("Received resource '%s'", resource_name)
+        post('resource-ready', name=resource_name)
+
+
+def resume_transfers():
+    ''' Request the rest of every partially received resource '''
+    for dirpath, _, fnames in os.walk(YR_CACHE_DIR):
+        for fname in fnames:
+            if fname.endswith(PARTIAL_SUFFIX):
+                path = os.path.join(dirpath, fname)[:-len(PARTIAL_SUFFIX)]
+                request_resource(os.path.relpath(path, YR_CACHE_DIR),
+                        force=True)
 
 #
 # As soon as this module is imported, 'update_cache' is connected to
-# the 'resource-update' event.
+# the 'resource-update' event and 'write_chunk' to 'resource-chunk'.
+# Interrupted transfers are resumed every time we join a server and
+# the resources that cannot be received are given up.
 #
+# Writing to the disk must not stall the loop: the resources are written
+# by the cache writer and the chunks by the worker pool
 connect('resource-update', update_cache)
+connect('resource-chunk', write_chunk, offload=True)
+connect('resource-ready', resource_ready)
+connect('resource-missing', resource_missing)
+connect('resource-prefetch', prefetch)
+connect('join', resume_transfers)
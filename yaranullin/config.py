@@ -14,7 +14,13 @@
 # ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
 # OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
 
-"""Global configuration."""
+"""Global configuration.
+
+Importing this module only computes some paths. The configuration files
+are parsed the first time an option is read, and the folders of Yaranullin
+are created by create_dirs().
+
+"""
 
 import os
 import sys
@@ -45,11 +51,16 @@ else:
 YR_FONT_DIR = os.path.join(YR_DIR, 'fonts')
 YR_CACHE_DIR = os.path.join(YR_DIR, 'cache')
 YR_SAVE_DIR = os.path.join(YR_DIR, 'saves')
-for folder in (YR_FONT_DIR, YR_CACHE_DIR, YR_SAVE_DIR):
-    try:
-        os.makedirs(folder)
-    except OSError:
-        pass
+
+
+def create_dirs():
+    ''' Create the folders of Yaranullin if they are missing '''
+    for folder in (YR_FONT_DIR, YR_CACHE_DIR, YR_SAVE_DIR):
+        try:
+            os.makedirs(folder)
+        except OSError:
+            pass
+
 
 # Installed config file.
 MAIN_CONFIG_FILE = os.path.join(sys.prefix, 'share', 'yaranullin',
@@ -59,24 +70,87 @@ if not os.path.exists(MAIN_CONFIG_FILE):
     MAIN_CONFIG_FILE = os.path.join(os.path.split(
                        os.path.dirname(__file__))[0], 'data', 'yaranullin.ini')
 
-# Create a global configuration object and use args to update configuration
-CONFIG = ConfigParser.RawConfigParser(allow_no_value=True)
+# User provided config file
+USER_CONFIG_FILE = os.path.join(YR_DIR, 'yaranullin.ini')
 
-# Try to load main config file, exit on fail
-try:
-    CONFIG.readfp(open(MAIN_CONFIG_FILE))
-except IOError as why:
-    if why.errno == 2:
-        sys.exit("Unable to find main configuration file")
-    raise
-except ConfigParser.Error:
-    sys.exit('Unable to parse main configuration file')
 
+class Config(object):
+
+    ''' Read only access to the parsed configuration files '''
+
+    def __init__(self, parser):
+        self._parser = parser
+        self._cache = {}
+
+    def _get(self, method, section, option):
+        key = method, section, option
+        try:
+            return self._cache[key]
+        except KeyError:
+            value = getattr(self._parser, method)(section, option)
+            self._cache[key] = value
+            return value
+
+    def get(self, section, option):
+        return self._get('get', section, option)
+
+    def getint(self, section, option):
+        return self._get('getint', section, option)
+
+    def getfloat(self, section, option):
+        return self._get('getfloat', section, option)
+
+    def getboolean(self, section, option):
+        return self._get('getboolean', section, option)
+
+    def has_option(self, section, option):
+        return self._parser.has_option(section, option)
+
+    def sections(self):
+        return self._parser.sections()
+
+    def items(self, section):
+        return self._parser.items(section)
+
+
+def _parse():
+    ''' Parse the main and the user config files '''
+    parser = ConfigParser.RawConfigParser(allow_no_value=True)
+    # Try to load main config file, exit on fail
+    try:
+        parser.readfp(open(MAIN_CONFIG_FILE))
+    except IOError as why:
+        if why.errno == 2:
+            sys.exit("Unable to find main configuration file")
+        raise
+    except ConfigParser.Error:
+        sys.exit('Unable to parse main configuration file')
+    # Update the configuration with the user provided config file
+    parser.read(USER_CONFIG_FILE)
+    return Config(parser)
+
+
+_CONFIG = None
+
+
+def get_config():
+    ''' Return the configuration, parsing the files the first time '''
+    global _CONFIG
+    if _CONFIG is None:
+        _CONFIG = _parse()
+    return _CONFIG
+
+
+class _LazyConfig(object):
+
+    ''' Stand for the configuration until an option is read '''
+
+    def __getattr__(self, name):
+        return getattr(get_config(), name)
+
+
+CONFIG = _LazyConfig()
 
-# User provided config file
-USER_CONFIG_FILE = os.path.join(YR_DIR, 'yaranullin.ini')
-# Update CONFIG
-CONFIG.read(USER_CONFIG_FILE)
 
 # Log files
 LOG_FILE_CLIENT = os.path.join(YR_DIR, 'client.log')
@@ -18,11 +18,29 @@
 
 This module is a simple implementation of an event pattern.
 
+Events are queued by priority class: a queued event of higher priority is
+always processed before one of lower priority, while events of the same
+class keep their order. The changes of a game never overtake the queued
+changes of the same pawn or board, whatever their class. Some events
+supersede the queued events of the same kind (e.g. a new mouse motion or a
+new position of the same pawn), so they are coalesced with them instead of
+being appended.
+
+Any thread can post events on a bus. The events posted by a thread other
+than the one processing the queue wait in a separate ingress queue and are
+moved to the event queue by the loop thread, which a pipe can wake up.
+Handlers connected with 'offload' run in a pool of worker threads instead of
+the loop thread, and the events they post come back through the ingress.
+
 '''
 
+import os
+import errno
+import thread
+import weakref
 import collections
 import logging
-import inspect
+import time
 
 LOGGER = logging.getLogger(__name__)
 
@@ -33,25 +51,460 @@ LOGGER = logging.getLogger(__name__)
 from yaranullin.weakcallback import WeakCallback
 
 
-_QUEUE = collections.deque()
-_EVENTS = collections.defaultdict(set)
+# Priority classes
+HIGH, NORMAL, LOW = range(3)
 
+# Interactive requests go first, bulk loads last
+_PRIORITIES = {
+    'quit': HIGH,
+    'game-request-pawn-move': HIGH,
+    'game-request-pawn-next': HIGH,
+    'mouse-motion': LOW,
+    'mouse-drag-left': LOW,
+    'game-request-pawn-new': LOW,
+    'resource-chunk': LOW,
+    'game-request-tile-chunks': LOW,
+}
 
-def connect(event, callback, events=None):
-    ''' Connect a callback to an event '''
-    if events is None:
-        events = _EVENTS
+# The changes of a game depend on each other (a pawn is moved after it is
+# created), so they keep their order whatever their priority. The board
+# and pawn an event changes, as the names of the attributes holding them: an
+# event waits behind the queued events changing the same pawn or its board,
+# and an event changing a whole board behind every event on that board.
+_ORDER = {
+    'game-request-board-new': ('name',),
+    'game-request-board-del': ('name',),
+    'game-request-pawn-new': ('bname', 'pname'),
+    'game-request-pawn-del': ('bname', 'pname'),
+    'game-request-pawn-move': ('bname', 'pname'),
+    'game-request-pawn-next': ('bname',),
+    'game-request-pawn-spawn': ('bname',),
+    'game-request-undo': ('bname',),
+    'game-request-redo': ('bname',),
+    'game-event-board-new': ('name',),
+    'game-event-board-del': ('name',),
+    'game-event-pawn-new': ('bname', 'pname'),
+    'game-event-pawn-del': ('bname', 'pname'),
+    'game-event-pawn-moved': ('bname', 'pname'),
+}
+
+def _sum_rel(queued, event_dict):
+    ''' Merge two motion events adding their relative movements '''
+    merged = dict(event_dict)
+    merged['rel'] = (queued['rel'][0] + event_dict['rel'][0],
+            queued['rel'][1] + event_dict['rel'][1])
+    return merged
+
+
+def _same_pawn(event_dict):
+    ''' Coalesce the events about the same pawn '''
+    return event_dict['bname'], event_dict['pname']
+
+
+# Events superseding the queued events of the same kind and with the same
+# key, as a tuple (key function, merge function). If the merge function is
+# None the new event simply replaces the queued one.
+_COALESCE = {
+    'tick': (lambda event_dict: None, None),
+    'mouse-motion': (lambda event_dict: None, _sum_rel),
+    'mouse-drag-left': (lambda event_dict: None, _sum_rel),
+    'game-event-pawn-moved': (_same_pawn, None),
+}
+
+
+class EventQueue(object):
+
+    ''' A queue of events with a deque for every priority class '''
+
+    def __init__(self, priorities=None, coalesce=None, order=None):
+        if priorities is None:
+            priorities = _PRIORITIES
+        if coalesce is None:
+            coalesce = _COALESCE
+        if order is None:
+            order = _ORDER
+        self.priorities = priorities
+        self.coalesce = coalesce
+        self.order = order
+        # The queued events are kept as [seq, priority, path, event_dict]
+        self._deques = (collections.deque(), collections.deque(),
+                collections.deque())
+        self._seq = 0
+        # Queued events that can be coalesced, by event and key
+        self._pending = {}
+        # How many queued events, by priority, change a path or are within
+        # it, and the last one queued for a path
+        self._exact = {}
+        self._within = {}
+        self._latest = {}
+
+    def _get_key(self, event_dict):
+        ''' Return the coalescing key of an event or None '''
+        event = event_dict['event']
+        try:
+            key_func = self.coalesce[event][0]
+            return event, key_func(event_dict)
+        except KeyError:
+            return None
+
+    def _get_path(self, event_dict):
+        ''' Return the board and pawn changed by an event or None '''
+        try:
+            names = self.order[event_dict['event']]
+        except KeyError:
+            return None
+        return tuple(event_dict.get(name) for name in names)
+
+    def _count(self, entry, step):
+        ''' Add step to the counters of the path of a queued event '''
+        priority, path = entry[1], entry[2]
+        counters = [(self._exact, path)]
+        counters.extend((self._within, path[:index])
+                for index in range(1, len(path) + 1))
+        for table, key in counters:
+            counts = table.setdefault(key, [0, 0, 0])
+            counts[priority] += step
+            if not any(counts):
+                del table[key]
+
+    def _lowest(self, path, priority):
+        ''' Return the priority an event must take to keep its order '''
+        # Behind the events within the path and those changing a parent
+        behind = [self._within.get(path)]
+        behind.extend(self._exact.get(path[:index])
+                for index in range(1, len(path)))
+        for counts in behind:
+            if counts is not None:
+                for lower in range(LOW, priority, -1):
+                    if counts[lower]:
+                        priority = lower
+                        break
+        return priority
+
+    def _is_last(self, entry):
+        ''' Tell if nothing changing the same path was queued after entry '''
+        path = entry[2]
+        if path is None:
+            return True
+        for index in range(1, len(path) + 1):
+            if self._latest.get(path[:index], (-1,))[0] > entry[0]:
+                return False
+        return True
+
+    def _remove(self, entry):
+        ''' Remove a queued event '''
+        deque_ = self._deques[entry[1]]
+        for index, queued in enumerate(deque_):
+            if queued is entry:
+                del deque_[index]
+                break
+        self._forget(entry)
+
+    def _forget(self, entry):
+        ''' Forget an event no longer queued '''
+        if entry[2] is not None:
+            self._count(entry, -1)
+            if self._latest.get(entry[2]) is entry:
+                del self._latest[entry[2]]
+
+    def append(self, event_dict):
+        ''' Queue an event or coalesce it with a queued one '''
+        key = self._get_key(event_dict)
+        if key is not None:
+            queued = self._pending.get(key)
+            if queued is not None:
+                merge = self.coalesce[key[0]][1]
+                if merge is not None:
+                    event_dict = merge(queued[3], event_dict)
+                if self._is_last(queued):
+                    # Keep the position of the queued event
+                    queued[3].clear()
+                    queued[3].update(event_dict)
+                    return
+                # Something else changed the same pawn in between: the
+                # queued event is stale and the new one goes after
+                self._remove(queued)
+        priority = self.priorities.get(event_dict['event'], NORMAL)
+        path = self._get_path(event_dict)
+        if path is not None:
+            priority = self._lowest(path, priority)
+        entry = [self._seq, priority, path, event_dict]
+        self._seq += 1
+        if path is not None:
+            self._count(entry, 1)
+            self._latest[path] = entry
+        if key is not None:
+            self._pending[key] = entry
+        self._deques[priority].append(entry)
+
+    def popleft(self):
+        ''' Remove and return the next event '''
+        for deque_ in self._deques:
+            if deque_:
+                entry = deque_.popleft()
+                event_dict = entry[3]
+                self._forget(entry)
+                if self._pending:
+                    key = self._get_key(event_dict)
+                    if key is not None and self._pending.get(key) is entry:
+                        del self._pending[key]
+                return event_dict
+        raise IndexError('pop from an empty queue')
+
+    def clear(self):
+        ''' Remove all events '''
+        for deque_ in self._deques:
+            deque_.clear()
+        self._pending.clear()
+        self._exact.clear()
+        self._within.clear()
+        self._latest.clear()
+
+    def __len__(self):
+        return sum(len(deque_) for deque_ in self._deques)
+
+    def __nonzero__(self):
+        return any(self._deques)
+
+    def __iter__(self):
+        for deque_ in self._deques:
+            for entry in deque_:
+                yield entry[3]
+
+
+class Wakeup(object):
+
+    ''' A pipe waking up the loop thread when another thread posts '''
+
+    def __init__(self):
+        self._read_fd, self._write_fd = os.pipe()
+        for fd in (self._read_fd, self._write_fd):
+            _set_nonblocking(fd)
+        self._notified = False
+
+    def fileno(self):
+        ''' Return the file descriptor to wait on '''
+        return self._read_fd
+
+    def notify(self):
+        ''' Make the file descriptor readable '''
+        if self._notified:
+            return
+        self._notified = True
+        try:
+            os.write(self._write_fd, 'x')
+        except OSError as why:
+            # A full pipe is already readable
+            if why.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise
+
+    def drain(self):
+        ''' Consume the notifications '''
+        self._notified = False
+        try:
+            while os.read(self._read_fd, 4096):
+                pass
+        except OSError as why:
+            if why.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise
+
+    def close(self):
+        ''' Close the pipe '''
+        os.close(self._read_fd)
+        os.close(self._write_fd)
+
+
+def _set_nonblocking(fd):
+    # Imported here: there is no fcntl on Windows
+    import fcntl
+    flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+    fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+
+class EventBus(object):
+
+    ''' A queue of events and the callbacks connected to them
+
+    Every game hosted by a process has its own bus. The functions of this
+    module work on the default bus.
+
+    '''
+
+    def __init__(self, name=None, queue=None, events=None):
+        if queue is None:
+            queue = EventQueue()
+        if events is None:
+            events = collections.defaultdict(set)
+        self.name = name
+        self.queue = queue
+        self.events = events
+        # When not None, an object collecting statistics about the events
+        # (see yaranullin.profiling.EventProfiler)
+        self.profiler = None
+        # The thread processing the queue; the events posted by the other
+        # threads wait in the ingress queue
+        self._owner = thread.get_ident()
+        self._ingress = collections.deque()
+        self.wakeup = None
+        # Handlers run by the worker pool (see yaranullin.workers); they
+        # are forgotten when they are no longer connected
+        self.offloaded = weakref.WeakSet()
+        self.pool = None
+
+    def connect(self, event, callback, offload=False):
+        ''' Connect a callback to an event
+
+        With 'offload' the callback runs in the worker pool of the bus, if it
+        has one.
+
+        '''
+        wrapper = _connect(event, callback, self.events)
+        if offload:
+            self.offloaded.add(wrapper)
+
+    def disconnect(self, event=None, callback=None):
+        ''' Disconnect callbacks '''
+        _disconnect_all(event, callback, self.events)
+
+    def post(self, event, attributes=None, **kattributes):
+        ''' Post an event, from any thread '''
+        if thread.get_ident() == self._owner:
+            return _post(event, attributes, kattributes, self.queue,
+                    self.profiler)
+        event_dict = _make_event(event, attributes, kattributes)
+        # deque.append() is atomic
+        self._ingress.append(event_dict)
+        if self.wakeup is not None:
+            self.wakeup.notify()
+        return event_dict['id']
+
+    def enable_wakeup(self):
+        ''' Return a Wakeup notified when another thread posts an event '''
+        if self.wakeup is None:
+            self.wakeup = Wakeup()
+        return self.wakeup
+
+    def _drain_ingress(self):
+        ''' Move the events posted by the other threads to the queue '''
+        if self.wakeup is not None:
+            self.wakeup.drain()
+        ingress = self._ingress
+        queue = self.queue
+        profiler = self.profiler
+        while ingress:
+            event_dict = ingress.popleft()
+            if profiler is None:
+                queue.append(event_dict)
+            else:
+                depth = len(queue)
+                profiler.posting(event_dict)
+                queue.append(event_dict)
+                profiler.posted(event_dict, len(queue) > depth, len(queue))
+
+    def process_queue(self, budget=None):
+        ''' Consume the event queue and call all handlers
+
+        The calling thread becomes the loop thread of the bus.
+
+        '''
+        self._owner = thread.get_ident()
+        if self._ingress:
+            self._drain_ingress()
+        return _process_queue(self.queue, self.events, budget,
+                self.profiler, self.offloaded, self.pool)
+
+
+_BUS = EventBus('default')
+_QUEUE = _BUS.queue
+_EVENTS = _BUS.events
+
+
+def default_bus():
+    ''' Return the bus used by the functions of this module '''
+    return _BUS
+
+
+def get_bus(bus=None):
+    ''' Return bus, or the default bus if it is None '''
+    if bus is None:
+        return _BUS
+    return bus
+
+
+def enable_profiling(profiler, bus=None):
+    ''' Report posted and processed events to 'profiler' '''
+    get_bus(bus).profiler = profiler
+
+
+def disable_profiling(bus=None):
+    ''' Stop collecting statistics about the events '''
+    get_bus(bus).profiler = None
+
+
+def enable_offload(workers=4, max_pending=256, bus=None, pool=None):
+    ''' Run the offloaded handlers of a bus in a pool of threads
+
+    Many buses can share the threads of the same 'pool'; disabling the
+    offload of any of them stops it.
+
+    '''
+    from yaranullin.workers import WorkerPool
+    bus = get_bus(bus)
+    if bus.pool is None:
+        if pool is None:
+            pool = WorkerPool(workers, max_pending)
+        bus.pool = pool
+    return bus.pool
+
+
+def disable_offload(bus=None):
+    ''' Run the offloaded handlers on the loop thread again '''
+    bus = get_bus(bus)
+    if bus.pool is not None:
+        bus.pool.close()
+        bus.pool = None
+
+
+def set_priority(event, priority):
+    ''' Set the priority class of an event '''
+    if priority not in (HIGH, NORMAL, LOW):
+        raise ValueError('event_system.set_priority(): invalid priority')
+    _PRIORITIES[event] = priority
+
+
+def set_coalesce(event, key, merge=None):
+    ''' Let a new event supersede the queued ones with the same key
+
+    'key' returns the key of an event dictionary; 'merge', if given, returns
+    the event dictionary replacing the queued one.
+
+    '''
+    _COALESCE[event] = key, merge
+
+
+def _connect(event, callback, events):
     if not isinstance(event, basestring):
         raise RuntimeError('event_system.connect(): invalid event type')
     wrapper = WeakCallback(callback)
     LOGGER.debug("Connecting callback %s with event '%s'", repr(callback),
         event)
     events[event].add(wrapper)
+    # Dead callbacks are removed as soon as their owner is collected
+    wrapper.track(events[event])
+    return wrapper
+
+
+def connect(event, callback, events=None, offload=False):
+    ''' Connect a callback to an event '''
+    if events is None:
+        _BUS.connect(event, callback, offload)
+    else:
+        _connect(event, callback, events)
 
 
 def _disconnect(event, callback, events=None):
     ''' Disconnect a callback from an event '''
-    if events in None:
+    if events is None:
         events = _EVENTS
     wrapper = WeakCallback(callback)
     if wrapper in events[event]:
@@ -63,10 +516,7 @@ def _disconnect(event, callback, events=None):
                 repr(callback), event)
 
 
-def disconnect(event=None, callback=None, events=None):
-    ''' Disconnect callbacks '''
-    if events is None:
-        events = _EVENTS
+def _disconnect_all(event, callback, events):
     if callback is None and event is None:
         # Remove all callbacks
         LOGGER.debug("Disconnecting all callbacks")
@@ -81,23 +531,19 @@ def disconnect(event=None, callback=None, events=None):
     elif event in events:
         # Delete all callbacks connected to an event
         LOGGER.debug("Disconnecting all callbacks from event '%s'", event)
-        events.remove(event)
+        del events[event]
 
 
-def post(event, attributes=None, queue=None, events=None, **kattributes):
-    ''' Post an event '''
-    if queue is None:
-        queue = _QUEUE
+def disconnect(event=None, callback=None, events=None):
+    ''' Disconnect callbacks '''
     if events is None:
         events = _EVENTS
+    _disconnect_all(event, callback, events)
+
+
+def _make_event(event, attributes, kattributes):
     if not isinstance(event, basestring):
         raise RuntimeError('event_system.post(): invalid event type')
-    #if not events[event] and not events['any']:
-        #if event != 'tick':
-            #LOGGER.debug("No callback connected to event '%s': dropping...",
-                    #event)
-        #if event != 'quit':
-            #return
     event_dict = dict(kattributes)
     if attributes is not None:
         try:
@@ -111,55 +557,81 @@ def post(event, attributes=None, queue=None, events=None, **kattributes):
     event_dict['id'] = id_
     # Add a special attribute with the type of the event
     event_dict['event'] = event
-    queue.append(event_dict)
-    if event != 'tick':
+    return event_dict
+
+
+def _post(event, attributes, kattributes, queue, profiler):
+    event_dict = _make_event(event, attributes, kattributes)
+    id_ = event_dict['id']
+    if profiler is None:
+        queue.append(event_dict)
+    else:
+        depth = len(queue)
+        profiler.posting(event_dict)
+        queue.append(event_dict)
+        profiler.posted(event_dict, len(queue) > depth, len(queue))
+    if event != 'tick' and LOGGER.isEnabledFor(logging.DEBUG):
         LOGGER.debug("Appended event '%s' to the queue, with args %s", event,
                 repr(event_dict))
     return id_
 
 
-def process_queue(queue=None, events=None):
-    ''' Consume the event queue and call all handlers '''
+def post(event, attributes=None, queue=None, events=None, **kattributes):
+    ''' Post an event '''
     if queue is None:
-        queue = _QUEUE
-    if events is None:
-        events = _EVENTS
+        return _BUS.post(event, attributes, **kattributes)
+    return _post(event, attributes, kattributes, queue, _BUS.profiler)
+
+
+def _process_queue(queue, events, budget, profiler, offloaded=(),
+        pool=None):
+    if budget is not None:
+        deadline = time.time() + budget
     stop = False
     garbage = set()
+    # Checking the logging level once per event is much cheaper than
+    # formatting debug messages for every handler
+    is_debug = LOGGER.isEnabledFor(logging.DEBUG)
     while queue:
         event_dict = queue.popleft()
         event = event_dict['event']
+        debug = is_debug and event != 'tick'
         # Find all handler for this event
         handlers = set(events[event])
         handlers |= events['any']
-        if event != 'tick':
+        if debug:
             LOGGER.debug("Calling handlers for event '%s'...", event)
-        for handler_ in handlers:
-            handler = handler_()
-            if handler is None:
-                garbage.add(handler_)
+        if profiler is not None:
+            profiler.dequeued(event_dict)
+            started = time.time()
+        for handler in handlers:
+            if pool is not None and handler in offloaded:
+                # Every handler gets its own copy, the other handlers run
+                # while it is queued
+                pool.submit(handler, dict(event_dict))
                 continue
-            if event != 'tick':
-                LOGGER.debug("Calling callback '%s'...", repr(handler))
-            args, _, _, _ = inspect.getargspec(handler)
-            if inspect.ismethod(handler):
-                len_args = len(args) - 1
+            if debug:
+                LOGGER.debug("Calling callback '%s'...", repr(handler()))
+            if profiler is None:
+                alive = handler.dispatch(event_dict)
             else:
-                len_args = len(args)
-            if len_args == 0:
-                handler()
-            elif len_args == 1:
-                handler(event_dict)
-            else:
-                raise TypeError("Bad number of arguments for callback '%s'" %
-                        repr(handler))
-            if event != 'tick':
-                LOGGER.debug("Calling callback '%s'... done", repr(handler))
-        if event != 'tick':
+                called = time.time()
+                alive = handler.dispatch(event_dict)
+                profiler.handled(event, handler, time.time() - called)
+            if not alive:
+                garbage.add(handler)
+                continue
+            if debug:
+                LOGGER.debug("Calling callback '%s'... done",
+                        repr(handler()))
+        if profiler is not None:
+            profiler.processed(event, time.time() - started)
+        if debug:
             LOGGER.debug("Calling handlers for event '%s'... done", event)
         # Garbage collect every dead WeakCallback
         if garbage:
             events[event] -= garbage
+            events['any'] -= garbage
             # 'garbage.clear()' takes about 80% of the time
             # of 'garbage = set()'
             garbage.clear()
@@ -167,9 +639,27 @@ def process_queue(queue=None, events=None):
         if event == 'quit':
             stop = True
             break
+        if budget is not None and time.time() > deadline:
+            break
     return stop
 
 
+def process_queue(queue=None, events=None, budget=None):
+    ''' Consume the event queue and call all handlers
+
+    If a time budget (in seconds) is given, stop as soon as it is exceeded
+    and leave the remaining events in the queue for the next call.
+
+    '''
+    if queue is None and events is None:
+        return _BUS.process_queue(budget)
+    if queue is None:
+        queue = _QUEUE
+    if events is None:
+        events = _EVENTS
+    return _process_queue(queue, events, budget, _BUS.profiler)
+
+
 def step():
     post('tick')
     stop = process_queue()
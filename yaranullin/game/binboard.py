@@ -0,0 +1,398 @@
+# yaranullin/game/binboard.py
+#
+# Copyright (c) 2012 Marco Scopesi <marco.scopesi@gmail.com>
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+''' Binary files holding many boards, loaded through mmap.
+
+A tmx file must be parsed as a whole before its board can be used. A binary
+board file instead keeps every board in fixed-layout tables, so opening it
+only maps it in memory: the pages of a board are read from the disk when
+the board is loaded, and those of a tile layer when its tiles are needed.
+
+Layout (little endian, offsets from the start of the file):
+
+    file header   magic, version, number of boards
+    board index   offset of the name and of the header of every board
+    board header  width, height, tile width, number of pawns and layers,
+                  offset of the tmx skeleton
+    pawn table    offset of the name, x, y, width, height, initiative
+    layer table   offset of the name, width, height, offset of the GIDs
+    strings       32 bit length followed by the utf-8 bytes
+    GIDs          32 bit unsigned integers, row by row, 4 bytes aligned
+
+The skeleton is the tmx file without the tile data: it keeps tilesets and
+properties, so a board can be turned back into a tmx file.
+
+'''
+
+import os
+import sys
+import mmap
+import array
+import struct
+import collections
+
+from xml.etree import ElementTree
+
+from yaranullin.game.tile_layer import TileLayer, encode_data, _TYPECODE
+
+
+MAGIC = 'YRNBOARD'
+VERSION = 1
+# Suffix of the binary board files
+SUFFIX = '.yrb'
+
+FILE_HEADER = struct.Struct('<8sHHI')
+INDEX_ENTRY = struct.Struct('<II')
+BOARD_HEADER = struct.Struct('<IIIIII')
+PAWN_ENTRY = struct.Struct('<IiiIIi')
+LAYER_ENTRY = struct.Struct('<IIII')
+STRING_LENGTH = struct.Struct('<I')
+GID = struct.Struct('<I')
+
+Pawn = collections.namedtuple('Pawn', 'name pos size initiative')
+
+
+class FormatError(ValueError):
+    ''' Error reading a binary board file '''
+
+
+def _check_bounds(data, offset, size, what):
+    ''' Raise FormatError unless size bytes at offset are inside data '''
+    if offset < 0 or size < 0 or offset + size > len(data):
+        raise FormatError('%s at offset %d (%d bytes) is past the end of '
+                'the file (%d bytes)' % (what, offset, size, len(data)))
+
+
+def _get_object_layer(tmx_map, layer_name):
+    for objectgroup in tmx_map.findall('objectgroup'):
+        if objectgroup.attrib['name'] == layer_name:
+            return objectgroup
+
+
+def _get_initiative(pawn):
+    for prop in pawn.findall('properties/property'):
+        if prop.attrib['name'] == 'initiative':
+            return int(prop.attrib['value'])
+    raise FormatError("Pawn '%s' has no initiative" % pawn.attrib['name'])
+
+
+def board_from_tmx(tmx_string):
+    ''' Return the parts of a tmx board stored in a binary file
+
+    The result is a dictionary with size, tilewidth, pawns (a list of
+    Pawn), layers (a list of (name, size, gids)) and skeleton.
+
+    '''
+    tmx_map = ElementTree.fromstring(tmx_string)
+    tilewidth = int(tmx_map.attrib['tilewidth'])
+    pawns = []
+    pawn_layer = _get_object_layer(tmx_map, 'pawns')
+    if pawn_layer is not None:
+        for pawn in pawn_layer.findall('object'):
+            # The same rounding of the tmx loader
+            size = (max(int(pawn.attrib['width']) // tilewidth, 1),
+                    max(int(pawn.attrib['height']) // tilewidth, 1))
+            pos = (int(pawn.attrib['x']) // tilewidth,
+                    int(pawn.attrib['y']) // tilewidth)
+            pawns.append(Pawn(pawn.attrib['name'], pos, size,
+                _get_initiative(pawn)))
+    layers = []
+    for element in tmx_map.findall('layer'):
+        layer = TileLayer.from_element(element)
+        layers.append((layer.name, layer.size, layer.gids))
+        # The skeleton keeps the attributes but not the tiles
+        data = element.find('data')
+        if data is not None:
+            data.text = None
+            data.attrib.clear()
+    return dict(size=(int(tmx_map.attrib['width']),
+        int(tmx_map.attrib['height'])), tilewidth=tilewidth, pawns=pawns,
+        layers=layers, skeleton=ElementTree.tostring(tmx_map))
+
+
+class _Writer(object):
+
+    ''' Lay out the tables and the strings of a file '''
+
+    def __init__(self):
+        self._parts = []
+        self.offset = 0
+
+    def reserve(self, fmt, count=1):
+        ''' Reserve a table of count entries, return it and its offset '''
+        offset = self.offset
+        table = bytearray(fmt.size * count)
+        self._parts.append(table)
+        self.offset += len(table)
+        return table, offset
+
+    def append(self, data):
+        ''' Append some bytes, return their offset '''
+        offset = self.offset
+        self._parts.append(data)
+        self.offset += len(data)
+        return offset
+
+    def string(self, text):
+        ''' Append a string, return its offset '''
+        if isinstance(text, unicode):
+            text = text.encode('utf-8')
+        return self.append(STRING_LENGTH.pack(len(text)) + text)
+
+    def align(self, size=4):
+        ''' Pad up to a multiple of size '''
+        padding = -self.offset % size
+        if padding:
+            self.append('\x00' * padding)
+
+    def tostring(self):
+        return ''.join(str(part) for part in self._parts)
+
+
+def write_boards(path, boards):
+    ''' Write a binary file with the boards in a list of (name, tmx) '''
+    writer = _Writer()
+    writer.append(FILE_HEADER.pack(MAGIC, VERSION, 0, len(boards)))
+    index, _ = writer.reserve(INDEX_ENTRY, len(boards))
+    for number, (bname, tmx_string) in enumerate(boards):
+        board = board_from_tmx(tmx_string)
+        name = writer.string(bname)
+        writer.align()
+        header, header_offset = writer.reserve(BOARD_HEADER)
+        pawns, _ = writer.reserve(PAWN_ENTRY, len(board['pawns']))
+        layers, _ = writer.reserve(LAYER_ENTRY, len(board['layers']))
+        INDEX_ENTRY.pack_into(index, number * INDEX_ENTRY.size, name,
+                header_offset)
+        BOARD_HEADER.pack_into(header, 0, board['size'][0],
+                board['size'][1], board['tilewidth'], len(board['pawns']),
+                len(board['layers']), writer.string(board['skeleton']))
+        for entry, pawn in enumerate(board['pawns']):
+            PAWN_ENTRY.pack_into(pawns, entry * PAWN_ENTRY.size,
+                    writer.string(pawn.name), pawn.pos[0], pawn.pos[1],
+                    pawn.size[0], pawn.size[1], pawn.initiative)
+        for entry, (lname, size, gids) in enumerate(board['layers']):
+            lname = writer.string(lname)
+            writer.align()
+            if sys.byteorder == 'big':
+                gids = array.array(_TYPECODE, gids)
+                gids.byteswap()
+            data = writer.append(gids.tostring())
+            LAYER_ENTRY.pack_into(layers, entry * LAYER_ENTRY.size, lname,
+                    size[0], size[1], data)
+    with open(path, 'wb') as file_:
+        file_.write(writer.tostring())
+
+
+class MappedLayer(TileLayer):
+
+    ''' A tile layer reading its GIDs straight from a mapped file
+
+    Single tiles and chunks are read from the file; the whole array is
+    copied in memory only if it is needed, e.g. to change it.
+
+    '''
+
+    def __init__(self, name, size, data, offset):
+        TileLayer.__init__(self, name, size)
+        self._data = data
+        self._offset = offset
+
+    @property
+    def gids(self):
+        if self._gids is None:
+            gids = array.array(_TYPECODE)
+            gids.fromstring(self._read(0, self.size[0] * self.size[1]))
+            if sys.byteorder == 'big':
+                gids.byteswap()
+            self._gids = gids
+        return self._gids
+
+    def _read(self, start, count):
+        ''' Return the bytes of count GIDs from the start-th one '''
+        start = self._offset + start * GID.size
+        return self._data[start:start + count * GID.size]
+
+    def get(self, pos):
+        if self._gids is not None:
+            return TileLayer.get(self, pos)
+        return GID.unpack_from(self._data, self._offset + GID.size *
+                (pos[1] * self.size[0] + pos[0]))[0]
+
+    def get_chunk(self, chunk):
+        if self._gids is not None:
+            return TileLayer.get_chunk(self, chunk)
+        pos, size = self._chunk_area(chunk)
+        width = self.size[0]
+        chunk_gids = array.array(_TYPECODE)
+        for y in xrange(pos[1], pos[1] + size[1]):
+            chunk_gids.fromstring(self._read(y * width + pos[0], size[0]))
+        if sys.byteorder == 'big':
+            chunk_gids.byteswap()
+        return pos, size, chunk_gids
+
+
+class BinBoard(object):
+
+    ''' A board of a binary file, read from the file when needed '''
+
+    def __init__(self, data, name, offset):
+        self._data = data
+        self.name = name
+        _check_bounds(data, offset, BOARD_HEADER.size, 'Board header')
+        (width, height, self.tilewidth, self._num_pawns, self._num_layers,
+                self._skeleton) = BOARD_HEADER.unpack_from(data, offset)
+        self.size = width, height
+        self._offset = offset + BOARD_HEADER.size
+        _check_bounds(data, self._offset, self._num_pawns * PAWN_ENTRY.size +
+                self._num_layers * LAYER_ENTRY.size, 'Pawn and layer tables')
+
+    def _string(self, offset):
+        return _read_string(self._data, offset)
+
+    @property
+    def skeleton(self):
+        ''' The tmx string of the board without the tile data '''
+        return self._string(self._skeleton)
+
+    def pawns(self):
+        ''' Return the list of the pawns '''
+        pawns = []
+        for number in xrange(self._num_pawns):
+            (name, x, y, width, height, initiative) = PAWN_ENTRY.unpack_from(
+                    self._data, self._offset + number * PAWN_ENTRY.size)
+            pawns.append(Pawn(self._string(name), (x, y), (width, height),
+                initiative))
+        return pawns
+
+    def layers(self):
+        ''' Return the tile layers, in the order of the tmx file '''
+        layers = []
+        start = self._offset + self._num_pawns * PAWN_ENTRY.size
+        for number in xrange(self._num_layers):
+            name, width, height, data = LAYER_ENTRY.unpack_from(self._data,
+                    start + number * LAYER_ENTRY.size)
+            _check_bounds(self._data, data, width * height * GID.size,
+                    'Tiles of a layer')
+            layers.append(MappedLayer(self._string(name), (width, height),
+                self._data, data))
+        return layers
+
+    def to_tmx(self):
+        ''' Return the tmx string of the board '''
+        tmx_map = ElementTree.fromstring(self.skeleton)
+        fill_tiles(tmx_map, dict((layer.name, layer) for layer in
+            self.layers()))
+        return ElementTree.tostring(tmx_map)
+
+
+def fill_tiles(tmx_map, layers):
+    ''' Write the GIDs of the layers in the empty <data> tags of a map '''
+    for element in tmx_map.findall('layer'):
+        layer = layers.get(element.attrib['name'])
+        data = element.find('data')
+        if layer is None or data is None or data.text:
+            continue
+        data.attrib['encoding'] = 'base64'
+        data.attrib['compression'] = 'zlib'
+        data.text = encode_data(layer.gids)
+
+
+def _read_string(data, offset):
+    _check_bounds(data, offset, STRING_LENGTH.size, 'String')
+    (length, ) = STRING_LENGTH.unpack_from(data, offset)
+    start = offset + STRING_LENGTH.size
+    _check_bounds(data, start, length, 'String')
+    try:
+        return data[start:start + length].decode('utf-8')
+    except UnicodeDecodeError:
+        raise FormatError('String at offset %d is not utf-8' % offset)
+
+
+class BinBoardFile(object):
+
+    ''' A binary board file mapped in memory '''
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as file_:
+            if not os.fstat(file_.fileno()).st_size:
+                # An empty file cannot be mapped
+                raise FormatError("'%s' is empty" % path)
+            self._data = mmap.mmap(file_.fileno(), 0,
+                    access=mmap.ACCESS_READ)
+        try:
+            self._read_index()
+        except FormatError:
+            self._data.close()
+            raise
+
+    def _read_index(self):
+        ''' Check the file header and read the board index '''
+        path = self.path
+        data = self._data
+        if len(data) < FILE_HEADER.size:
+            raise FormatError("'%s' is too short" % path)
+        magic, version, _, count = FILE_HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise FormatError("'%s' is not a board file" % path)
+        if version != VERSION:
+            raise FormatError("'%s' has version %d instead of %d" % (path,
+                version, VERSION))
+        _check_bounds(data, FILE_HEADER.size, count * INDEX_ENTRY.size,
+                'Board index')
+        # Offsets of the board headers, by name
+        self._boards = collections.OrderedDict()
+        for number in xrange(count):
+            name, header = INDEX_ENTRY.unpack_from(data,
+                    FILE_HEADER.size + number * INDEX_ENTRY.size)
+            _check_bounds(data, header, BOARD_HEADER.size, 'Board header')
+            self._boards[_read_string(data, name)] = header
+
+    def names(self):
+        ''' Return the names of the boards '''
+        return self._boards.keys()
+
+    def get(self, name):
+        ''' Return a board '''
+        return BinBoard(self._data, name, self._boards[name])
+
+    def close(self):
+        self._data.close()
+
+
+def run(args):
+    ''' Convert tmx files to a binary file or a binary file to tmx files '''
+    if args.output.endswith(SUFFIX):
+        boards = []
+        for path in args.files:
+            with open(path) as tmx_file:
+                boards.append((os.path.splitext(os.path.basename(path))[0],
+                    tmx_file.read()))
+        write_boards(args.output, boards)
+        print "Wrote %d boards to '%s'" % (len(boards), args.output)
+        return
+    if not os.path.isdir(args.output):
+        os.makedirs(args.output)
+    for path in args.files:
+        board_file = BinBoardFile(path)
+        try:
+            for bname in board_file.names():
+                tmx_path = os.path.join(args.output, bname + '.tmx')
+                with open(tmx_path, 'w') as tmx_file:
+                    tmx_file.write(board_file.get(bname).to_tmx())
+                print "Wrote '%s'" % tmx_path
+        finally:
+            board_file.close()
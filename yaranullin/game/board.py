@@ -22,6 +22,8 @@ LOGGER = logging.getLogger(__name__)
 
 from yaranullin.game.cell_content import Pawn
 from yaranullin.game.grid import Grid
+from yaranullin.game.spatial import SpatialIndex
+from yaranullin.game.persistent import PMap, PawnState, BoardState
 
 
 class Board(object):
@@ -33,7 +35,12 @@ class Board(object):
         self.size = size
         self.initiatives = []
         self.pawns = {}
+        # Incremented at every change of the pawns
+        self.revision = 0
+        # State of the pawns shared with the snapshots
+        self._states = PMap()
         self._grid = Grid(size)
+        self._index = SpatialIndex()
         LOGGER.debug("Initialized board '%s' with size (%d, %d)", name,
                 size[0], size[1])
 
@@ -41,13 +48,22 @@ class Board(object):
         ''' Place a pawn on the grid '''
         contents = self._grid.get(pos, size)
         # Add a pawn only if the cells are empty or taken only by this pawn
-        if len(contents) > 1 or pawn not in contents:
+        contents.discard(pawn)
+        if contents:
             raise IndexError
         self._grid.remove(pawn)
         self._grid.add(pawn, pos, size)
+        self._index.add(pawn.name, pos, size)
+        self._states = self._states.set(pawn.name, PawnState(pawn.name,
+            pawn.initiative, tuple(pos), tuple(size)))
+        self.revision += 1
 
     def create_pawn(self, name, initiative, pos, size):
         ''' Create a new Pawn '''
+        if name in self.pawns:
+            LOGGER.warning("Pawn '%s' already exists inside board '%s'", name,
+                self.name)
+            return
         pawn = Pawn(name, initiative, size)
         try:
             self._place_pawn(pawn, pos, size)
@@ -73,10 +89,46 @@ class Board(object):
         else:
             self.initiatives.remove(pawn)
             self._grid.remove(pawn)
+            self._index.remove(name)
+            self._states = self._states.remove(name)
+            self.revision += 1
             LOGGER.info("Removed pawn '%s' from board '%s'", name,
                     self.name)
             return pawn
 
+    def is_free(self, pos, size, pawn=None):
+        ''' Return True if pawn (or anything of that size) fits at pos '''
+        return self._grid.is_free(pos, size, pawn)
+
+    def find_free(self, pos, size, max_distance=None):
+        ''' Return the free position for a pawn of size nearest to pos '''
+        return self._grid.find_free(pos, size, max_distance)
+
+    def spawn_pawns(self, pos, pawns, max_distance=None):
+        ''' Create many pawns as near as possible to pos
+
+        'pawns' is a list of (name, initiative, size). The pawns without a
+        free position within max_distance steps are not created; the others
+        are returned.
+
+        '''
+        created = []
+        for name, initiative, size in pawns:
+            free_pos = self.find_free(pos, size, max_distance)
+            if free_pos is None:
+                LOGGER.warning("No room for pawn '%s' of size (%d, %d) near "
+                        "(%d, %d) within board '%s'", name, size[0], size[1],
+                        pos[0], pos[1], self.name)
+                continue
+            pawn = self.create_pawn(name, initiative, free_pos, size)
+            if pawn:
+                created.append(pawn)
+        return created
+
+    def pawns_in(self, pos, size):
+        ''' Return the pawns overlapping an area '''
+        return [self.pawns[name] for name in self._index.query(pos, size)]
+
     def move_pawn(self, name, pos, size=None):
         ''' Move the pawn 'name' to pos'''
         LOGGER.debug("Moving pawn '%s' to (%d, %d)...", name, pos[0], pos[1])
@@ -96,3 +148,44 @@ class Board(object):
             LOGGER.info("Moved pawn '%s' at pos (%d, %d) within board '%s'",
                     name, pos[0], pos[1], self.name)
             return pawn
+
+    def snapshot(self):
+        ''' Return the state of the board, in constant time '''
+        return BoardState(self.name, self.size, self._states, self.revision)
+
+    def restore(self, state):
+        ''' Bring the pawns back to a snapshot of this board
+
+        Only the pawns changed since the snapshot are touched. Return a
+        dictionary with the old and the new PawnState of every changed pawn
+        (None where the pawn does not exist).
+
+        '''
+        changes = self._states.diff(state.pawns)
+        # Lift all the changed pawns: in the snapshot they do not overlap
+        for pname, (old, new) in changes.iteritems():
+            if old is None:
+                continue
+            pawn = self.pawns[pname]
+            self._grid.remove(pawn)
+            if new is None:
+                del self.pawns[pname]
+                self.initiatives.remove(pawn)
+                self._index.remove(pname)
+        for pname, (old, new) in changes.iteritems():
+            if new is None:
+                continue
+            pawn = self.pawns.get(pname)
+            if pawn is None:
+                pawn = self.pawns[pname] = Pawn(pname, new.initiative,
+                        new.size)
+                self.initiatives.append(pawn)
+            pawn.initiative = new.initiative
+            self._grid.add(pawn, new.pos, new.size)
+            self._index.add(pname, new.pos, new.size)
+        self.initiatives.sort(key=lambda pawn: pawn.initiative, reverse=True)
+        self._states = state.pawns
+        self.revision += 1
+        LOGGER.info("Restored %d pawns of board '%s'", len(changes),
+                self.name)
+        return changes
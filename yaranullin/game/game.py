@@ -65,6 +65,16 @@ class Game(object):
         else:
             return board.move_pawn(pname, pos, size)
 
+    def spawn_pawns(self, bname, pos, pawns, max_distance=None):
+        ''' Add many pawns to a board near pos '''
+        try:
+            board = self.boards[bname]
+        except KeyError:
+            LOGGER.warning("Board '%s' not found", bname)
+            return []
+        else:
+            return board.spawn_pawns(pos, pawns, max_distance)
+
     def del_pawn(self, bname, pname):
         ''' Remove a pawn '''
         try:
@@ -18,46 +18,167 @@ import logging
 
 LOGGER = logging.getLogger(__name__)
 
+from yaranullin.config import CONFIG
 from yaranullin.game.game import Game
-from yaranullin.event_system import post, connect
+from yaranullin.event_system import get_bus
 from yaranullin.game.tmx_wrapper import TmxWrapper, ParseError
+from yaranullin.game.binboard import FormatError
+from yaranullin.game.snapshot import SnapshotService
+from yaranullin.game.tile_layer import CHUNK_SIZE, encode_data
+from yaranullin.game.pathfinding import Pathfinder, CostMap
+from yaranullin.game.visibility import SightService
+from yaranullin.game.persistent import History
 
 
 class GameWrapper(object):
 
-    def __init__(self):
+    def __init__(self, bus=None):
+        self.bus = get_bus(bus)
         self.game = Game()
-        self.tmx_wrapper = TmxWrapper()
-        connect('game-request-board-new', self.create_board)
-        connect('game-request-board-del', self.del_board)
-        connect('game-request-pawn-new', self.create_pawn)
-        connect('game-request-pawn-move', self.move_pawn)
-        connect('game-request-pawn-del', self.del_pawn)
-        connect('game-request-update', self.request_update)
+        self.tmx_wrapper = TmxWrapper(self.bus)
+        self.snapshots = None
+        self._pathfinders = {}
+        self._histories = {}
+        # Maximum steps of the movement ranges asked by the clients
+        self.max_range = CONFIG.getint('game', 'max-range')
+        # Changes of a board that can be undone
+        self.undo_depth = CONFIG.getint('game', 'undo-depth')
+        # Cells a pawn can see around it
+        self.sight = SightService(self.game, self.tmx_wrapper,
+                CONFIG.getint('game', 'sight-radius'), self.bus)
+        self.bus.connect('game-request-board-new', self.create_board)
+        self.bus.connect('game-request-board-del', self.del_board)
+        self.bus.connect('game-request-pawn-new', self.create_pawn)
+        self.bus.connect('game-request-pawn-move', self.move_pawn)
+        self.bus.connect('game-request-pawn-del', self.del_pawn)
+        self.bus.connect('game-request-pawn-spawn', self.spawn_pawns)
+        self.bus.connect('game-request-undo', self.undo)
+        self.bus.connect('game-request-redo', self.redo)
+        self.bus.connect('game-request-update', self.request_update)
+        self.bus.connect('game-request-tile-chunks', self.send_chunks)
+        self.bus.connect('game-request-pawn-range', self.send_range)
+        self.bus.connect('game-request-pawn-path', self.send_path)
         LOGGER.debug("GameWrapper initialized")
 
-    def request_update(self):
-        boards = self._dump_game()
-        post('game-event-update', tmxs=boards)
+    def enable_snapshots(self, interval):
+        ''' Build the tmx strings of the boards in the background '''
+        self.snapshots = SnapshotService(self.tmx_wrapper, interval,
+                self.bus)
 
-    def _dump_game(self):
+    def request_update(self, event_dict):
+        # With lazy_layers the client fetches the tiles in chunks
+        lazy_layers = event_dict.get('lazy_layers', False)
+        boards, moves = self._dump_game(lazy_layers)
+        # If the request comes from a client, the update is sent only to it
+        self.bus.post('game-event-update', tmxs=boards, moves=moves,
+                lazy_layers=lazy_layers, chunk_size=CHUNK_SIZE,
+                client=event_dict.get('client'))
+
+    def send_chunks(self, event_dict):
+        ''' Send some chunks of a tile layer '''
+        bname = event_dict['bname']
+        lname = event_dict['layer']
+        layer = self.tmx_wrapper.get_layer(bname, lname)
+        if layer is None:
+            LOGGER.warning("No layer '%s' in board '%s'", lname, bname)
+            return
+        for chunk in event_dict['chunks']:
+            try:
+                pos, size, gids = layer.get_chunk(chunk)
+            except IndexError:
+                LOGGER.warning("Invalid chunk %r of layer '%s'", chunk,
+                        lname)
+                continue
+            self.bus.post('game-event-tile-chunk', bname=bname, layer=lname,
+                    pos=pos, size=size, data=encode_data(gids),
+                    client=event_dict.get('client'))
+
+    def get_pathfinder(self, bname):
+        ''' Return the pathfinder of a board or None '''
+        try:
+            board = self.game.boards[bname]
+        except KeyError:
+            LOGGER.warning("Board '%s' not found", bname)
+            return
+        pathfinder = self._pathfinders.get(bname)
+        if pathfinder is None or pathfinder.board is not board:
+            costs = None
+            tile_costs = self.tmx_wrapper.get_tile_costs(bname)
+            if tile_costs:
+                costs = CostMap(self.tmx_wrapper.get_layers(bname),
+                        tile_costs)
+            pathfinder = Pathfinder(board, costs)
+            self._pathfinders[bname] = pathfinder
+        return pathfinder
+
+    def _allowance(self, event_dict):
+        ''' Return the steps of a request, at most max_range '''
+        steps = event_dict.get('steps')
+        if steps is None:
+            return self.max_range
+        return min(steps, self.max_range)
+
+    def send_range(self, event_dict):
+        ''' Send the positions a pawn can reach '''
+        bname = event_dict['bname']
+        pname = event_dict['pname']
+        steps = self._allowance(event_dict)
+        pathfinder = self.get_pathfinder(bname)
+        if pathfinder is None:
+            return
+        try:
+            reached = pathfinder.get_range(pname, steps)
+        except KeyError:
+            LOGGER.warning("Pawn '%s' was not in board '%s'", pname, bname)
+            return
+        self.bus.post('game-event-pawn-range', bname=bname, pname=pname,
+                steps=steps, cells=sorted(reached),
+                client=event_dict.get('client'))
+
+    def send_path(self, event_dict):
+        ''' Send the cheapest path of a pawn to a position '''
+        bname = event_dict['bname']
+        pname = event_dict['pname']
+        pos = tuple(event_dict['pos'])
+        pathfinder = self.get_pathfinder(bname)
+        if pathfinder is None:
+            return
+        try:
+            path, cost = pathfinder.find_path(pname, pos,
+                    self._allowance(event_dict))
+        except KeyError:
+            LOGGER.warning("Pawn '%s' was not in board '%s'", pname, bname)
+            return
+        self.bus.post('game-event-pawn-path', bname=bname, pname=pname,
+                pos=pos, path=path, cost=cost,
+                client=event_dict.get('client'))
+
+    def _dump_game(self, lazy_layers=False):
         boards = {}
+        moves = {}
         for name in self.game.boards:
-            board = self.tmx_wrapper.get_tmx_board(name)
+            board = None
+            if self.snapshots is not None:
+                board, board_moves = self.snapshots.get_board(name,
+                        lazy_layers)
+                if board_moves:
+                    moves[name] = board_moves
+            if board is None:
+                board = self.tmx_wrapper.get_tmx_board(name, lazy_layers)
             if board:
                 boards[name] = board
             else:
                 LOGGER.error("Unable to dump board '%s' to a string", name)
-        return boards
+        return boards, moves
 
     def load_from_files(self, files):
-        ''' Load a board and its pawns from a tmx file '''
+        ''' Load the boards and their pawns from tmx or binary files '''
         for tmx in files:
             try:
                 self.tmx_wrapper.load_board_from_file(tmx)
             except IOError:
                 LOGGER.exception("Unable to open file '%s'", tmx)
-            except ParseError:
+            except (ParseError, FormatError):
                 LOGGER.exception("Unable to parse file '%s'", tmx)
             else:
                 LOGGER.info("Loaded board from file '%s'", tmx)
@@ -67,12 +188,15 @@ class GameWrapper(object):
         size = event_dict['size']
         board = self.game.create_board(name, size)
         if board:
-            post('game-event-board-new', event_dict)
+            self._histories[name] = History(board.snapshot(), self.undo_depth)
+            self.bus.post('game-event-board-new', event_dict)
 
     def del_board(self, event_dict):
         board = self.game.del_board(event_dict['name'])
+        self._pathfinders.pop(event_dict['name'], None)
+        self._histories.pop(event_dict['name'], None)
         if board:
-            post('game-event-board-del', event_dict)
+            self.bus.post('game-event-board-del', event_dict)
 
     def create_pawn(self, event_dict):
         bname = event_dict['bname']
@@ -82,7 +206,22 @@ class GameWrapper(object):
         size = event_dict['size']
         pawn = self.game.create_pawn(bname, pname, initiative, pos, size)
         if pawn:
-            post('game-event-pawn-new', event_dict)
+            self._record(bname)
+            self.bus.post('game-event-pawn-new', event_dict)
+
+    def spawn_pawns(self, event_dict):
+        ''' Create many pawns in the free places nearest to a position '''
+        bname = event_dict['bname']
+        pawns = [(pawn['pname'], pawn['initiative'], tuple(pawn['size']))
+                for pawn in event_dict['pawns']]
+        created = self.game.spawn_pawns(bname, tuple(event_dict['pos']),
+                pawns, event_dict.get('max_distance'))
+        if created:
+            self._record(bname)
+        for pawn in created:
+            self.bus.post('game-event-pawn-new', bname=bname,
+                    pname=pawn.name, initiative=pawn.initiative,
+                    pos=pawn.pos, size=pawn.size)
 
     def move_pawn(self, event_dict):
         bname = event_dict['bname']
@@ -92,77 +231,166 @@ class GameWrapper(object):
             size = event_dict['size']
         except KeyError:
             size = None
+        steps = event_dict.get('steps')
+        if event_dict.get('client') is not None:
+            # The server decides how far the pawns of a client can walk
+            steps = self._allowance(event_dict)
+        if steps is not None:
+            # Only a move the pawn can walk, with its new size, is allowed
+            pathfinder = self.get_pathfinder(bname)
+            try:
+                allowed = pathfinder is not None and pathfinder.can_move(
+                        pname, pos, steps, size)
+            except KeyError:
+                allowed = False
+            if not allowed:
+                LOGGER.warning("Pawn '%s' cannot reach (%d, %d) in %d "
+                        "steps within board '%s'", pname, pos[0], pos[1],
+                        steps, bname)
+                return
         pawn = self.game.move_pawn(bname, pname, pos, size)
         if pawn:
-            post('game-event-pawn-moved', event_dict)
+            self._record(bname)
+            # Every client gets the move, not only the one asking for it
+            event_dict = dict(event_dict)
+            event_dict.pop('client', None)
+            self.bus.post('game-event-pawn-moved', event_dict)
 
     def del_pawn(self, event_dict):
         bname = event_dict['bname']
         pname = event_dict['pname']
         pawn = self.game.del_pawn(bname, pname)
         if pawn:
-            post('game-event-pawn-del', event_dict)
+            self._record(bname)
+            self.bus.post('game-event-pawn-del', event_dict)
+
+    def _record(self, bname):
+        ''' Keep a snapshot of a board after a change '''
+        history = self._histories.get(bname)
+        if history is not None:
+            history.record(self.game.boards[bname].snapshot())
+
+    def _restore(self, bname, state):
+        ''' Bring a board back to a snapshot and tell what changed '''
+        changes = self.game.boards[bname].restore(state)
+        for pname, (old, new) in changes.iteritems():
+            if new is None:
+                self.bus.post('game-event-pawn-del', bname=bname,
+                        pname=pname)
+            elif old is None:
+                self.bus.post('game-event-pawn-new', bname=bname,
+                        pname=pname, initiative=new.initiative, pos=new.pos,
+                        size=new.size)
+            else:
+                self.bus.post('game-event-pawn-moved', bname=bname,
+                        pname=pname, pos=new.pos, size=new.size)
+
+    def reset_histories(self):
+        ''' Start the histories from the current boards
+
+        Called once the boards are loaded or restored, so that their
+        loading cannot be undone.
+
+        '''
+        for bname, history in self._histories.iteritems():
+            history.reset(self.game.boards[bname].snapshot())
+
+    def undo(self, event_dict):
+        ''' Undo the last change of a board '''
+        bname = event_dict['bname']
+        history = self._histories.get(bname)
+        state = history.undo() if history is not None else None
+        if state is None:
+            LOGGER.warning("Nothing to undo in board '%s'", bname)
+            return
+        self._restore(bname, state)
+
+    def redo(self, event_dict):
+        ''' Redo the last undone change of a board '''
+        bname = event_dict['bname']
+        history = self._histories.get(bname)
+        state = history.redo() if history is not None else None
+        if state is None:
+            LOGGER.warning("Nothing to redo in board '%s'", bname)
+            return
+        self._restore(bname, state)
 
     def clear(self):
         for bname in self.game.boards:
             self.game.del_board(bname)
-            post('game-event-board-del', name=bname)
+            self.bus.post('game-event-board-del', name=bname)
 
 
 class DummyGameWrapper(object):
 
-    def __init__(self):
+    def __init__(self, bus=None):
+        self.bus = get_bus(bus)
         self.boards = set()
-        self.tmx_wrapper = TmxWrapper()
-        connect('game-event-update', self.update)
-        connect('game-request-board-new', self.create_board)
-        connect('game-request-board-del', self.del_board)
-        connect('game-request-pawn-new', self.create_pawn)
-        connect('game-request-pawn-move', self.move_pawn)
-        connect('game-request-pawn-del', self.del_pawn)
+        self.tmx_wrapper = TmxWrapper(self.bus)
+        self.bus.connect('game-event-update', self.update)
+        self.bus.connect('game-event-tile-chunk', self.set_chunk)
+        self.bus.connect('game-request-board-new', self.create_board)
+        self.bus.connect('game-request-board-del', self.del_board)
+        self.bus.connect('game-request-pawn-new', self.create_pawn)
+        self.bus.connect('game-request-pawn-move', self.move_pawn)
+        self.bus.connect('game-request-pawn-del', self.del_pawn)
 
     def update(self, event_dict):
         self.clear()
         tmxs = event_dict['tmxs']
+        moves = event_dict.get('moves', {})
         for name, tmx_map in tmxs.iteritems():
             try:
-                self.tmx_wrapper.load_board_from_tmx(name, tmx_map)
+                self.tmx_wrapper.load_board_from_tmx(name, tmx_map,
+                        moves.get(name, ()))
             except ParseError:
                 LOGGER.exception("Unable to load board '%s' from tmx string",
                         name)
             else:
                 LOGGER.info("Loaded board '%s' from tmx string", name)
+                resources = self.tmx_wrapper.get_resources(name)
+                if resources:
+                    self.bus.post('resource-prefetch', names=list(resources))
+
+    def set_chunk(self, event_dict):
+        try:
+            self.tmx_wrapper.set_chunk(event_dict['bname'],
+                    event_dict['layer'], event_dict['pos'],
+                    event_dict['size'], event_dict['data'])
+        except (KeyError, IndexError, ValueError):
+            LOGGER.exception("Unable to set a chunk of layer '%s'",
+                    event_dict['layer'])
 
     def create_board(self, event_dict):
         self.boards.add(event_dict['name'])
         LOGGER.info("Created board with name '%s' and size (%d, %d)",
                 event_dict['name'], event_dict['size'][0],
                 event_dict['size'][1])
-        post('game-event-board-new', event_dict)
+        self.bus.post('game-event-board-new', event_dict)
 
     def del_board(self, event_dict):
         self.boards.remove(event_dict['name'])
         LOGGER.info("Deleted board with name '%s'", event_dict['name'])
-        post('game-event-board-del', event_dict)
+        self.bus.post('game-event-board-del', event_dict)
 
     def create_pawn(self, event_dict):
         LOGGER.info("Created pawn '%s' within board '%s'",
                 event_dict['pname'], event_dict['bname'])
-        post('game-event-pawn-new', event_dict)
+        self.bus.post('game-event-pawn-new', event_dict)
 
     def move_pawn(self, event_dict):
         LOGGER.info("Moved pawn '%s' at pos (%d, %d) within board '%s'",
                 event_dict['pname'], event_dict['pos'][0],
                 event_dict['pos'][1], event_dict['bname'])
-        post('game-event-pawn-moved', event_dict)
+        self.bus.post('game-event-pawn-moved', event_dict)
 
     def del_pawn(self, event_dict):
         LOGGER.info("Removed pawn '%s' from board '%s'", event_dict['pname'],
                 event_dict['bname'])
-        post('game-event-pawn-del', event_dict)
+        self.bus.post('game-event-pawn-del', event_dict)
 
     def clear(self):
         for bname in self.boards:
-            post('game-event-board-del', name=bname)
+            self.bus.post('game-event-board-del', name=bname)
         self.boards.clear()
         LOGGER.info("All boards have been deleted")
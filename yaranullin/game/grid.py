@@ -14,11 +14,36 @@
 # ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
 # OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
 
-''' Low level interface to a 2D map object '''
+''' Low level interface to a 2D map object
+
+Besides the contents of every cell, the grid keeps the occupied cells as
+bitsets, one integer per row, so the free places of an area are found with
+a few operations on integers.
+
+'''
 
 import weakref
 
 
+def _mask(first, last):
+    ''' Return an integer with the bits from first to last set '''
+    first = max(first, 0)
+    if first > last:
+        return 0
+    return ((1 << (last - first + 1)) - 1) << first
+
+
+def _fits(free, width):
+    ''' Return the bits x of free such that bits x...x+width-1 are all set '''
+    fits = free
+    span = 1
+    while span < width:
+        step = min(span, width - span)
+        fits &= fits >> step
+        span += step
+    return fits
+
+
 class Grid(object):
 
     ''' Indexed rectangular area '''
@@ -28,12 +53,15 @@ class Grid(object):
         # Use a weakref for content, to avoid keeping alive a dead object
         self._grid = {}
         self._contents = weakref.WeakKeyDictionary()
+        # Occupied cells of every row
+        self._rows = [0] * size[1]
 
     def _get_cells(self, pos, size):
         ''' Iter through cells in the give range '''
         # Check if all cells are within the size of the grid
         max_pos = pos[0] + size[0] - 1, pos[1] + size[1] - 1
-        if max_pos[0] >= self.size[0] or max_pos[1] >= self.size[1]:
+        if (pos[0] < 0 or pos[1] < 0 or max_pos[0] >= self.size[0] or
+                max_pos[1] >= self.size[1]):
             raise IndexError("Range between (%d, %d) and (%d, %d) contains "
                     "cells out of grid" % (pos[0], pos[1], max_pos[0],
                         max_pos[1]))
@@ -46,6 +74,7 @@ class Grid(object):
         ''' Clear the grid '''
         self._grid.clear()
         self._contents.clear()
+        self._rows = [0] * self.size[1]
 
     def get(self, pos, size):
         ''' Get all contents in the given range '''
@@ -55,6 +84,31 @@ class Grid(object):
                 cnts |= set(self._grid[cell])
         return cnts
 
+    def is_free(self, pos, size, ignore=None):
+        ''' Return True if the range is inside the grid and has no content
+
+        The content 'ignore' does not count, so a content can check if it
+        fits somewhere else.
+
+        '''
+        if (pos[0] < 0 or pos[1] < 0 or pos[0] + size[0] > self.size[0] or
+                pos[1] + size[1] > self.size[1]):
+            return False
+        if ignore is None:
+            bits = _mask(pos[0], pos[0] + size[0] - 1)
+            rows = self._rows
+            for pos_y in xrange(pos[1], pos[1] + size[1]):
+                if rows[pos_y] & bits:
+                    return False
+            return True
+        grid = self._grid
+        for pos_x in xrange(pos[0], size[0] + pos[0]):
+            for pos_y in xrange(pos[1], size[1] + pos[1]):
+                cnts = grid.get((pos_x, pos_y))
+                if cnts and (len(cnts) > 1 or ignore not in cnts):
+                    return False
+        return True
+
     def add(self, cnt, pos, size):
         ''' Add content to the cells in the given range '''
         if cnt not in self._contents:
@@ -64,6 +118,9 @@ class Grid(object):
                 self._grid[cell] = weakref.WeakSet()
             self._grid[cell].add(cnt)
             self._contents[cnt].add(cell)
+        bits = _mask(pos[0], pos[0] + size[0] - 1)
+        for pos_y in xrange(pos[1], pos[1] + size[1]):
+            self._rows[pos_y] |= bits
         cnt.pos = pos
         cnt.size = size
 
@@ -76,5 +133,67 @@ class Grid(object):
             # Delete cell if empty
             if not self._grid[cell]:
                 del self._grid[cell]
+                self._rows[cell[1]] &= ~(1 << cell[0])
         del self._contents[cnt]
         cnt.pos = None
+
+    def _free_band(self, pos_y, size):
+        ''' Return the bits x where a content of size fits at (x, pos_y) '''
+        occupied = 0
+        for row in self._rows[pos_y:pos_y + size[1]]:
+            occupied |= row
+        free = ~occupied & _mask(0, self.size[0] - 1)
+        return _fits(free, size[0]) & _mask(0, self.size[0] - size[0])
+
+    def find_free(self, pos, size, max_distance=None):
+        ''' Return the free range of the given size nearest to pos
+
+        Ranges are looked for in rings around pos, so the first one found
+        is at the lowest number of steps (diagonals included); among them
+        the nearest in a straight line wins. Return None if there is no
+        free range within max_distance steps.
+
+        '''
+        width, height = self.size
+        if size[0] > width or size[1] > height:
+            return
+        # Start from the nearest range inside the grid
+        target_x = min(max(pos[0], 0), width - size[0])
+        target_y = min(max(pos[1], 0), height - size[1])
+        if max_distance is None:
+            max_distance = max(width, height)
+        bands = {}
+        for distance in xrange(max_distance + 1):
+            best = None
+            for pos_y in xrange(max(target_y - distance, 0),
+                    min(target_y + distance, height - size[1]) + 1):
+                try:
+                    fits = bands[pos_y]
+                except KeyError:
+                    fits = bands[pos_y] = self._free_band(pos_y, size)
+                if not fits:
+                    continue
+                if abs(pos_y - target_y) == distance:
+                    # A whole side of the ring
+                    fits &= _mask(target_x - distance, target_x + distance)
+                else:
+                    fits &= (_mask(target_x - distance, target_x - distance) |
+                            _mask(target_x + distance, target_x + distance))
+                if not fits:
+                    continue
+                # The nearest places on the left and on the right
+                candidates = []
+                right = fits >> target_x
+                if right:
+                    candidates.append(target_x +
+                            (right & -right).bit_length() - 1)
+                left = fits & _mask(0, target_x)
+                if left:
+                    candidates.append(left.bit_length() - 1)
+                for pos_x in candidates:
+                    score = ((pos_x - target_x) ** 2 + (pos_y - target_y) **
+                            2, pos_y, pos_x)
+                    if best is None or score < best:
+                        best = score
+            if best is not None:
+                return best[2], best[1]
@@ -0,0 +1,258 @@
+# yaranullin/game/journal.py
+#
+# Copyright (c) 2012 Marco Scopesi <marco.scopesi@gmail.com>
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+''' Durable journal of the changes to the game.
+
+Every applied 'game-event-*' is appended to a journal file, one JSON record
+per line. Records are written and synced to disk in groups, at most once
+every commit interval. From time to time the whole state is written to a
+snapshot file and the journal is emptied.
+
+After a crash the state is rebuilt from the last snapshot and the records
+that follow it.
+
+'''
+
+import os
+import json
+import time
+import logging
+
+LOGGER = logging.getLogger(__name__)
+
+from yaranullin.event_system import get_bus
+
+
+SNAPSHOT_FILE = 'snapshot.json'
+JOURNAL_FILE = 'journal.log'
+
+# Events changing the state of the game
+RECORDED_EVENTS = ('game-event-board-new', 'game-event-board-del',
+        'game-event-pawn-new', 'game-event-pawn-moved', 'game-event-pawn-del')
+
+
+def state_from_game(game):
+    ''' Return the state of a Game as a dictionary '''
+    state = {}
+    for bname, board in game.boards.iteritems():
+        state[bname] = board.snapshot().to_dict()
+    return state
+
+
+def apply_record(state, record):
+    ''' Apply a journal record to a state '''
+    event = record['event']
+    if event == 'game-event-board-new':
+        state[record['name']] = dict(size=record['size'], pawns={})
+    elif event == 'game-event-board-del':
+        state.pop(record['name'], None)
+    elif event == 'game-event-pawn-new':
+        board = state.get(record['bname'])
+        if board is not None:
+            board['pawns'][record['pname']] = dict(
+                    initiative=record['initiative'], pos=record['pos'],
+                    size=record['size'])
+    elif event == 'game-event-pawn-moved':
+        try:
+            pawn = state[record['bname']]['pawns'][record['pname']]
+        except KeyError:
+            return
+        pawn['pos'] = record['pos']
+        if record.get('size') is not None:
+            pawn['size'] = record['size']
+    elif event == 'game-event-pawn-del':
+        board = state.get(record['bname'])
+        if board is not None:
+            board['pawns'].pop(record['pname'], None)
+
+
+def _make_record(seq, event_dict):
+    ''' Keep only the attributes needed to replay an event '''
+    event = event_dict['event']
+    if event in ('game-event-board-new', 'game-event-board-del'):
+        keys = ('name', 'size')
+    else:
+        keys = ('bname', 'pname', 'initiative', 'pos', 'size')
+    record = dict((key, event_dict[key]) for key in keys if key in
+            event_dict)
+    record['event'] = event
+    record['seq'] = seq
+    return record
+
+
+class Journal(object):
+
+    ''' Append-only journal of the game with periodic snapshots '''
+
+    def __init__(self, folder, commit_interval=0.5, snapshot_every=10000,
+            bus=None):
+        self.bus = get_bus(bus)
+        self.folder = folder
+        self.commit_interval = commit_interval
+        self.snapshot_every = snapshot_every
+        self.state = {}
+        self.seq = 0
+        self._snapshot_seq = 0
+        self._pending = []
+        self._last_commit = time.time()
+        self._file = None
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+
+    def _path(self, fname):
+        return os.path.join(self.folder, fname)
+
+    def recover(self):
+        ''' Rebuild the state from the snapshot and the journal
+
+        Return True if there was something to recover.
+
+        '''
+        found = False
+        self.state = {}
+        self.seq = self._snapshot_seq = 0
+        try:
+            with open(self._path(SNAPSHOT_FILE)) as snapshot:
+                data = json.load(snapshot)
+        except IOError:
+            pass
+        else:
+            found = True
+            self.state = data['boards']
+            self.seq = self._snapshot_seq = data['seq']
+        replayed = 0
+        try:
+            with open(self._path(JOURNAL_FILE)) as journal:
+                for line in journal:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # A record torn by the crash: nothing follows it
+                        LOGGER.warning("Truncated record in the journal")
+                        break
+                    found = True
+                    if record['seq'] <= self.seq:
+                        # Already in the snapshot
+                        continue
+                    apply_record(self.state, record)
+                    self.seq = record['seq']
+                    replayed += 1
+        except IOError:
+            pass
+        LOGGER.info("Recovered %d boards from the journal (%d records "
+                "replayed)", len(self.state), replayed)
+        return found
+
+    def restore(self, game_wrapper):
+        ''' Bring the game to the recovered state '''
+        game = game_wrapper.game
+        for bname in list(game.boards):
+            if bname not in self.state:
+                game_wrapper.del_board(dict(name=bname))
+        for bname, board_state in self.state.iteritems():
+            if bname not in game.boards:
+                game_wrapper.create_board(dict(name=bname,
+                    size=tuple(board_state['size'])))
+            board = game.boards[bname]
+            for pname in list(board.pawns):
+                if pname not in board_state['pawns']:
+                    game_wrapper.del_pawn(dict(bname=bname, pname=pname))
+            # A pawn may stand where another one has to go, so keep moving
+            # them until no more progress is possible
+            todo = dict(board_state['pawns'])
+            while todo:
+                remaining = len(todo)
+                for pname, pawn_state in todo.items():
+                    pos = tuple(pawn_state['pos'])
+                    event_dict = dict(bname=bname, pname=pname, pos=pos,
+                            size=tuple(pawn_state['size']),
+                            initiative=pawn_state['initiative'])
+                    if pname in board.pawns:
+                        game_wrapper.move_pawn(event_dict)
+                    else:
+                        game_wrapper.create_pawn(event_dict)
+                    pawn = board.pawns.get(pname)
+                    if pawn is not None and tuple(pawn.pos) == pos:
+                        del todo[pname]
+                if len(todo) == remaining:
+                    LOGGER.warning("Unable to restore pawns %s of board "
+                            "'%s'", ', '.join(sorted(todo)), bname)
+                    break
+
+    def start(self, game):
+        ''' Write a snapshot of game and start recording '''
+        self.state = state_from_game(game)
+        self.snapshot()
+        for event in RECORDED_EVENTS:
+            self.bus.connect(event, self.record)
+        self.bus.connect('tick', self.tick)
+        self.bus.connect('quit', self.close)
+
+    def record(self, event_dict):
+        ''' Append an event to the journal '''
+        self.seq += 1
+        record = _make_record(self.seq, event_dict)
+        apply_record(self.state, record)
+        self._pending.append(json.dumps(record))
+
+    def commit(self):
+        ''' Write the pending records and sync them to disk '''
+        self._last_commit = time.time()
+        if not self._pending:
+            return
+        if self._file is None:
+            self._file = open(self._path(JOURNAL_FILE), 'a')
+        self._file.write('\n'.join(self._pending) + '\n')
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        LOGGER.debug("Committed %d records to the journal",
+                len(self._pending))
+        self._pending = []
+        if self.seq - self._snapshot_seq >= self.snapshot_every:
+            self.snapshot()
+
+    def snapshot(self):
+        ''' Write the whole state and empty the journal '''
+        self._pending = []
+        tmp_path = self._path(SNAPSHOT_FILE + '.tmp')
+        with open(tmp_path, 'w') as snapshot:
+            json.dump(dict(seq=self.seq, boards=self.state), snapshot)
+            snapshot.flush()
+            os.fsync(snapshot.fileno())
+        if os.path.exists(self._path(SNAPSHOT_FILE)):
+            # os.rename() does not replace files on Windows
+            if os.name == 'nt':
+                os.remove(self._path(SNAPSHOT_FILE))
+        os.rename(tmp_path, self._path(SNAPSHOT_FILE))
+        self._snapshot_seq = self.seq
+        # The records are now in the snapshot
+        if self._file is not None:
+            self._file.close()
+        self._file = open(self._path(JOURNAL_FILE), 'w')
+        LOGGER.info("Wrote a snapshot of the game (record %d)", self.seq)
+
+    def tick(self):
+        ''' Commit the pending records once per commit interval '''
+        if (self._pending and time.time() - self._last_commit >=
+                self.commit_interval):
+            self.commit()
+
+    def close(self):
+        ''' Commit the pending records and close the journal '''
+        self.commit()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
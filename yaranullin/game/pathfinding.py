@@ -0,0 +1,245 @@
+# yaranullin/game/pathfinding.py
+#
+# Copyright (c) 2012 Marco Scopesi <marco.scopesi@gmail.com>
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+''' Paths and movement ranges of the pawns on a board.
+
+A pawn moves one cell at a time, diagonals included, but never cuts the
+corner of something it could not stand on. A pawn of w x h cells can stand
+where all of its cells are inside the board, free of other pawns and not
+blocked by a tile. Entering a position costs as much as the most expensive
+tile below the pawn; without tile costs every step costs 1.
+
+The tile costs come from the tmx tilesets: a tile with a 'cost' property of
+0 blocks the pawns, a higher value slows them down.
+
+Every result is cached until the pawns of the board change (see
+Board.revision), so the highlight of the cells a pawn can reach and the
+check of a move requested by a client cost a lookup most of the time.
+
+'''
+
+import heapq
+
+# Tiled keeps the flipping of a tile in the highest bits of its GID
+GID_MASK = 0x1fffffff
+
+NEIGHBOURS = ((1, 0), (-1, 0), (0, 1), (0, -1),
+        (1, 1), (1, -1), (-1, 1), (-1, -1))
+
+
+def distance(pos, other_pos):
+    ''' Return the number of steps between two cells on an empty board '''
+    return max(abs(pos[0] - other_pos[0]), abs(pos[1] - other_pos[1]))
+
+
+class CostMap(object):
+
+    ''' Cost of entering the cells of a board, from its tile layers '''
+
+    def __init__(self, layers, tile_costs):
+        self.layers = list(layers)
+        self.tile_costs = tile_costs
+        self._cells = {}
+
+    def get(self, pos):
+        ''' Return the cost of a cell, 0 if it is blocked '''
+        try:
+            return self._cells[pos]
+        except KeyError:
+            pass
+        cost = 1
+        for layer in self.layers:
+            tile_cost = self.tile_costs.get(layer.get(pos) & GID_MASK)
+            if tile_cost is None:
+                continue
+            if tile_cost <= 0:
+                cost = 0
+                break
+            cost = max(cost, tile_cost)
+        self._cells[pos] = cost
+        return cost
+
+    def get_area(self, pos, size):
+        ''' Return the cost of the most expensive cell of an area '''
+        cost = 1
+        for pos_x in xrange(pos[0], pos[0] + size[0]):
+            for pos_y in xrange(pos[1], pos[1] + size[1]):
+                cell_cost = self.get((pos_x, pos_y))
+                if not cell_cost:
+                    return 0
+                cost = max(cost, cell_cost)
+        return cost
+
+
+class Pathfinder(object):
+
+    ''' Find the paths and the movement ranges of the pawns of a board '''
+
+    def __init__(self, board, costs=None):
+        self.board = board
+        self.costs = costs
+        self._revision = None
+        # Cost of the positions of every pawn, 0 where it cannot stand
+        self._fits = {}
+        self._ranges = {}
+        self._paths = {}
+
+    def _check_revision(self):
+        ''' Forget the results if the board has changed '''
+        if self._revision != self.board.revision:
+            self._fits.clear()
+            self._ranges.clear()
+            self._paths.clear()
+            self._revision = self.board.revision
+
+    def _get_pawn(self, pname, size=None):
+        ''' Return a pawn, the size it walks with and where it fits '''
+        self._check_revision()
+        pawn = self.board.pawns[pname]
+        if size is None:
+            size = pawn.size
+        size = tuple(size)
+        fits = self._fits.setdefault((pname, size), {})
+        return pawn, size, fits
+
+    def _cost(self, pawn, size, pos, fits):
+        ''' Return the cost of moving pawn to pos, 0 if it cannot '''
+        try:
+            return fits[pos]
+        except KeyError:
+            pass
+        cost = 0
+        if self.board.is_free(pos, size, pawn):
+            cost = 1
+            if self.costs is not None:
+                cost = self.costs.get_area(pos, size)
+        fits[pos] = cost
+        return cost
+
+    def _neighbours(self, pawn, size, pos, fits):
+        ''' Yield the positions a step away from pos and their cost '''
+        pos_x, pos_y = pos
+        for delta_x, delta_y in NEIGHBOURS:
+            new_pos = pos_x + delta_x, pos_y + delta_y
+            cost = self._cost(pawn, size, new_pos, fits)
+            if not cost:
+                continue
+            if delta_x and delta_y and not (
+                    self._cost(pawn, size, (pos_x + delta_x, pos_y), fits)
+                    and self._cost(pawn, size, (pos_x, pos_y + delta_y),
+                        fits)):
+                # Cutting a corner
+                continue
+            yield new_pos, cost
+
+    def get_range(self, pname, steps):
+        ''' Return the positions a pawn can reach with at most 'steps'
+
+        The result is a dictionary with the cost of reaching every position,
+        the current position of the pawn included.
+
+        '''
+        pawn, size, fits = self._get_pawn(pname)
+        key = pname, steps
+        try:
+            return self._ranges[key]
+        except KeyError:
+            pass
+        start = tuple(pawn.pos)
+        reached = {start: 0}
+        heap = [(0, start)]
+        while heap:
+            spent, pos = heapq.heappop(heap)
+            if spent > reached[pos]:
+                # Already reached with fewer steps
+                continue
+            for new_pos, cost in self._neighbours(pawn, size, pos, fits):
+                new_spent = spent + cost
+                if new_spent > steps or new_spent >= reached.get(new_pos,
+                        new_spent + 1):
+                    continue
+                reached[new_pos] = new_spent
+                heapq.heappush(heap, (new_spent, new_pos))
+        self._ranges[key] = reached
+        return reached
+
+    def find_path(self, pname, goal, steps=None, size=None):
+        ''' Return the cheapest path of a pawn to goal and its cost
+
+        The path is the list of the positions of the pawn, from the current
+        to goal. If goal cannot be reached (with at most 'steps') the path
+        is None. With 'size' the pawn walks as if it had that size.
+
+        '''
+        pawn, size, fits = self._get_pawn(pname, size)
+        goal = tuple(goal)
+        key = pname, goal, steps, size
+        try:
+            return self._paths[key]
+        except KeyError:
+            pass
+        start = tuple(pawn.pos)
+        result = None, None
+        if start == goal:
+            result = [start], 0
+        elif self._cost(pawn, size, goal, fits) and (steps is None or
+                distance(start, goal) <= steps):
+            result = self._search(pawn, size, start, goal, steps, fits)
+        self._paths[key] = result
+        return result
+
+    def _search(self, pawn, size, start, goal, steps, fits):
+        ''' A* search from start to goal '''
+        # A step costs at least 1, so the distance never overestimates
+        spent = {start: 0}
+        came_from = {start: None}
+        heap = [(distance(start, goal), 0, start)]
+        while heap:
+            _, cost_so_far, pos = heapq.heappop(heap)
+            if pos == goal:
+                path = []
+                while pos is not None:
+                    path.append(pos)
+                    pos = came_from[pos]
+                path.reverse()
+                return path, cost_so_far
+            if cost_so_far > spent[pos]:
+                continue
+            for new_pos, cost in self._neighbours(pawn, size, pos, fits):
+                new_spent = cost_so_far + cost
+                estimate = new_spent + distance(new_pos, goal)
+                if steps is not None and estimate > steps:
+                    continue
+                if new_spent >= spent.get(new_pos, new_spent + 1):
+                    continue
+                spent[new_pos] = new_spent
+                came_from[new_pos] = pos
+                heapq.heappush(heap, (estimate, new_spent, new_pos))
+        return None, None
+
+    def can_move(self, pname, pos, steps, size=None):
+        ''' Return True if a pawn can reach pos with at most 'steps'
+
+        With 'size' the pawn walks as if it had that size.
+
+        '''
+        self._check_revision()
+        pos = tuple(pos)
+        if size is None or tuple(size) == tuple(self.board.pawns[pname].size):
+            reached = self._ranges.get((pname, steps))
+            if reached is not None:
+                return pos in reached
+        return self.find_path(pname, pos, steps, size)[0] is not None
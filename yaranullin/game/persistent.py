@@ -0,0 +1,370 @@
+# yaranullin/game/persistent.py
+#
+# Copyright (c) 2012 Marco Scopesi <marco.scopesi@gmail.com>
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+''' Persistent maps and snapshots of the boards.
+
+A PMap is an immutable dictionary stored as a hash array mapped trie: every
+change returns a new map sharing all of the trie with the old one but the
+path to the changed key. A Board keeps the state of its pawns in a PMap, so
+a snapshot of the board is just a reference to the current map: it costs
+nothing, it never changes, and two snapshots are compared by looking only
+at the parts of the trie they do not share.
+
+Snapshots of a board give undo and redo of the changes (see History) and a
+consistent copy of a board to serialize while the game goes on.
+
+'''
+
+import collections
+
+
+_BITS = 5
+_MASK = (1 << _BITS) - 1
+_HASH_BITS = 32
+
+_MISSING = object()
+
+
+def _hash(key):
+    return hash(key) & 0xffffffff
+
+
+def _bit_count(bits):
+    return bin(bits).count('1')
+
+
+class _Leaf(tuple):
+
+    ''' A key and its value (hash, key, value) '''
+
+    __slots__ = ()
+
+
+class _Collision(object):
+
+    ''' Leaves of keys with the same hash '''
+
+    __slots__ = ('hash', 'leaves')
+
+    def __init__(self, key_hash, leaves):
+        self.hash = key_hash
+        self.leaves = leaves
+
+
+class _Node(object):
+
+    ''' Up to 32 entries, by the 5 bits of the hash at the node depth '''
+
+    __slots__ = ('bitmap', 'entries')
+
+    def __init__(self, bitmap, entries):
+        self.bitmap = bitmap
+        self.entries = entries
+
+
+def _hash_of(entry):
+    return entry[0] if isinstance(entry, _Leaf) else entry.hash
+
+
+def _merge(first, second, shift):
+    ''' Return a node holding two entries with different keys '''
+    first_hash = _hash_of(first)
+    second_hash = _hash_of(second)
+    if first_hash == second_hash:
+        if isinstance(first, _Collision):
+            return _Collision(first_hash, first.leaves + (second, ))
+        return _Collision(first_hash, (first, second))
+    first_bit = (first_hash >> shift) & _MASK
+    second_bit = (second_hash >> shift) & _MASK
+    if first_bit == second_bit:
+        return _Node(1 << first_bit, (_merge(first, second,
+            shift + _BITS), ))
+    if first_bit > second_bit:
+        first, second = second, first
+    return _Node((1 << first_bit) | (1 << second_bit), (first, second))
+
+
+def _get(entry, key_hash, key, shift):
+    while True:
+        if isinstance(entry, _Node):
+            bit = 1 << ((key_hash >> shift) & _MASK)
+            if not entry.bitmap & bit:
+                return _MISSING
+            entry = entry.entries[_bit_count(entry.bitmap & (bit - 1))]
+            shift += _BITS
+        elif isinstance(entry, _Leaf):
+            if entry[0] == key_hash and entry[1] == key:
+                return entry[2]
+            return _MISSING
+        else:
+            if entry.hash == key_hash:
+                for leaf in entry.leaves:
+                    if leaf[1] == key:
+                        return leaf[2]
+            return _MISSING
+
+
+def _set(entry, leaf, shift):
+    ''' Return entry with leaf added or replaced, and True if added '''
+    if isinstance(entry, _Node):
+        bit = 1 << ((leaf[0] >> shift) & _MASK)
+        index = _bit_count(entry.bitmap & (bit - 1))
+        entries = entry.entries
+        if not entry.bitmap & bit:
+            return _Node(entry.bitmap | bit, entries[:index] + (leaf, ) +
+                    entries[index:]), True
+        old = entries[index]
+        new, added = _set(old, leaf, shift + _BITS)
+        if new is old:
+            return entry, False
+        return _Node(entry.bitmap, entries[:index] + (new, ) +
+                entries[index + 1:]), added
+    if isinstance(entry, _Leaf):
+        if entry[0] == leaf[0] and entry[1] == leaf[1]:
+            if entry[2] is leaf[2]:
+                return entry, False
+            return leaf, False
+        return _merge(entry, leaf, shift), True
+    if entry.hash != leaf[0]:
+        return _merge(entry, leaf, shift), True
+    for index, old in enumerate(entry.leaves):
+        if old[1] == leaf[1]:
+            if old[2] is leaf[2]:
+                return entry, False
+            return _Collision(entry.hash, entry.leaves[:index] + (leaf, ) +
+                    entry.leaves[index + 1:]), False
+    return _Collision(entry.hash, entry.leaves + (leaf, )), True
+
+
+def _remove(entry, key_hash, key, shift):
+    ''' Return entry without key (None if empty), or entry if not found '''
+    if isinstance(entry, _Node):
+        bit = 1 << ((key_hash >> shift) & _MASK)
+        if not entry.bitmap & bit:
+            return entry
+        index = _bit_count(entry.bitmap & (bit - 1))
+        old = entry.entries[index]
+        new = _remove(old, key_hash, key, shift + _BITS)
+        if new is old:
+            return entry
+        entries = entry.entries
+        if new is None:
+            if len(entries) == 1:
+                return None
+            entries = entries[:index] + entries[index + 1:]
+            if len(entries) == 1 and not isinstance(entries[0], _Node):
+                # A single leaf moves up
+                return entries[0]
+            return _Node(entry.bitmap & ~bit, entries)
+        if len(entries) == 1 and not isinstance(new, _Node):
+            return new
+        return _Node(entry.bitmap, entries[:index] + (new, ) +
+                entries[index + 1:])
+    if isinstance(entry, _Leaf):
+        if entry[0] == key_hash and entry[1] == key:
+            return None
+        return entry
+    if entry.hash != key_hash:
+        return entry
+    leaves = tuple(leaf for leaf in entry.leaves if leaf[1] != key)
+    if len(leaves) == len(entry.leaves):
+        return entry
+    if len(leaves) == 1:
+        return leaves[0]
+    return _Collision(entry.hash, leaves)
+
+
+def _leaves(entry):
+    ''' Yield the leaves below an entry '''
+    if entry is None:
+        return
+    if isinstance(entry, _Leaf):
+        yield entry
+    elif isinstance(entry, _Collision):
+        for leaf in entry.leaves:
+            yield leaf
+    else:
+        for child in entry.entries:
+            for leaf in _leaves(child):
+                yield leaf
+
+
+def _diff(first, second):
+    ''' Yield (key, first value, second value) of the keys that differ
+
+    Entries shared by the two tries are skipped without looking inside.
+
+    '''
+    if first is second:
+        return
+    if isinstance(first, _Node) and isinstance(second, _Node):
+        bitmap = first.bitmap | second.bitmap
+        while bitmap:
+            bit = bitmap & -bitmap
+            bitmap &= ~bit
+            first_child = second_child = None
+            if first.bitmap & bit:
+                first_child = first.entries[_bit_count(first.bitmap &
+                    (bit - 1))]
+            if second.bitmap & bit:
+                second_child = second.entries[_bit_count(second.bitmap &
+                    (bit - 1))]
+            for change in _diff(first_child, second_child):
+                yield change
+        return
+    # Different kinds of entries: compare their leaves
+    first_items = dict((leaf[1], leaf[2]) for leaf in _leaves(first))
+    second_items = dict((leaf[1], leaf[2]) for leaf in _leaves(second))
+    for key, value in first_items.iteritems():
+        other = second_items.pop(key, _MISSING)
+        if other is not value and other != value:
+            yield key, value, other
+    for key, value in second_items.iteritems():
+        yield key, _MISSING, value
+
+
+class PMap(object):
+
+    ''' Immutable mapping sharing its structure with its versions '''
+
+    __slots__ = ('_root', '_len')
+
+    def __init__(self, root=None, length=0):
+        self._root = root
+        self._len = length
+
+    @classmethod
+    def from_dict(cls, items):
+        ''' Return a map with the items of a dictionary '''
+        pmap = cls()
+        for key, value in items.iteritems():
+            pmap = pmap.set(key, value)
+        return pmap
+
+    def get(self, key, default=None):
+        if self._root is None:
+            return default
+        value = _get(self._root, _hash(key), key, 0)
+        return default if value is _MISSING else value
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        for leaf in _leaves(self._root):
+            yield leaf[1]
+
+    def iteritems(self):
+        for leaf in _leaves(self._root):
+            yield leaf[1], leaf[2]
+
+    def set(self, key, value):
+        ''' Return a map with key set to value '''
+        leaf = _Leaf((_hash(key), key, value))
+        if self._root is None:
+            return PMap(_Node(1 << (leaf[0] & _MASK), (leaf, )), 1)
+        root, added = _set(self._root, leaf, 0)
+        if root is self._root:
+            return self
+        return PMap(root, self._len + (1 if added else 0))
+
+    def remove(self, key):
+        ''' Return a map without key; raise KeyError if it is missing '''
+        if self._root is None:
+            raise KeyError(key)
+        root = _remove(self._root, _hash(key), key, 0)
+        if root is self._root:
+            raise KeyError(key)
+        if root is not None and not isinstance(root, _Node):
+            # The root is always a node
+            root = _Node(1 << (_hash_of(root) & _MASK), (root, ))
+        return PMap(root, self._len - 1)
+
+    def diff(self, other):
+        ''' Return {key: (value here, value in other)} of the differences
+
+        A missing value is None.
+
+        '''
+        changes = {}
+        for key, mine, theirs in _diff(self._root, other._root):
+            changes[key] = (None if mine is _MISSING else mine,
+                    None if theirs is _MISSING else theirs)
+        return changes
+
+
+PawnState = collections.namedtuple('PawnState', 'name initiative pos size')
+
+
+class BoardState(collections.namedtuple('BoardState',
+        'name size pawns revision')):
+
+    ''' Snapshot of a board: a PMap of PawnState by name '''
+
+    __slots__ = ()
+
+    def to_dict(self):
+        ''' Return the state as plain dictionaries and lists '''
+        pawns = {}
+        for pname, pawn in self.pawns.iteritems():
+            pawns[pname] = dict(initiative=pawn.initiative,
+                    pos=list(pawn.pos), size=list(pawn.size))
+        return dict(size=list(self.size), pawns=pawns)
+
+
+class History(object):
+
+    ''' Snapshots of a board to undo and redo its changes '''
+
+    def __init__(self, state, depth=100):
+        self._undo = collections.deque([state], depth + 1)
+        self._redo = []
+
+    def reset(self, state):
+        ''' Forget every change and start again from state '''
+        self._undo = collections.deque([state], self._undo.maxlen)
+        del self._redo[:]
+
+    def record(self, state):
+        ''' Add the state after a change; the undone changes are lost '''
+        if state.pawns is self._undo[-1].pawns:
+            return
+        self._undo.append(state)
+        del self._redo[:]
+
+    def undo(self):
+        ''' Return the state before the last change, or None '''
+        if len(self._undo) < 2:
+            return
+        self._redo.append(self._undo.pop())
+        return self._undo[-1]
+
+    def redo(self):
+        ''' Return the state after the last undone change, or None '''
+        if not self._redo:
+            return
+        state = self._redo.pop()
+        self._undo.append(state)
+        return state
@@ -0,0 +1,211 @@
+# yaranullin/game/snapshot.py
+#
+# Copyright (c) 2012 Marco Scopesi <marco.scopesi@gmail.com>
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+''' Snapshots of the boards built in the background.
+
+Serializing a big board takes a while, so the tmx strings sent to joining
+clients are built by a worker thread. The worker keeps its own copy of every
+board and applies to it the moves of the pawns; the main loop only queues
+these moves. A joining client gets the latest snapshot of every board and
+the moves that happened after it was taken.
+
+'''
+
+import time
+import Queue
+import threading
+import collections
+import logging
+
+from xml.etree import ElementTree
+
+LOGGER = logging.getLogger(__name__)
+
+from yaranullin.event_system import get_bus
+from yaranullin.game.tmx_wrapper import move_pawn_object, \
+        tostring_without_tiles
+
+
+class SnapshotService(object):
+
+    ''' Keep a recent tmx string of every board of a TmxWrapper '''
+
+    def __init__(self, tmx_wrapper, interval=1.0, bus=None):
+        self.bus = get_bus(bus)
+        self.tmx_wrapper = tmx_wrapper
+        self.interval = interval
+        self._seq = 0
+        # Latest snapshot of every board, as (seq, tmx string, tmx string
+        # without the tile data)
+        self._ready = {}
+        # Moves not yet in the snapshots, by board and pawn
+        self._delta = collections.defaultdict(collections.OrderedDict)
+        # Boards of a binary file, whose snapshot waits for a client
+        self._deferred = set()
+        self._jobs = Queue.Queue()
+        self._results = Queue.Queue()
+        self._thread = threading.Thread(target=self._work,
+                name='snapshot-worker')
+        self._thread.daemon = True
+        self._thread.start()
+        self.bus.connect('game-event-board-new', self.add_board)
+        self.bus.connect('game-event-board-del', self.del_board)
+        self.bus.connect('game-event-pawn-moved', self.move_pawn)
+        self.bus.connect('tick', self.collect)
+        self.bus.connect('quit', self.close)
+
+    def add_board(self, event_dict):
+        ''' Give the worker a copy of a board loaded from a tmx
+
+        The tiles of a board of a binary file stay in the file until they
+        are needed, so its copy is made when a client first asks for it.
+
+        '''
+        bname = event_dict['name']
+        if self.tmx_wrapper.is_paged(bname):
+            self._forget(bname)
+            self._deferred.add(bname)
+            return
+        self._deferred.discard(bname)
+        self._start(bname)
+
+    def _start(self, bname):
+        ''' Take the first snapshot of a board and send it to the worker '''
+        tmx_map = self.tmx_wrapper.get_tmx_board(bname)
+        if tmx_map is None:
+            # The board was not loaded from a tmx
+            return
+        self._seq += 1
+        self._ready[bname] = (self._seq, tmx_map,
+                self.tmx_wrapper.get_tmx_board(bname, lazy_layers=True))
+        self._delta.pop(bname, None)
+        self._jobs.put(('add', bname, self._seq, tmx_map))
+
+    def _forget(self, bname):
+        ''' Drop the snapshot of a board '''
+        self._ready.pop(bname, None)
+        self._delta.pop(bname, None)
+        self._jobs.put(('del', bname, None, None))
+
+    def del_board(self, event_dict):
+        ''' Forget a board '''
+        bname = event_dict['name']
+        self._deferred.discard(bname)
+        self._forget(bname)
+
+    def move_pawn(self, event_dict):
+        ''' Queue a move for the worker '''
+        bname = event_dict['bname']
+        if bname not in self._ready:
+            return
+        self._seq += 1
+        move = dict(bname=bname, pname=event_dict['pname'],
+                pos=event_dict['pos'], size=event_dict.get('size'))
+        delta = self._delta[bname]
+        # Only the latest position of a pawn is needed
+        delta.pop(move['pname'], None)
+        delta[move['pname']] = self._seq, move
+        self._jobs.put(('move', bname, self._seq, move))
+
+    def collect(self):
+        ''' Take the snapshots built by the worker '''
+        while True:
+            try:
+                bname, seq, tmx_map, lazy_map = self._results.get_nowait()
+            except Queue.Empty:
+                break
+            if bname not in self._ready or seq <= self._ready[bname][0]:
+                # Deleted or reloaded in the meantime
+                continue
+            self._ready[bname] = seq, tmx_map, lazy_map
+            delta = self._delta.get(bname)
+            if delta:
+                for pname, (move_seq, _) in delta.items():
+                    if move_seq <= seq:
+                        del delta[pname]
+
+    def get_board(self, bname, lazy_layers=False):
+        ''' Return the latest tmx of a board and the moves after it
+
+        A board of a binary file gets its first snapshot here, unless the
+        tiles are left out: they would be read from the file for nothing.
+
+        '''
+        if bname in self._deferred:
+            if lazy_layers:
+                return None, []
+            self._deferred.discard(bname)
+            self._start(bname)
+        try:
+            tmx_map = self._ready[bname][2 if lazy_layers else 1]
+        except KeyError:
+            return None, []
+        delta = self._delta.get(bname, {})
+        return tmx_map, [move for _, move in delta.itervalues()]
+
+    def flush(self, timeout=None):
+        ''' Wait until the worker has built the snapshots of every move '''
+        done = threading.Event()
+        self._jobs.put(('flush', None, None, done))
+        done.wait(timeout)
+        self.collect()
+
+    def close(self):
+        ''' Stop the worker '''
+        self._jobs.put(None)
+
+    def _work(self):
+        ''' Apply the moves and build the snapshots (worker thread) '''
+        boards = {}
+        # Boards changed since their last snapshot
+        dirty = {}
+        deadline = None
+        while True:
+            timeout = None
+            if deadline is not None:
+                timeout = max(deadline - time.time(), 0)
+            try:
+                job = self._jobs.get(timeout=timeout)
+            except Queue.Empty:
+                job = ('flush', None, None, None)
+            if job is None:
+                break
+            action, bname, seq, data = job
+            if action == 'add':
+                boards[bname] = ElementTree.fromstring(data)
+                dirty.pop(bname, None)
+            elif action == 'del':
+                boards.pop(bname, None)
+                dirty.pop(bname, None)
+            elif action == 'move' and bname in boards:
+                move_pawn_object(boards[bname], data['pname'], data['pos'],
+                        data['size'])
+                dirty[bname] = seq
+                if deadline is None:
+                    deadline = time.time() + self.interval
+            elif action == 'flush':
+                started = time.time()
+                for bname, seq in dirty.iteritems():
+                    self._results.put((bname, seq,
+                        ElementTree.tostring(boards[bname]),
+                        tostring_without_tiles(boards[bname])))
+                if dirty:
+                    LOGGER.debug("Built %d snapshots in %.3f seconds",
+                            len(dirty), time.time() - started)
+                dirty.clear()
+                deadline = None
+                if data is not None:
+                    data.set()
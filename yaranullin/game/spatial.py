@@ -0,0 +1,110 @@
+# yaranullin/game/spatial.py
+#
+# Copyright (c) 2012 Marco Scopesi <marco.scopesi@gmail.com>
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+''' A spatial index of rectangles on a board.
+
+The board is divided in square buckets of BUCKET_SIZE cells; every item is
+kept in the buckets it overlaps, so finding the items inside an area only
+looks at the buckets covering it, however big the board is.
+
+'''
+
+import collections
+
+
+BUCKET_SIZE = 8
+
+
+def overlaps(pos, size, other_pos, other_size):
+    ''' Return True if two rectangles have a cell in common '''
+    return (pos[0] < other_pos[0] + other_size[0] and
+            other_pos[0] < pos[0] + size[0] and
+            pos[1] < other_pos[1] + other_size[1] and
+            other_pos[1] < pos[1] + size[1])
+
+
+class SpatialIndex(object):
+
+    ''' Index of rectangles (pos, size) by key '''
+
+    def __init__(self, bucket_size=BUCKET_SIZE):
+        self.bucket_size = bucket_size
+        self._buckets = collections.defaultdict(set)
+        self._items = {}
+
+    def _get_buckets(self, pos, size):
+        bucket_size = self.bucket_size
+        for x in xrange(pos[0] // bucket_size,
+                (pos[0] + size[0] - 1) // bucket_size + 1):
+            for y in xrange(pos[1] // bucket_size,
+                    (pos[1] + size[1] - 1) // bucket_size + 1):
+                yield x, y
+
+    def add(self, key, pos, size):
+        ''' Add an item or move it to pos '''
+        if key in self._items:
+            self.remove(key)
+        pos = tuple(pos)
+        size = tuple(size)
+        self._items[key] = pos, size
+        for bucket in self._get_buckets(pos, size):
+            self._buckets[bucket].add(key)
+
+    def move(self, key, pos, size=None):
+        ''' Move an item, keeping its size if not given '''
+        if size is None:
+            size = self._items[key][1]
+        self.add(key, pos, size)
+
+    def remove(self, key):
+        ''' Remove an item '''
+        try:
+            pos, size = self._items.pop(key)
+        except KeyError:
+            return
+        for bucket in self._get_buckets(pos, size):
+            keys = self._buckets[bucket]
+            keys.discard(key)
+            if not keys:
+                del self._buckets[bucket]
+
+    def get(self, key):
+        ''' Return (pos, size) of an item or None '''
+        return self._items.get(key)
+
+    def query(self, pos, size):
+        ''' Return the keys of the items overlapping an area '''
+        found = set()
+        checked = set()
+        for bucket in self._get_buckets(pos, size):
+            for key in self._buckets.get(bucket, ()):
+                if key in checked:
+                    continue
+                checked.add(key)
+                item_pos, item_size = self._items[key]
+                if overlaps(pos, size, item_pos, item_size):
+                    found.add(key)
+        return found
+
+    def keys(self):
+        ''' Return the keys of all items '''
+        return self._items.keys()
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def __len__(self):
+        return len(self._items)
@@ -0,0 +1,167 @@
+# yaranullin/game/tests/binboard.py
+#
+# Copyright (c) 2012 Marco Scopesi <marco.scopesi@gmail.com>
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+import os
+import sys
+import array
+import shutil
+import tempfile
+import unittest
+
+from xml.etree import ElementTree
+
+if __name__ == '__main__':
+    sys.path.insert(0, ".")
+
+from yaranullin.event_system import EventBus
+from yaranullin.game import binboard
+from yaranullin.game.game_wrapper import GameWrapper
+from yaranullin.game.tile_layer import TileLayer, encode_data
+from yaranullin.game.tmx_wrapper import TmxWrapper
+
+
+WIDTH, HEIGHT = 20, 18
+GIDS = array.array('I', xrange(WIDTH * HEIGHT))
+
+TMX = '''<map version="1.0" orientation="orthogonal" width="%d" height="%d"
+tilewidth="32" tileheight="32">
+ <tileset firstgid="1" name="floor" source="floor.tsx"/>
+ <layer name="bg" width="%d" height="%d">
+  <data encoding="base64" compression="zlib">%s</data>
+ </layer>
+ <objectgroup name="pawns" width="%d" height="%d">
+  <object name="Dragon" x="64" y="96" width="64" height="64">
+   <properties>
+    <property name="initiative" value="12"/>
+   </properties>
+  </object>
+ </objectgroup>
+</map>''' % (WIDTH, HEIGHT, WIDTH, HEIGHT, encode_data(GIDS), WIDTH, HEIGHT)
+
+
+class TestBinBoard(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, 'campaign' + binboard.SUFFIX)
+        binboard.write_boards(self.path, [('cave', TMX), ('tomb', TMX)])
+        self.board_file = binboard.BinBoardFile(self.path)
+
+    def tearDown(self):
+        self.board_file.close()
+        shutil.rmtree(self.folder)
+
+    def test_tables(self):
+        self.assertEqual(['cave', 'tomb'], self.board_file.names())
+        board = self.board_file.get('tomb')
+        self.assertEqual((WIDTH, HEIGHT), board.size)
+        self.assertEqual(32, board.tilewidth)
+        self.assertEqual([binboard.Pawn('Dragon', (2, 3), (2, 2), 12)],
+                board.pawns())
+
+    def test_mapped_layer(self):
+        layer, = self.board_file.get('cave').layers()
+        self.assertEqual(('bg', (WIDTH, HEIGHT)), (layer.name, layer.size))
+        self.assertEqual(WIDTH * 2 + 5, layer.get((5, 2)))
+        pos, size, gids = layer.get_chunk((1, 1))
+        self.assertEqual(((16, 16), (4, 2)), (pos, size))
+        self.assertEqual([16 * WIDTH + 16 + x for x in range(4)],
+                list(gids[:4]))
+        # Nothing was copied from the file so far
+        self.assertFalse(layer.decoded)
+        self.assertEqual(GIDS, layer.gids)
+
+    def test_to_tmx(self):
+        tmx_map = ElementTree.fromstring(self.board_file.get('cave').to_tmx())
+        layer = TileLayer.from_element(tmx_map.find('layer'))
+        self.assertEqual(GIDS, layer.gids)
+        self.assertEqual('floor.tsx', tmx_map.find('tileset').attrib['source'])
+
+    def test_bad_file(self):
+        with open(self.path, 'r+b') as file_:
+            file_.write('NOTBOARD')
+        self.assertRaises(binboard.FormatError, binboard.BinBoardFile,
+                self.path)
+
+    def test_truncated_file(self):
+        size = os.path.getsize(self.path)
+        # Cut inside the index, the first header, the tables and the tiles
+        for length in (0, 20, 60, 150, size - 4):
+            with open(self.path, 'r+b') as file_:
+                file_.truncate(length)
+            try:
+                board_file = binboard.BinBoardFile(self.path)
+            except binboard.FormatError:
+                continue
+            try:
+                for bname in board_file.names():
+                    board = board_file.get(bname)
+                    board.pawns()
+                    board.layers()
+                    board.skeleton
+            except binboard.FormatError:
+                pass
+            else:
+                self.fail('No error with %d bytes out of %d' % (length,
+                    size))
+            finally:
+                board_file.close()
+
+    def test_tmx_wrapper(self):
+        bus = EventBus('binboard')
+        wrapper = TmxWrapper(bus)
+        wrapper.load_board_from_binboard(self.board_file.get('cave'))
+        events = [(event['event'], event.get('pname')) for event in
+                bus.queue]
+        self.assertEqual([('game-request-board-new', None),
+            ('game-request-pawn-new', 'Dragon')], events)
+        # The moves before the tmx is needed are kept
+        wrapper.move_pawn(dict(bname='cave', pname='Dragon', pos=(7, 7)))
+        self.assertFalse(wrapper.get_layer('cave', 'bg').decoded)
+        tmx_map = ElementTree.fromstring(wrapper.get_tmx_board('cave'))
+        pawn = tmx_map.find('objectgroup/object')
+        self.assertEqual(('224', '224'), (pawn.attrib['x'],
+            pawn.attrib['y']))
+        layer = TileLayer.from_element(tmx_map.find('layer'))
+        self.assertEqual(GIDS, layer.gids)
+        self.assertEqual(set(['floor.tsx']), wrapper.get_resources('cave'))
+
+    def test_snapshots(self):
+        bus = EventBus('snapshots')
+        game = GameWrapper(bus)
+        game.enable_snapshots(60)
+        try:
+            game.load_from_files([self.path])
+            bus.process_queue()
+            self.assertEqual(set(['cave', 'tomb']), set(game.game.boards))
+            layers = [game.tmx_wrapper.get_layer(bname, 'bg') for bname in
+                    ('cave', 'tomb')]
+            self.assertFalse([layer for layer in layers if layer.decoded])
+            # The first client asking for the tiles of a board builds its
+            # snapshot
+            tmx_map, _ = game.snapshots.get_board('cave', lazy_layers=True)
+            self.assertIsNone(tmx_map)
+            tmx_map, _ = game.snapshots.get_board('cave')
+            tmx_map = ElementTree.fromstring(tmx_map)
+            self.assertEqual(GIDS, TileLayer.from_element(
+                tmx_map.find('layer')).gids)
+            self.assertFalse(layers[1].decoded)
+        finally:
+            game.snapshots.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -37,6 +37,11 @@ class TestBoard(unittest.TestCase):
         self.assertIn(pawn.name, self.board.pawns)
         self.assertIs(pawn, self.board.pawns[pawn.name])
         self.assertIn(pawn, self.board.initiatives)
+        # Names are unique inside a board
+        self.assertIsNone(self.board.create_pawn('Dragon', 10, (20, 20),
+            (1, 1)))
+        self.assertIs(pawn, self.board.pawns['Dragon'])
+        self.assertEqual(1, len(self.board.initiatives))
 
     def del_pawn(self):
         pos = 3, 4
@@ -47,6 +52,30 @@ class TestBoard(unittest.TestCase):
         self.assertIsNot(pawn, self.board.pawns[pawn.name])
         self.assertNotIn(pawn, self.board.initiatives)
 
+    def test_pawns_in(self):
+        self.board.create_pawn('Dragon', 35, (3, 4), (5, 6))
+        self.board.create_pawn('Orc', 10, (50, 50), (1, 1))
+        self.board.move_pawn('Orc', (20, 20))
+        names = [pawn.name for pawn in self.board.pawns_in((0, 0), (4, 5))]
+        self.assertEqual(['Dragon'], names)
+        names = [pawn.name for pawn in self.board.pawns_in((20, 20), (1, 1))]
+        self.assertEqual(['Orc'], names)
+        self.board.del_pawn('Orc')
+        self.assertEqual([], self.board.pawns_in((20, 20), (1, 1)))
+
+    def test_spawn_pawns(self):
+        self.board.create_pawn('Dragon', 35, (10, 10), (4, 4))
+        pawns = [('Orc%d' % i, i, (2, 2)) for i in range(20)]
+        created = self.board.spawn_pawns((11, 11), pawns)
+        self.assertEqual(20, len(created))
+        for pawn in created:
+            self.assertEqual([pawn], self.board.pawns_in(pawn.pos,
+                pawn.size))
+        # No room on a tiny board
+        board = Board('Closet', (3, 3))
+        created = board.spawn_pawns((0, 0), [('A', 1, (2, 2)),
+            ('B', 1, (2, 2))])
+        self.assertEqual(['A'], [pawn.name for pawn in created])
 
 
 if __name__ == '__main__':
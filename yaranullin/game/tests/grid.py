@@ -66,6 +66,28 @@ class TestGrid(unittest.TestCase):
         self.assertIn(content, grid_content)
         self.assertEqual(1, len(grid_content))
 
+    def test_is_free(self):
+        content = Content()
+        self.grid.add(content, (1, 2), (2, 1))
+        self.assertFalse(self.grid.is_free((0, 0), (3, 3)))
+        self.assertTrue(self.grid.is_free((0, 0), (3, 3), content))
+        self.assertTrue(self.grid.is_free((3, 2), (2, 2)))
+        self.assertFalse(self.grid.is_free((-1, 0), (1, 1)))
+        self.assertFalse(self.grid.is_free((199, 0), (2, 1)))
+
+    def test_find_free(self):
+        content = Content()
+        self.grid.add(content, (10, 10), (3, 3))
+        self.assertEqual((20, 20), self.grid.find_free((20, 20), (2, 2)))
+        # Nearest place around the content
+        self.assertEqual((11, 9), self.grid.find_free((11, 11), (1, 1)))
+        self.assertEqual((10, 8), self.grid.find_free((10, 10), (2, 2)))
+        self.assertIsNone(self.grid.find_free((11, 11), (1, 1), 1))
+        # Inside the grid, even if pos is not
+        self.assertEqual((198, 0), self.grid.find_free((500, -3), (2, 2)))
+        self.grid.remove(content)
+        self.assertEqual((10, 10), self.grid.find_free((10, 10), (3, 3)))
+
 
 if __name__ == '__main__':
     unittest.main()
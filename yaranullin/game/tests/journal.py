@@ -0,0 +1,160 @@
+# yaranullin/game/tests/journal.py
+#
+# Copyright (c) 2012 Marco Scopesi <marco.scopesi@gmail.com>
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+import unittest
+import shutil
+import tempfile
+import os
+import sys
+
+if __name__ == '__main__':
+    sys.path.insert(0, ".")
+
+from yaranullin.event_system import disconnect, EventBus
+from yaranullin.game.game_wrapper import GameWrapper
+from yaranullin.game.journal import Journal, JOURNAL_FILE
+from yaranullin.run_server import _open_journal
+
+
+# The board of the journal, with Knight and Orc
+_TMX = ('<?xml version="1.0" encoding="UTF-8"?>'
+        '<map version="1.0" orientation="orthogonal" width="10" height="10" '
+        'tilewidth="32" tileheight="32">'
+        '<objectgroup name="pawns" width="10" height="10">'
+        '<object name="Knight" x="32" y="32" width="32" height="32">'
+        '<properties><property name="initiative" value="10"/></properties>'
+        '</object>'
+        '<object name="Orc" x="64" y="64" width="32" height="32">'
+        '<properties><property name="initiative" value="5"/></properties>'
+        '</object></objectgroup></map>')
+
+
+def _pawn(pname, pos):
+    return {'event': 'game-event-pawn-new', 'bname': 'Dungeon',
+            'pname': pname, 'initiative': 10, 'pos': pos, 'size': [1, 1]}
+
+
+class TestJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.journal = Journal(self.folder)
+        self.journal.record({'event': 'game-event-board-new',
+            'name': 'Dungeon', 'size': [10, 10]})
+        self.journal.record(_pawn('Dragon', [1, 1]))
+        self.journal.record(_pawn('Knight', [2, 2]))
+
+    def tearDown(self):
+        self.journal.close()
+        disconnect()
+        shutil.rmtree(self.folder)
+
+    def test_recover(self):
+        self.journal.record({'event': 'game-event-pawn-moved',
+            'bname': 'Dungeon', 'pname': 'Knight', 'pos': [3, 3]})
+        self.journal.commit()
+        journal = Journal(self.folder)
+        self.assertTrue(journal.recover())
+        self.assertEqual(journal.seq, 4)
+        pawns = journal.state['Dungeon']['pawns']
+        self.assertEqual(sorted(pawns), ['Dragon', 'Knight'])
+        self.assertEqual(pawns['Knight']['pos'], [3, 3])
+        self.assertEqual(pawns['Knight']['size'], [1, 1])
+
+    def test_uncommitted_records_are_lost(self):
+        self.journal.commit()
+        self.journal.record(_pawn('Thief', [4, 4]))
+        journal = Journal(self.folder)
+        journal.recover()
+        self.assertNotIn('Thief', journal.state['Dungeon']['pawns'])
+
+    def test_torn_record(self):
+        self.journal.commit()
+        with open(os.path.join(self.folder, JOURNAL_FILE), 'a') as file_:
+            file_.write('{"seq": 4, "event": "game-ev')
+        journal = Journal(self.folder)
+        journal.recover()
+        self.assertEqual(journal.seq, 3)
+        self.assertEqual(len(journal.state['Dungeon']['pawns']), 2)
+
+    def test_snapshot(self):
+        self.journal.snapshot_every = 4
+        self.journal.commit()
+        self.journal.record({'event': 'game-event-pawn-del',
+            'bname': 'Dungeon', 'pname': 'Dragon'})
+        self.journal.commit()
+        # The journal was replaced by a snapshot
+        self.assertEqual(os.path.getsize(os.path.join(self.folder,
+            JOURNAL_FILE)), 0)
+        journal = Journal(self.folder)
+        journal.recover()
+        self.assertEqual(journal.seq, 4)
+        self.assertEqual(list(journal.state['Dungeon']['pawns']), ['Knight'])
+
+    def test_restore(self):
+        self.journal.commit()
+        game_wrapper = GameWrapper()
+        game_wrapper.create_board({'name': 'Dungeon', 'size': (10, 10)})
+        # Knight stands where the Dragon has to go
+        game_wrapper.create_pawn({'bname': 'Dungeon', 'pname': 'Knight',
+            'initiative': 10, 'pos': (1, 1), 'size': (1, 1)})
+        game_wrapper.create_pawn({'bname': 'Dungeon', 'pname': 'Orc',
+            'initiative': 5, 'pos': (5, 5), 'size': (1, 1)})
+        journal = Journal(self.folder)
+        journal.recover()
+        journal.restore(game_wrapper)
+        pawns = game_wrapper.game.boards['Dungeon'].pawns
+        self.assertEqual(sorted(pawns), ['Dragon', 'Knight'])
+        self.assertEqual(pawns['Dragon'].pos, (1, 1))
+        self.assertEqual(pawns['Knight'].pos, (2, 2))
+
+    def test_restart(self):
+        # The journal of a game started from the tmx file
+        folder = os.path.join(self.folder, 'restart')
+        journal = Journal(folder)
+        journal.record({'event': 'game-event-board-new', 'name': 'Dungeon',
+            'size': [10, 10]})
+        journal.record(_pawn('Knight', [1, 1]))
+        journal.record(_pawn('Orc', [2, 2]))
+        journal.record({'event': 'game-event-pawn-moved',
+            'bname': 'Dungeon', 'pname': 'Knight', 'pos': [5, 5]})
+        journal.record({'event': 'game-event-pawn-del', 'bname': 'Dungeon',
+            'pname': 'Orc'})
+        journal.commit()
+        journal.close()
+        path = os.path.join(self.folder, 'Dungeon.tmx')
+        with open(path, 'w') as tmx_file:
+            tmx_file.write(_TMX)
+        bus = EventBus('restart')
+        game_wrapper = GameWrapper(bus)
+        game_wrapper.load_from_files([path])
+        journal = _open_journal(folder, game_wrapper, bus)
+        try:
+            bus.process_queue()
+            pawns = game_wrapper.game.boards['Dungeon'].pawns
+            self.assertEqual(['Knight'], list(pawns))
+            self.assertEqual((5, 5), pawns['Knight'].pos)
+            # Neither the load nor the restore can be undone
+            bus.post('game-request-undo', bname='Dungeon')
+            bus.process_queue()
+            self.assertEqual((5, 5), pawns['Knight'].pos)
+        finally:
+            journal.close()
+            del game_wrapper, bus
+
+
+if __name__ == '__main__':
+    unittest.main()
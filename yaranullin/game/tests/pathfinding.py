@@ -0,0 +1,187 @@
+# yaranullin/game/tests/pathfinding.py
+#
+# Copyright (c) 2012 Marco Scopesi <marco.scopesi@gmail.com>
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+import unittest
+import sys
+
+if __name__ == '__main__':
+    sys.path.insert(0, ".")
+
+from yaranullin.event_system import EventBus
+from yaranullin.game.board import Board
+from yaranullin.game.game_wrapper import GameWrapper
+from yaranullin.game.pathfinding import Pathfinder, CostMap
+
+
+class FakeLayer(object):
+
+    def __init__(self, gids):
+        self.gids = gids
+
+    def get(self, pos):
+        return self.gids.get(pos, 1)
+
+
+class TestPathfinder(unittest.TestCase):
+
+    def setUp(self):
+        self.board = Board('Dungeon', (10, 10))
+        self.board.create_pawn('Orc', 10, (0, 0), (1, 1))
+        self.pathfinder = Pathfinder(self.board)
+
+    def test_range(self):
+        reached = self.pathfinder.get_range('Orc', 2)
+        # Diagonals included
+        self.assertEqual(9, len(reached))
+        self.assertEqual(0, reached[0, 0])
+        self.assertEqual(2, reached[2, 2])
+
+    def test_blocked(self):
+        # A wall of pawns with a gap at (5, 9)
+        for y in range(9):
+            self.board.create_pawn('Wall%d' % y, 0, (5, y), (1, 1))
+        path, cost = self.pathfinder.find_path('Orc', (9, 0))
+        self.assertEqual(path[0], (0, 0))
+        self.assertEqual(path[-1], (9, 0))
+        self.assertIn((5, 9), path)
+        self.assertEqual(cost, len(path) - 1)
+        self.assertNotIn((9, 0), self.pathfinder.get_range('Orc', 10))
+        self.assertFalse(self.pathfinder.can_move('Orc', (9, 0), 10))
+
+    def test_big_pawn(self):
+        self.board.create_pawn('Dragon', 20, (0, 5), (2, 2))
+        # A gap of a single cell is too narrow
+        self.board.create_pawn('Left', 0, (0, 3), (3, 1))
+        self.board.create_pawn('Right', 0, (4, 3), (6, 1))
+        self.assertEqual((None, None),
+                self.pathfinder.find_path('Dragon', (0, 0)))
+        self.assertIsNotNone(self.pathfinder.find_path('Orc', (3, 5))[0])
+
+    def test_resize(self):
+        # The Orc fits through the gap only with its own size
+        self.board.create_pawn('Left', 0, (0, 3), (3, 1))
+        self.board.create_pawn('Right', 0, (4, 3), (6, 1))
+        self.assertTrue(self.pathfinder.can_move('Orc', (0, 5), 10))
+        self.assertFalse(self.pathfinder.can_move('Orc', (0, 5), 10,
+            (2, 2)))
+        self.assertTrue(self.pathfinder.can_move('Orc', (0, 1), 10, (2, 2)))
+
+    def test_corner(self):
+        self.board.create_pawn('A', 0, (1, 0), (1, 1))
+        self.board.create_pawn('B', 0, (0, 1), (1, 1))
+        self.assertEqual({(0, 0): 0}, self.pathfinder.get_range('Orc', 3))
+
+    def test_revision(self):
+        self.assertIn((1, 1), self.pathfinder.get_range('Orc', 1))
+        self.board.create_pawn('Goblin', 5, (1, 1), (1, 1))
+        self.assertNotIn((1, 1), self.pathfinder.get_range('Orc', 1))
+        self.board.move_pawn('Orc', (5, 5))
+        self.assertIn((6, 6), self.pathfinder.get_range('Orc', 1))
+
+    def test_costs(self):
+        # Tile 2 is a swamp and tile 3 a wall
+        layer = FakeLayer({(1, 0): 2, (1, 1): 2, (0, 1): 3})
+        pathfinder = Pathfinder(self.board, CostMap([layer], {2: 3, 3: 0}))
+        reached = pathfinder.get_range('Orc', 3)
+        self.assertNotIn((0, 1), reached)
+        self.assertEqual(3, reached[1, 0])
+        self.assertEqual((None, None), pathfinder.find_path('Orc', (2, 0),
+            3))
+        path, cost = pathfinder.find_path('Orc', (2, 0))
+        self.assertEqual(4, cost)
+
+
+class TestGameWrapper(unittest.TestCase):
+
+    def setUp(self):
+        self.bus = EventBus('test')
+        self.wrapper = GameWrapper(self.bus)
+        self.events = []
+        self.bus.connect('game-event-pawn-range', self.received)
+        self.bus.connect('game-event-pawn-moved', self.received)
+        self.bus.connect('game-event-pawn-path', self.received)
+        self.bus.post('game-request-board-new', name='Dungeon', size=(10, 10))
+        self.bus.post('game-request-pawn-new', bname='Dungeon', pname='Orc',
+                initiative=10, pos=(0, 0), size=(1, 1))
+        self.bus.process_queue()
+
+    def tearDown(self):
+        # Unittest keeps the test cases: let go of the handlers
+        del self.bus, self.wrapper
+
+    def received(self, event_dict):
+        self.events.append(event_dict)
+
+    def test_range(self):
+        self.bus.post('game-request-pawn-range', bname='Dungeon',
+                pname='Orc', steps=1, client=3)
+        self.bus.process_queue()
+        event_dict = self.events.pop()
+        self.assertEqual([(0, 0), (0, 1), (1, 0), (1, 1)],
+                event_dict['cells'])
+        self.assertEqual(3, event_dict['client'])
+
+    def test_move(self):
+        self.bus.post('game-request-pawn-move', bname='Dungeon',
+                pname='Orc', pos=(5, 5), steps=3)
+        self.bus.process_queue()
+        self.assertEqual([], self.events)
+        self.bus.post('game-request-pawn-move', bname='Dungeon',
+                pname='Orc', pos=(3, 3), steps=3)
+        self.bus.process_queue()
+        self.assertEqual((3, 3), self.events.pop()['pos'])
+
+    def test_client_limits(self):
+        self.wrapper.max_range = 2
+        # The steps of a client never go past max_range
+        self.bus.post('game-request-pawn-path', bname='Dungeon', pname='Orc',
+                pos=(3, 0), steps=10, client=3)
+        self.bus.post('game-request-pawn-range', bname='Dungeon',
+                pname='Orc', steps=10, client=3)
+        self.bus.process_queue()
+        self.assertEqual(2, self.events.pop()['steps'])
+        self.assertIsNone(self.events.pop()['path'])
+        # The moves of a client are checked even without steps
+        self.bus.post('game-request-pawn-move', bname='Dungeon',
+                pname='Orc', pos=(6, 6), client=3)
+        self.bus.post('game-request-pawn-move', bname='Dungeon',
+                pname='Orc', pos=(2, 2), size=(1, 1), client=3)
+        self.bus.process_queue()
+        event_dict = self.events.pop()
+        self.assertEqual([], self.events)
+        self.assertEqual((2, 2), event_dict['pos'])
+        # The move is sent to every client
+        self.assertNotIn('client', event_dict)
+
+    def test_client_resize(self):
+        self.bus.post('game-request-pawn-new', bname='Dungeon', pname='Left',
+                initiative=0, pos=(0, 3), size=(3, 1))
+        self.bus.post('game-request-pawn-new', bname='Dungeon',
+                pname='Right', initiative=0, pos=(4, 3), size=(6, 1))
+        self.bus.process_queue()
+        # The move is checked with the size the pawn is getting
+        self.bus.post('game-request-pawn-move', bname='Dungeon',
+                pname='Orc', pos=(0, 5), size=(2, 2), client=3)
+        self.bus.process_queue()
+        self.assertEqual([], self.events)
+        self.bus.post('game-request-pawn-move', bname='Dungeon',
+                pname='Orc', pos=(0, 5), client=3)
+        self.bus.process_queue()
+        self.assertEqual((0, 5), self.events.pop()['pos'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,186 @@
+# yaranullin/game/tests/persistent.py
+#
+# Copyright (c) 2012 Marco Scopesi <marco.scopesi@gmail.com>
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+import unittest
+import sys
+
+if __name__ == '__main__':
+    sys.path.insert(0, ".")
+
+from yaranullin.event_system import EventBus
+from yaranullin.game.board import Board
+from yaranullin.game.game_wrapper import GameWrapper
+from yaranullin.game.persistent import PMap, History
+
+
+class Colliding(object):
+
+    ''' A key with a chosen hash '''
+
+    def __init__(self, name, key_hash):
+        self.name = name
+        self.key_hash = key_hash
+
+    def __hash__(self):
+        return self.key_hash
+
+    def __eq__(self, other):
+        return self.name == other.name
+
+    def __ne__(self, other):
+        return not self == other
+
+
+class TestPMap(unittest.TestCase):
+
+    def test_set_remove(self):
+        empty = PMap()
+        pmap = empty
+        for i in range(1000):
+            pmap = pmap.set(i, str(i))
+        self.assertEqual(1000, len(pmap))
+        self.assertEqual('500', pmap[500])
+        self.assertEqual(0, len(empty))
+        smaller = pmap.remove(500)
+        self.assertNotIn(500, smaller)
+        self.assertIn(500, pmap)
+        self.assertEqual(999, len(smaller))
+        self.assertRaises(KeyError, smaller.remove, 500)
+        self.assertEqual(dict((i, str(i)) for i in range(1000) if i != 500),
+                dict(smaller.iteritems()))
+
+    def test_collisions(self):
+        keys = [Colliding(name, 7) for name in 'abc']
+        pmap = PMap()
+        for key in keys:
+            pmap = pmap.set(key, key.name)
+        self.assertEqual('b', pmap[Colliding('b', 7)])
+        pmap = pmap.remove(keys[0]).remove(keys[1])
+        self.assertEqual(['c'], [value for _, value in pmap.iteritems()])
+
+    def test_shared(self):
+        pmap = PMap.from_dict(dict((i, i) for i in range(1000)))
+        self.assertIs(pmap, pmap.set(3, 3))
+        changed = pmap.set(3, 'three').remove(4).set('new', 1)
+        self.assertEqual({3: (3, 'three'), 4: (4, None), 'new': (None, 1)},
+                pmap.diff(changed))
+        # Only the path to the changed key is copied
+        self.assertEqual(len(pmap._root.entries),
+                len(pmap.set(3, 'three')._root.entries))
+        shared = [entry is other for entry, other in
+                zip(pmap._root.entries, pmap.set(3, 'three')._root.entries)]
+        self.assertEqual(1, shared.count(False))
+
+
+class TestSnapshots(unittest.TestCase):
+
+    def setUp(self):
+        self.board = Board('Dungeon', (20, 20))
+        self.board.create_pawn('Orc', 10, (0, 0), (1, 1))
+        self.board.create_pawn('Dragon', 20, (5, 5), (2, 2))
+
+    def test_isolation(self):
+        state = self.board.snapshot()
+        self.board.move_pawn('Orc', (3, 3))
+        self.board.del_pawn('Dragon')
+        self.assertEqual((0, 0), state.pawns['Orc'].pos)
+        self.assertEqual({'size': [20, 20], 'pawns': {'Orc': dict(
+            initiative=10, pos=[3, 3], size=[1, 1])}},
+            self.board.snapshot().to_dict())
+
+    def test_restore(self):
+        state = self.board.snapshot()
+        self.board.move_pawn('Orc', (5, 7))
+        self.board.del_pawn('Dragon')
+        self.board.create_pawn('Goblin', 5, (5, 5), (1, 1))
+        changes = self.board.restore(state)
+        self.assertEqual(set(['Orc', 'Dragon', 'Goblin']), set(changes))
+        self.assertEqual((0, 0), self.board.pawns['Orc'].pos)
+        self.assertNotIn('Goblin', self.board.pawns)
+        self.assertEqual(['Dragon', 'Orc'],
+                [pawn.name for pawn in self.board.initiatives])
+        self.assertEqual(['Dragon'], [pawn.name for pawn in
+            self.board.pawns_in((6, 6), (1, 1))])
+        self.assertFalse(self.board.is_free((5, 5), (1, 1)))
+
+    def test_history(self):
+        history = History(self.board.snapshot(), depth=2)
+        for pos in ((1, 1), (2, 2), (3, 3)):
+            self.board.move_pawn('Orc', pos)
+            history.record(self.board.snapshot())
+        self.assertEqual((2, 2), history.undo().pawns['Orc'].pos)
+        self.assertEqual((1, 1), history.undo().pawns['Orc'].pos)
+        # Older changes are forgotten
+        self.assertIsNone(history.undo())
+        self.assertEqual((2, 2), history.redo().pawns['Orc'].pos)
+        self.board.move_pawn('Orc', (9, 9))
+        history.record(self.board.snapshot())
+        self.assertIsNone(history.redo())
+
+
+class TestUndo(unittest.TestCase):
+
+    def setUp(self):
+        self.bus = EventBus('test')
+        self.wrapper = GameWrapper(self.bus)
+        self.events = []
+        for event in ('game-event-pawn-new', 'game-event-pawn-moved',
+                'game-event-pawn-del'):
+            self.bus.connect(event, self.received)
+        self.bus.post('game-request-board-new', name='Dungeon', size=(10, 10))
+        self.bus.post('game-request-pawn-new', bname='Dungeon', pname='Orc',
+                initiative=10, pos=(0, 0), size=(1, 1))
+        self.bus.post('game-request-pawn-move', bname='Dungeon', pname='Orc',
+                pos=(4, 4))
+        self.bus.process_queue()
+        del self.events[:]
+
+    def tearDown(self):
+        # Unittest keeps the test cases: let go of the handlers
+        del self.bus, self.wrapper
+
+    def received(self, event_dict):
+        self.events.append((event_dict['event'], event_dict['pname'],
+            event_dict.get('pos')))
+
+    def test_undo_redo(self):
+        for event in ('game-request-undo', 'game-request-undo',
+                'game-request-redo'):
+            self.bus.post(event, bname='Dungeon')
+        self.bus.process_queue()
+        self.assertEqual([('game-event-pawn-moved', 'Orc', (0, 0)),
+            ('game-event-pawn-del', 'Orc', None),
+            ('game-event-pawn-new', 'Orc', (0, 0))], self.events)
+
+    def test_reset(self):
+        self.wrapper.reset_histories()
+        self.bus.post('game-request-undo', bname='Dungeon')
+        self.bus.process_queue()
+        self.assertEqual([], self.events)
+        # Only the changes after the reset are undone
+        self.bus.post('game-request-pawn-move', bname='Dungeon', pname='Orc',
+                pos=(5, 5))
+        self.bus.process_queue()
+        del self.events[:]
+        self.bus.post('game-request-undo', bname='Dungeon')
+        self.bus.post('game-request-undo', bname='Dungeon')
+        self.bus.process_queue()
+        self.assertEqual([('game-event-pawn-moved', 'Orc', (4, 4))],
+                self.events)
+
+
+if __name__ == '__main__':
+    unittest.main()
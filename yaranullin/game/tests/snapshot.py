@@ -0,0 +1,95 @@
+# yaranullin/game/tests/snapshot.py
+#
+# Copyright (c) 2012 Marco Scopesi <marco.scopesi@gmail.com>
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+import unittest
+import sys
+
+from xml.etree import ElementTree
+
+if __name__ == '__main__':
+    sys.path.insert(0, ".")
+
+from yaranullin.event_system import disconnect
+from yaranullin.game.tmx_wrapper import TmxWrapper
+from yaranullin.game.snapshot import SnapshotService
+
+
+TMX = '''<map version="1.0" orientation="orthogonal" width="10" height="10"
+tilewidth="32" tileheight="32">
+ <objectgroup name="pawns">
+  <object name="Dragon" x="32" y="64" width="32" height="32">
+   <properties><property name="initiative" value="10"/></properties>
+  </object>
+ </objectgroup>
+</map>'''
+
+
+def _pawn_xy(tmx_map):
+    pawn = ElementTree.fromstring(tmx_map).find('objectgroup/object')
+    return pawn.attrib['x'], pawn.attrib['y']
+
+
+def _move(pos):
+    return dict(bname='Dungeon', pname='Dragon', pos=pos)
+
+
+class TestSnapshotService(unittest.TestCase):
+
+    def setUp(self):
+        self.tmx_wrapper = TmxWrapper()
+        self.tmx_wrapper.load_board_from_tmx('Dungeon', TMX)
+        self.service = SnapshotService(self.tmx_wrapper, interval=60)
+        self.service.add_board(dict(name='Dungeon'))
+
+    def tearDown(self):
+        self.service.close()
+        disconnect()
+
+    def test_tmx_wrapper_move(self):
+        self.tmx_wrapper.move_pawn(_move((4, 5)))
+        tmx_map = self.tmx_wrapper.get_tmx_board('Dungeon')
+        self.assertEqual(_pawn_xy(tmx_map), ('128', '160'))
+
+    def test_delta(self):
+        self.service.move_pawn(_move((2, 2)))
+        self.service.move_pawn(_move((4, 5)))
+        tmx_map, moves = self.service.get_board('Dungeon')
+        # The snapshot is older than the moves
+        self.assertEqual(_pawn_xy(tmx_map), ('32', '64'))
+        self.assertEqual(moves, [dict(_move((4, 5)), size=None)])
+
+    def test_flush(self):
+        self.service.move_pawn(_move((4, 5)))
+        self.service.flush(5)
+        tmx_map, moves = self.service.get_board('Dungeon')
+        self.assertEqual(_pawn_xy(tmx_map), ('128', '160'))
+        self.assertEqual(moves, [])
+
+    def test_load_with_moves(self):
+        tmx_map, moves = self.service.get_board('Dungeon')
+        moves = [dict(_move((4, 5)), size=(2, 2))]
+        tmx_wrapper = TmxWrapper()
+        tmx_wrapper.load_board_from_tmx('Dungeon', tmx_map, moves)
+        tmx_map = ElementTree.fromstring(tmx_wrapper.get_tmx_board(
+            'Dungeon'))
+        pawn = tmx_map.find('objectgroup/object')
+        self.assertEqual(pawn.attrib['width'], '64')
+        self.assertEqual(_pawn_xy(tmx_wrapper.get_tmx_board('Dungeon')),
+                ('128', '160'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+# yaranullin/game/tests/spatial.py
+#
+# Copyright (c) 2012 Marco Scopesi <marco.scopesi@gmail.com>
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+import unittest
+import sys
+
+if __name__ == '__main__':
+    sys.path.insert(0, ".")
+
+from yaranullin.game.spatial import SpatialIndex
+
+
+class TestSpatialIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.index = SpatialIndex(bucket_size=4)
+        self.index.add('Dragon', (3, 3), (3, 3))
+        self.index.add('Orc', (10, 1), (1, 1))
+
+    def test_query(self):
+        self.assertEqual(set(['Dragon']), self.index.query((5, 5), (1, 1)))
+        self.assertEqual(set(['Dragon', 'Orc']),
+                self.index.query((0, 0), (11, 6)))
+        # Same bucket but no overlap
+        self.assertEqual(set(), self.index.query((0, 0), (3, 3)))
+        self.assertEqual(set(), self.index.query((-10, -10), (5, 5)))
+
+    def test_move(self):
+        self.index.move('Dragon', (20, 20))
+        self.assertEqual(((20, 20), (3, 3)), self.index.get('Dragon'))
+        self.assertEqual(set(), self.index.query((3, 3), (3, 3)))
+        self.assertEqual(set(['Dragon']), self.index.query((22, 22), (1, 1)))
+
+    def test_remove(self):
+        self.index.remove('Dragon')
+        self.index.remove('Dragon')
+        self.assertNotIn('Dragon', self.index)
+        self.assertEqual(1, len(self.index))
+        self.assertEqual(set(), self.index.query((0, 0), (8, 8)))
+
+
+if __name__ == '__main__':
+    unittest.main()
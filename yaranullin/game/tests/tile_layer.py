@@ -0,0 +1,117 @@
+# yaranullin/game/tests/tile_layer.py
+#
+# Copyright (c) 2012 Marco Scopesi <marco.scopesi@gmail.com>
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+import unittest
+import array
+import sys
+
+from xml.etree import ElementTree
+
+if __name__ == '__main__':
+    sys.path.insert(0, ".")
+
+from yaranullin.event_system import disconnect, post, process_queue, \
+        connect
+from yaranullin.game.tile_layer import TileLayer, decode_data, \
+        encode_data, chunks_in
+from yaranullin.game.tmx_wrapper import TmxWrapper
+from yaranullin.game.game_wrapper import GameWrapper
+
+
+WIDTH, HEIGHT = 20, 18
+GIDS = array.array('I', xrange(WIDTH * HEIGHT))
+
+TMX = '''<map version="1.0" orientation="orthogonal" width="%d" height="%d"
+tilewidth="32" tileheight="32">
+ <layer name="bg" width="%d" height="%d">
+  <data encoding="base64" compression="zlib">%s</data>
+ </layer>
+</map>''' % (WIDTH, HEIGHT, WIDTH, HEIGHT, encode_data(GIDS))
+
+
+class TestTileLayer(unittest.TestCase):
+
+    def setUp(self):
+        element = ElementTree.fromstring(TMX).find('layer')
+        self.layer = TileLayer.from_element(element)
+
+    def test_lazy(self):
+        self.assertFalse(self.layer.decoded)
+        self.assertEqual(WIDTH + 3, self.layer.get((3, 1)))
+        self.assertTrue(self.layer.decoded)
+
+    def test_csv(self):
+        self.assertEqual([1, 2, 0, 4], list(decode_data('1,2,\n0,4',
+            'csv')))
+
+    def test_chunks(self):
+        self.assertEqual([(0, 0), (1, 0), (0, 1), (1, 1)],
+                chunks_in((10, 10), (10, 10)))
+        pos, size, gids = self.layer.get_chunk((1, 1))
+        self.assertEqual(((16, 16), (4, 2)), (pos, size))
+        self.assertEqual(16 * WIDTH + 16, gids[0])
+        self.assertEqual(17 * WIDTH + 19, gids[-1])
+        self.assertRaises(IndexError, self.layer.get_chunk, (2, 0))
+
+    def test_set_chunk(self):
+        empty = TileLayer('bg', (WIDTH, HEIGHT))
+        for chunk in chunks_in((0, 0), (WIDTH, HEIGHT)):
+            pos, size, gids = self.layer.get_chunk(chunk)
+            empty.set_chunk(pos, size, decode_data(encode_data(gids),
+                'base64', 'zlib'))
+        self.assertEqual(list(GIDS), list(empty.gids))
+
+
+class TestLazyLayers(unittest.TestCase):
+
+    def tearDown(self):
+        disconnect()
+
+    def test_fetch_chunks(self):
+        chunks = []
+
+        def received(event_dict):
+            chunks.append(event_dict)
+
+        connect('game-event-tile-chunk', received)
+        game_wrapper = GameWrapper()
+        game_wrapper.tmx_wrapper.load_board_from_tmx('Dungeon', TMX)
+        process_queue()
+        lazy_map = game_wrapper.tmx_wrapper.get_tmx_board('Dungeon',
+                lazy_layers=True)
+        self.assertIsNone(ElementTree.fromstring(lazy_map).find(
+            'layer/data').text)
+        # The tiles are still in the board
+        self.assertIn(encode_data(GIDS),
+                game_wrapper.tmx_wrapper.get_tmx_board('Dungeon'))
+        tmx_wrapper = TmxWrapper()
+        tmx_wrapper.load_board_from_tmx('Dungeon', lazy_map)
+        post('game-request-tile-chunks', bname='Dungeon', layer='bg',
+                chunks=[(1, 0), (0, 1)], client=3)
+        process_queue()
+        self.assertEqual([3, 3], [chunk['client'] for chunk in chunks])
+        for chunk in chunks:
+            tmx_wrapper.set_chunk(chunk['bname'], chunk['layer'],
+                    chunk['pos'], chunk['size'], chunk['data'])
+        layer = tmx_wrapper.get_layer('Dungeon', 'bg')
+        self.assertEqual(GIDS[16], layer.get((16, 0)))
+        self.assertEqual(GIDS[16 * WIDTH], layer.get((0, 16)))
+        # Not fetched yet
+        self.assertEqual(0, layer.get((1, 0)))
+
+
+if __name__ == '__main__':
+    unittest.main()
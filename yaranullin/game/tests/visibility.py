@@ -0,0 +1,178 @@
+# yaranullin/game/tests/visibility.py
+#
+# Copyright (c) 2012 Marco Scopesi <marco.scopesi@gmail.com>
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+import unittest
+import sys
+
+if __name__ == '__main__':
+    sys.path.insert(0, ".")
+
+from yaranullin.event_system import EventBus
+from yaranullin.game.game import Game
+from yaranullin.game.board import Board
+from yaranullin.game.visibility import Opacity, Sight, Visibility, \
+        SightService, field_of_view, _runs
+
+
+class FakeLayer(object):
+
+    chunk_size = 4
+
+    def __init__(self, size, gids):
+        self.size = size
+        self.gids = gids
+
+    def get_chunk(self, chunk):
+        pos = chunk[0] * 4, chunk[1] * 4
+        size = min(4, self.size[0] - pos[0]), min(4, self.size[1] - pos[1])
+        return pos, size, [self.gids.get((x, y), 1) for y in
+                xrange(pos[1], pos[1] + size[1]) for x in
+                xrange(pos[0], pos[0] + size[0])]
+
+
+class FakeTmxWrapper(object):
+
+    def get_layers(self, bname):
+        return []
+
+    def get_opaque_tiles(self, bname):
+        return set()
+
+
+def _wall(size, col, gap):
+    opacity = Opacity(size)
+    for row in xrange(size[1]):
+        if row != gap:
+            opacity.add((col, row))
+    return opacity
+
+
+class TestFieldOfView(unittest.TestCase):
+
+    def test_runs(self):
+        self.assertEqual([(0, 1), (4, 4), (6, 8)],
+                list(_runs(int('111010011', 2))))
+
+    def test_open(self):
+        cells = field_of_view(Opacity((20, 20)), (10, 10), 3).cells()
+        self.assertIn((13, 10), cells)
+        self.assertIn((12, 12), cells)
+        self.assertNotIn((14, 10), cells)
+        # The radius is round
+        self.assertNotIn((13, 13), cells)
+
+    def test_wall(self):
+        opacity = _wall((11, 11), 7, 5)
+        cells = field_of_view(opacity, (5, 5), 20).cells()
+        # The wall is seen but not what is behind it
+        self.assertIn((7, 0), cells)
+        self.assertNotIn((8, 0), cells)
+        # Except through the gap
+        self.assertIn((10, 5), cells)
+        self.assertIn((10, 4), cells)
+
+    def test_symmetric(self):
+        opacity = _wall((11, 11), 7, 5)
+        for other in ((10, 4), (9, 2), (10, 0)):
+            seen = other in field_of_view(opacity, (5, 5), 20).cells()
+            back = (5, 5) in field_of_view(opacity, other, 20).cells()
+            self.assertEqual(seen, back)
+
+    def test_from_layers(self):
+        layer = FakeLayer((6, 6), {(5, 1): 7, (2, 4): 8})
+        opacity = Opacity.from_layers((6, 6), [layer], set([7]))
+        self.assertEqual(1 << 5, opacity.rows[1])
+        self.assertEqual(1 << 1, opacity.cols[5])
+        self.assertEqual(0, opacity.rows[4])
+
+    def test_sees(self):
+        sight = Sight()
+        sight.cols[3] = 1 << 4
+        self.assertTrue(sight.sees((2, 3), (2, 2)))
+        self.assertFalse(sight.sees((2, 2), (2, 2)))
+
+
+class TestVisibility(unittest.TestCase):
+
+    def setUp(self):
+        self.board = Board('Dungeon', (11, 11))
+        self.board.create_pawn('Hero', 10, (5, 5), (1, 1))
+        self.board.create_pawn('Orc', 5, (9, 1), (1, 1))
+        self.visibility = Visibility(self.board, _wall((11, 11), 7, 5), 20)
+
+    def test_seen_pawns(self):
+        sight = self.visibility.get_sight(['Hero'])
+        self.assertEqual(set(['Hero']), self.visibility.seen_pawns(sight))
+        self.board.move_pawn('Orc', (9, 5))
+        self.assertEqual(set(['Hero', 'Orc']),
+                self.visibility.seen_pawns(sight))
+
+    def test_moved(self):
+        sight = self.visibility.pawn_sight('Hero')
+        self.assertIs(sight, self.visibility.pawn_sight('Hero'))
+        self.board.move_pawn('Hero', (8, 5))
+        self.assertIsNot(sight, self.visibility.pawn_sight('Hero'))
+        self.assertTrue(self.visibility.sees(
+            self.visibility.pawn_sight('Hero'), 'Orc'))
+
+
+class TestSightService(unittest.TestCase):
+
+    def setUp(self):
+        self.bus = EventBus('test')
+        self.game = Game()
+        board = self.game.create_board('Dungeon', (30, 30))
+        board.create_pawn('Hero', 10, (0, 0), (1, 1))
+        board.create_pawn('Orc', 5, (20, 20), (1, 1))
+        self.service = SightService(self.game, FakeTmxWrapper(), 5,
+                self.bus)
+        self.events = []
+        self.bus.connect('game-event-sight', self.received)
+
+    def tearDown(self):
+        # Unittest keeps the test cases: let go of the handlers
+        del self.bus, self.service
+
+    def received(self, event_dict):
+        self.events.append(event_dict)
+
+    def test_sight(self):
+        self.bus.post('game-request-sight', bname='Dungeon',
+                pnames=['Hero'], client=1)
+        self.bus.process_queue()
+        self.assertEqual(['Hero'], self.events.pop()['pnames'])
+        self.game.move_pawn('Dungeon', 'Orc', (3, 3))
+        self.bus.post('game-event-pawn-moved', bname='Dungeon', pname='Orc',
+                pos=(3, 3))
+        self.bus.process_queue()
+        self.assertEqual(['Hero', 'Orc'], self.events.pop()['pnames'])
+        self.game.move_pawn('Dungeon', 'Hero', (25, 25))
+        self.bus.post('game-event-pawn-moved', bname='Dungeon',
+                pname='Hero', pos=(25, 25))
+        self.bus.process_queue()
+        self.assertEqual(['Hero'], self.events.pop()['pnames'])
+        # Nothing changes for the client
+        self.bus.post('game-event-pawn-moved', bname='Dungeon',
+                pname='Orc', pos=(3, 3))
+        self.bus.process_queue()
+        self.assertEqual([], self.events)
+        self.bus.post('network-client-closed', client=1)
+        self.bus.process_queue()
+        self.assertEqual({}, self.service._seen)
+
+
+if __name__ == '__main__':
+    unittest.main()
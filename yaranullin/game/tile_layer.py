@@ -0,0 +1,169 @@
+# yaranullin/game/tile_layer.py
+#
+# Copyright (c) 2012 Marco Scopesi <marco.scopesi@gmail.com>
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+''' Tile layers of tmx boards, decoded lazily and split in chunks.
+
+The tile data of a layer is kept as found in the tmx file until a tile is
+needed; then it is decoded once into a compact array of GIDs. Layers are
+sent to the clients in square chunks of CHUNK_SIZE tiles (as the chunks of
+tmx infinite maps), so a client only asks for the chunks it displays.
+
+'''
+
+import sys
+import zlib
+import gzip
+import base64
+import array
+
+from cStringIO import StringIO
+
+
+CHUNK_SIZE = 16
+
+
+def _check_array():
+    ''' Return the typecode of an array of 32 bit unsigned integers '''
+    for typecode in ('I', 'L'):
+        if array.array(typecode).itemsize == 4:
+            return typecode
+    raise ImportError('No array type for 32 bit integers')
+
+_TYPECODE = _check_array()
+
+
+def decode_data(text, encoding=None, compression=None):
+    ''' Decode the content of a <data> tag into an array of GIDs '''
+    if encoding == 'csv':
+        return array.array(_TYPECODE, (int(gid) for gid in
+            text.replace('\n', '').split(',') if gid.strip()))
+    if encoding != 'base64':
+        raise ValueError("Unsupported tile data encoding '%s'" % encoding)
+    data = base64.b64decode(text.strip())
+    if compression == 'zlib':
+        data = zlib.decompress(data)
+    elif compression == 'gzip':
+        data = gzip.GzipFile(fileobj=StringIO(data)).read()
+    elif compression:
+        raise ValueError("Unsupported tile data compression '%s'" %
+                compression)
+    gids = array.array(_TYPECODE)
+    gids.fromstring(data)
+    # GIDs are little endian
+    if sys.byteorder == 'big':
+        gids.byteswap()
+    return gids
+
+
+def encode_data(gids):
+    ''' Encode an array of GIDs as base64 zlib compressed data '''
+    if sys.byteorder == 'big':
+        gids = array.array(_TYPECODE, gids)
+        gids.byteswap()
+    return base64.b64encode(zlib.compress(gids.tostring()))
+
+
+def chunks_in(pos, size, chunk_size=CHUNK_SIZE):
+    ''' Return the coordinates of the chunks covering an area '''
+    return [(x, y)
+            for y in xrange(pos[1] // chunk_size,
+                (pos[1] + size[1] - 1) // chunk_size + 1)
+            for x in xrange(pos[0] // chunk_size,
+                (pos[0] + size[0] - 1) // chunk_size + 1)]
+
+
+class TileLayer(object):
+
+    ''' A layer of tiles, decoded when first needed '''
+
+    def __init__(self, name, size, text=None, encoding=None,
+            compression=None, chunk_size=CHUNK_SIZE):
+        self.name = name
+        self.size = size
+        self.chunk_size = chunk_size
+        self._text = text
+        self._encoding = encoding
+        self._compression = compression
+        self._gids = None
+
+    @classmethod
+    def from_element(cls, element):
+        ''' Create a layer from a <layer> tag, without decoding it '''
+        size = int(element.attrib['width']), int(element.attrib['height'])
+        data = element.find('data')
+        text = encoding = compression = None
+        if data is not None and data.text and data.text.strip():
+            text = data.text
+            encoding = data.attrib.get('encoding')
+            compression = data.attrib.get('compression')
+        return cls(element.attrib['name'], size, text, encoding, compression)
+
+    @property
+    def decoded(self):
+        ''' True if the tile data has been decoded '''
+        return self._gids is not None
+
+    @property
+    def gids(self):
+        ''' The array of GIDs, row by row '''
+        if self._gids is None:
+            if self._text is None:
+                # No data received yet: every tile is empty
+                self._gids = array.array(_TYPECODE,
+                        [0]) * (self.size[0] * self.size[1])
+            else:
+                self._gids = decode_data(self._text, self._encoding,
+                        self._compression)
+                if len(self._gids) != self.size[0] * self.size[1]:
+                    raise ValueError("Layer '%s' has %d tiles instead of "
+                            "%d" % (self.name, len(self._gids),
+                                self.size[0] * self.size[1]))
+            # The text is not needed anymore
+            self._text = None
+        return self._gids
+
+    def get(self, pos):
+        ''' Return the GID of a tile '''
+        return self.gids[pos[1] * self.size[0] + pos[0]]
+
+    def _chunk_area(self, chunk):
+        ''' Return pos and size of a chunk, clipped to the layer '''
+        pos = chunk[0] * self.chunk_size, chunk[1] * self.chunk_size
+        if not (0 <= pos[0] < self.size[0] and 0 <= pos[1] < self.size[1]):
+            raise IndexError('Chunk %r is out of the layer' % (chunk, ))
+        size = (min(self.chunk_size, self.size[0] - pos[0]),
+                min(self.chunk_size, self.size[1] - pos[1]))
+        return pos, size
+
+    def get_chunk(self, chunk):
+        ''' Return pos, size and the array of GIDs of a chunk '''
+        pos, size = self._chunk_area(chunk)
+        gids = self.gids
+        width = self.size[0]
+        chunk_gids = array.array(_TYPECODE)
+        for y in xrange(pos[1], pos[1] + size[1]):
+            start = y * width + pos[0]
+            chunk_gids.extend(gids[start:start + size[0]])
+        return pos, size, chunk_gids
+
+    def set_chunk(self, pos, size, chunk_gids):
+        ''' Write the GIDs of a chunk received from the server '''
+        gids = self.gids
+        width = self.size[0]
+        for row in xrange(size[1]):
+            start = (pos[1] + row) * width + pos[0]
+            gids[start:start + size[0]] = chunk_gids[row * size[0]:
+                    (row + 1) * size[0]]
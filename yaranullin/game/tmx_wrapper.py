@@ -15,11 +15,17 @@
 # OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
 
 import os
+import collections
+import logging
 
 from xml.etree import ElementTree
 
+LOGGER = logging.getLogger(__name__)
+
 from yaranullin.config import YR_SAVE_DIR
-from yaranullin.event_system import post, connect
+from yaranullin.event_system import get_bus
+from yaranullin.game.tile_layer import TileLayer, decode_data
+from yaranullin.game import binboard
 
 
 class ParseError(SyntaxError):
@@ -54,43 +60,131 @@ def _set_property(tag, name, value):
     properties.append(ElementTree.Element('property', name=name, value=value))
 
 
+def move_pawn_object(tmx_map, pname, pos, size=None):
+    ''' Move the object of a pawn to pos, given in tiles '''
+    tilewidth = int(tmx_map.attrib['tilewidth'])
+    pawn_layer = _get_object_layer(tmx_map, 'pawns')
+    if pawn_layer is None:
+        return
+    for pawn in pawn_layer.findall('object'):
+        if pawn.attrib['name'] == pname:
+            # Attributes are strings, in pixels
+            pawn.attrib['x'] = str(pos[0] * tilewidth)
+            pawn.attrib['y'] = str(pos[1] * tilewidth)
+            if size is not None:
+                pawn.attrib['width'] = str(size[0] * tilewidth)
+                pawn.attrib['height'] = str(size[1] * tilewidth)
+
+
+def tostring_without_tiles(tmx_map):
+    ''' Return the tmx string of a map without the data of its layers '''
+    stripped = []
+    for data in tmx_map.findall('layer/data'):
+        stripped.append((data, data.text))
+        data.text = None
+    try:
+        return ElementTree.tostring(tmx_map)
+    finally:
+        for data, text in stripped:
+            data.text = text
+
+
 class TmxWrapper(object):
 
-    def __init__(self):
+    def __init__(self, bus=None):
+        self.bus = get_bus(bus)
         self._maps = {}
-        connect('game-event-pawn-moved', self.move_pawn)
+        self._layers = {}
+        # Boards loaded from a binary file whose tmx was not needed yet, with
+        # the moves of their pawns
+        self._skeletons = {}
+        # Boards whose tmx has no tile data yet
+        self._unfilled = set()
+        self.bus.connect('game-event-pawn-moved', self.move_pawn)
 
-    def move_pawn(self, event_dict):
-        ''' Change pawn position '''
-        bname = event_dict['bname']
-        pname = event_dict['pname']
-        pos = event_dict['pos']
+    def _get_map(self, bname):
+        ''' Return the tmx map of a board or None '''
+        try:
+            return self._maps[bname]
+        except KeyError:
+            pass
         try:
-            xml_board = self._maps[bname]
+            board, moves = self._skeletons.pop(bname)
         except KeyError:
             # The board was not loaded from a file
             return
-        pawn_layer = _get_object_layer(xml_board, 'pawns')
-        for pawn in pawn_layer.findall('object'):
-            name = pawn.attrib['name']
-            if name == pname:
-                pawn.attrib['x'] = pos[0]
-                pawn.attrib['y'] = pos[1]
+        tmx_map = ElementTree.fromstring(board.skeleton)
+        for pname, (pos, size) in moves.iteritems():
+            move_pawn_object(tmx_map, pname, pos, size)
+        self._maps[bname] = tmx_map
+        self._unfilled.add(bname)
+        return tmx_map
+
+    def move_pawn(self, event_dict):
+        ''' Change pawn position '''
+        bname = event_dict['bname']
+        if bname in self._skeletons:
+            # Applied when the tmx is needed
+            moves = self._skeletons[bname][1]
+            moves[event_dict['pname']] = (event_dict['pos'],
+                    event_dict.get('size'))
+            return
+        xml_board = self._get_map(bname)
+        if xml_board is None:
+            return
+        move_pawn_object(xml_board, event_dict['pname'], event_dict['pos'],
+                event_dict.get('size'))
 
     def load_board_from_file(self, fname):
-        ''' Load and return a board from a tmx file '''
+        ''' Load and return a board from a tmx file
+
+        A binary board file loads all of its boards.
+
+        '''
         complete_path = os.path.join(YR_SAVE_DIR, fname)
+        if fname.endswith(binboard.SUFFIX):
+            board_file = binboard.BinBoardFile(complete_path)
+            for bname in board_file.names():
+                self.load_board_from_binboard(board_file.get(bname))
+            return
         with open(complete_path) as tmx_file:
             tmx_map = tmx_file.read()
         bname = os.path.splitext(os.path.basename(fname))[0]
         self.load_board_from_tmx(bname, tmx_map)
 
-    def load_board_from_tmx(self, bname, tmx_map):
-        ''' Load and return a board from a string '''
+    def load_board_from_binboard(self, board):
+        ''' Load a board of a binary file (see yaranullin.game.binboard)
+
+        No tmx is parsed: the board and its pawns come from the tables of
+        the file and the tiles are read from it when needed.
+
+        '''
+        bname = board.name
+        self._maps.pop(bname, None)
+        self._unfilled.discard(bname)
+        self._skeletons[bname] = board, collections.OrderedDict()
+        self._layers[bname] = dict((layer.name, layer) for layer in
+                board.layers())
+        self.bus.post('game-request-board-new', name=bname, size=board.size)
+        for pawn in board.pawns():
+            self.bus.post('game-request-pawn-new', bname=bname,
+                    pname=pawn.name, initiative=pawn.initiative,
+                    pos=pawn.pos, size=pawn.size)
+
+    def load_board_from_tmx(self, bname, tmx_map, moves=()):
+        ''' Load and return a board from a string
+
+        The pawns in 'moves' (a list of dictionaries with pname, pos and
+        size) are placed at their new position.
+
+        '''
         try:
             tmx_map = ElementTree.fromstring(tmx_map)
         except:
             raise ParseError("Error parsing '%s'" % bname)
+        for move in moves:
+            move_pawn_object(tmx_map, move['pname'], move['pos'],
+                    move.get('size'))
         events = []
         # Save basic board attribute
         size = int(tmx_map.attrib['width']), int(tmx_map.attrib['height'])
@@ -119,12 +213,91 @@ class TmxWrapper(object):
                         pname=name, initiative=initiative, pos=pos,
                         size=size))
                 events.append(new_pawn_event)
+        # The tile layers are decoded only when needed
+        layers = {}
+        for layer in tmx_map.findall('layer'):
+            layers[layer.attrib['name']] = TileLayer.from_element(layer)
         # Now add the board to _maps
         self._maps[bname] = tmx_map
+        self._skeletons.pop(bname, None)
+        self._unfilled.discard(bname)
+        self._layers[bname] = layers
         for event in events:
-            post(event[0], event[1])
+            self.bus.post(event[0], event[1])
+
+    def is_paged(self, bname):
+        ''' Tell if the tiles of a board are still only in its binary file '''
+        return bname in self._skeletons or bname in self._unfilled
+
+    def get_resources(self, bname):
+        ''' Return the names of the files referenced by a board '''
+        names = set()
+        tmx_map = self._get_map(bname)
+        if tmx_map is not None:
+            for tag in ('tileset', 'tileset/image', 'imagelayer/image'):
+                for element in tmx_map.findall(tag):
+                    if 'source' in element.attrib:
+                        names.add(element.attrib['source'])
+        return names
+
+    def get_layer(self, bname, lname):
+        ''' Return a tile layer of a board or None '''
+        return self._layers.get(bname, {}).get(lname)
+
+    def get_layers(self, bname):
+        ''' Return the tile layers of a board '''
+        return self._layers.get(bname, {}).values()
+
+    def get_tile_properties(self, bname, name):
+        ''' Return a property of the tiles of a board by GID '''
+        values = {}
+        tmx_map = self._get_map(bname)
+        if tmx_map is None:
+            return values
+        for tileset in tmx_map.findall('tileset'):
+            firstgid = int(tileset.attrib.get('firstgid', 1))
+            for tile in tileset.findall('tile'):
+                try:
+                    values[firstgid + int(tile.attrib['id'])] = \
+                            _get_property(tile, name)
+                except KeyError:
+                    continue
+        return values
+
+    def get_tile_costs(self, bname):
+        ''' Return the 'cost' properties of the tiles of a board by GID '''
+        costs = {}
+        for gid, cost in self.get_tile_properties(bname, 'cost').iteritems():
+            try:
+                costs[gid] = int(cost)
+            except ValueError:
+                LOGGER.warning("Invalid cost of tile %d in board '%s'", gid,
+                        bname)
+        return costs
+
+    def get_opaque_tiles(self, bname):
+        ''' Return the GIDs of the tiles of a board blocking the sight '''
+        return set(gid for gid, value in self.get_tile_properties(bname,
+            'opaque').iteritems() if value.lower() in ('1', 'true', 'yes'))
+
+    def set_chunk(self, bname, lname, pos, size, data):
+        ''' Write a chunk of a tile layer received from the server '''
+        layer = self.get_layer(bname, lname)
+        if layer is None:
+            raise KeyError("No layer '%s' in board '%s'" % (lname, bname))
+        layer.set_chunk(pos, size, decode_data(data, 'base64', 'zlib'))
+
+    def get_tmx_board(self, bname, lazy_layers=False):
+        ''' Return an tmx version of board
+
+        With lazy_layers the tile data is left out, to be fetched in chunks.
 
-    def get_tmx_board(self, bname):
-        ''' Return an tmx version of board '''
-        if bname in self._maps:
-            return ElementTree.tostring(self._maps[bname])
+        '''
+        tmx_map = self._get_map(bname)
+        if tmx_map is not None:
+            if lazy_layers:
+                return tostring_without_tiles(tmx_map)
+            if bname in self._unfilled:
+                binboard.fill_tiles(tmx_map, self._layers[bname])
+                self._unfilled.discard(bname)
+            return ElementTree.tostring(tmx_map)
@@ -0,0 +1,359 @@
+# yaranullin/game/visibility.py
+#
+# Copyright (c) 2012 Marco Scopesi <marco.scopesi@gmail.com>
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+''' Field of view of the pawns and fog of war.
+
+A pawn sees the cells within a radius that are not hidden by a tile with an
+'opaque' property; pawns do not block the sight, so the field of view of a
+pawn only changes when the pawn moves and only the pawns that moved are
+computed again.
+
+The field of view is found by symmetric shadowcasting, a whole line of
+cells at a time: the opaque cells of a board and the cells seen are kept as
+bitsets, one integer per row (and one per column for the quadrants looking
+east and west), so a line is scanned and revealed with a few operations on
+integers instead of a loop on its cells.
+
+A client can ask to see a board through some pawns (its characters): the
+server then only sends it the pawns they see.
+
+'''
+
+import math
+import collections
+import logging
+
+LOGGER = logging.getLogger(__name__)
+
+from yaranullin.event_system import get_bus
+from yaranullin.game.pathfinding import GID_MASK
+from yaranullin.game.tile_layer import chunks_in
+
+
+def _runs(bits):
+    ''' Yield first and last bit of every run of set bits of an integer '''
+    while bits:
+        low = bits & -bits
+        first = low.bit_length() - 1
+        # Adding the lowest bit clears the run and sets the bit after it
+        carried = bits + low
+        last = (carried & ~bits).bit_length() - 2
+        bits &= carried
+        yield first, last
+
+
+def _bits(bits):
+    ''' Yield the positions of the set bits of an integer '''
+    for first, last in _runs(bits):
+        for index in xrange(first, last + 1):
+            yield index
+
+
+def _mask(first, last):
+    ''' Return an integer with the bits from first to last set '''
+    first = max(first, 0)
+    if first > last:
+        return 0
+    return ((1 << (last - first + 1)) - 1) << first
+
+
+def _scan(lines, length, line0, pos0, direction, radius, seen):
+    ''' Reveal a quadrant in seen, line by line
+
+    The quadrant starts at cell pos0 of line line0 and moves through the
+    lines in the given direction. Slopes are fractions (numerator,
+    denominator).
+
+    '''
+    pending = [(1, (-1, 1), (1, 1))]
+    while pending:
+        depth, start, end = pending.pop()
+        line = line0 + direction * depth
+        if depth > radius or not 0 <= line < len(lines):
+            continue
+        # First and last cells touched by the slopes, relative to pos0
+        low = (2 * depth * start[0] + start[1]) // (2 * start[1])
+        high = -((end[1] - 2 * depth * end[0]) // (2 * end[1]))
+        # The cells out of the board are walls
+        span = _mask(pos0 + low, min(pos0 + high, length - 1))
+        if not span:
+            continue
+        walls = lines[line] & span
+        floors = span & ~walls
+        # Only the floors whose center is between the slopes are seen, so
+        # that sight is symmetric; walls are seen anyway
+        reach = int(math.sqrt(radius * radius - depth * depth))
+        circle = _mask(pos0 - reach, pos0 + reach)
+        centered = _mask(pos0 - ((-depth * start[0]) // start[1]),
+                pos0 + (depth * end[0]) // end[1])
+        seen[line] = seen.get(line, 0) | (walls & circle) | (floors &
+                circle & centered)
+        for first, last in _runs(floors):
+            new_start = start
+            if first != pos0 + low:
+                new_start = (2 * (first - pos0) - 1, 2 * depth)
+            new_end = end
+            if last != pos0 + high:
+                new_end = (2 * (last + 1 - pos0) - 1, 2 * depth)
+            pending.append((depth + 1, new_start, new_end))
+
+
+class Opacity(object):
+
+    ''' Opaque cells of a board, as bitsets by row and by column '''
+
+    def __init__(self, size):
+        self.size = size
+        self.rows = [0] * size[1]
+        self.cols = [0] * size[0]
+
+    @classmethod
+    def from_layers(cls, size, layers, opaque_gids):
+        ''' Find the opaque tiles of some tile layers '''
+        opacity = cls(size)
+        if not opaque_gids:
+            return opacity
+        for layer in layers:
+            for chunk in chunks_in((0, 0), size, layer.chunk_size):
+                pos, chunk_size, gids = layer.get_chunk(chunk)
+                for index, gid in enumerate(gids):
+                    if gid & GID_MASK in opaque_gids:
+                        row, col = divmod(index, chunk_size[0])
+                        opacity.add((pos[0] + col, pos[1] + row))
+        return opacity
+
+    def add(self, pos):
+        ''' Make a cell opaque '''
+        self.rows[pos[1]] |= 1 << pos[0]
+        self.cols[pos[0]] |= 1 << pos[1]
+
+
+class Sight(object):
+
+    ''' Cells seen, as bitsets by row and by column '''
+
+    def __init__(self):
+        self.rows = {}
+        self.cols = {}
+
+    def update(self, other):
+        ''' Add the cells seen by other '''
+        for mine, others in ((self.rows, other.rows),
+                (self.cols, other.cols)):
+            for line, bits in others.iteritems():
+                mine[line] = mine.get(line, 0) | bits
+
+    def sees(self, pos, size):
+        ''' Return True if a cell of an area is seen '''
+        bits = _mask(pos[0], pos[0] + size[0] - 1)
+        for row in xrange(pos[1], pos[1] + size[1]):
+            if self.rows.get(row, 0) & bits:
+                return True
+        bits = _mask(pos[1], pos[1] + size[1] - 1)
+        for col in xrange(pos[0], pos[0] + size[0]):
+            if self.cols.get(col, 0) & bits:
+                return True
+        return False
+
+    def cells(self):
+        ''' Return the set of the cells seen '''
+        cells = set()
+        for row, bits in self.rows.iteritems():
+            cells.update((col, row) for col in _bits(bits))
+        for col, bits in self.cols.iteritems():
+            cells.update((col, row) for row in _bits(bits))
+        return cells
+
+
+def field_of_view(opacity, pos, radius):
+    ''' Return the Sight of a cell '''
+    sight = Sight()
+    pos_x, pos_y = pos
+    sight.rows[pos_y] = 1 << pos_x
+    width, height = opacity.size
+    for direction in (-1, 1):
+        _scan(opacity.rows, width, pos_y, pos_x, direction, radius,
+                sight.rows)
+        _scan(opacity.cols, height, pos_x, pos_y, direction, radius,
+                sight.cols)
+    return sight
+
+
+class Visibility(object):
+
+    ''' Field of view of the pawns of a board '''
+
+    def __init__(self, board, opacity, radius):
+        self.board = board
+        self.opacity = opacity
+        self.radius = radius
+        # Sight of every pawn and where it was computed
+        self._sights = {}
+
+    def pawn_sight(self, pname):
+        ''' Return the Sight of a pawn, computed again if it moved '''
+        pawn = self.board.pawns[pname]
+        pos, size = tuple(pawn.pos), tuple(pawn.size)
+        try:
+            old_pos, old_size, sight = self._sights[pname]
+        except KeyError:
+            pass
+        else:
+            if old_pos == pos and old_size == size:
+                return sight
+        sight = Sight()
+        # A big pawn sees from all of its cells
+        for pos_x in xrange(pos[0], pos[0] + size[0]):
+            for pos_y in xrange(pos[1], pos[1] + size[1]):
+                sight.update(field_of_view(self.opacity, (pos_x, pos_y),
+                    self.radius))
+        self._sights[pname] = pos, size, sight
+        return sight
+
+    def forget(self, pname):
+        ''' Forget the sight of a pawn '''
+        self._sights.pop(pname, None)
+
+    def get_sight(self, pnames):
+        ''' Return the cells seen by some pawns together '''
+        sight = Sight()
+        for pname in pnames:
+            if pname in self.board.pawns:
+                sight.update(self.pawn_sight(pname))
+        return sight
+
+    def sees(self, sight, pname):
+        ''' Return True if a pawn is inside the cells seen '''
+        pawn = self.board.pawns.get(pname)
+        return pawn is not None and sight.sees(pawn.pos, pawn.size)
+
+    def seen_pawns(self, sight):
+        ''' Return the names of the pawns inside the cells seen '''
+        return set(pname for pname in self.board.pawns if
+                self.sees(sight, pname))
+
+
+class SightService(object):
+
+    ''' Tell the server which pawns every client can see
+
+    A client asks to see a board through some pawns with a
+    'game-request-sight' event; from then on, the service posts a
+    'game-event-sight' event with the pawns they see whenever it changes.
+
+    '''
+
+    def __init__(self, game, tmx_wrapper, radius, bus=None):
+        self.bus = get_bus(bus)
+        self.game = game
+        self.tmx_wrapper = tmx_wrapper
+        self.radius = radius
+        self._visibility = {}
+        # Pawns seeing for every client, by board
+        self._viewers = collections.defaultdict(dict)
+        # Cells and pawns seen by every client, by board and client
+        self._sights = {}
+        self._seen = {}
+        self.bus.connect('game-request-sight', self.set_viewers)
+        self.bus.connect('game-event-pawn-new', self.pawn_changed)
+        self.bus.connect('game-event-pawn-moved', self.pawn_changed)
+        self.bus.connect('game-event-pawn-del', self.pawn_changed)
+        self.bus.connect('game-event-board-del', self.del_board)
+        self.bus.connect('network-client-closed', self.del_client)
+
+    def get_visibility(self, bname):
+        ''' Return the Visibility of a board or None '''
+        board = self.game.boards.get(bname)
+        if board is None:
+            return
+        visibility = self._visibility.get(bname)
+        if visibility is None or visibility.board is not board:
+            opacity = Opacity.from_layers(board.size,
+                    self.tmx_wrapper.get_layers(bname),
+                    self.tmx_wrapper.get_opaque_tiles(bname))
+            visibility = Visibility(board, opacity, self.radius)
+            self._visibility[bname] = visibility
+        return visibility
+
+    def _post(self, bname, client):
+        seen = self._seen.get((bname, client))
+        self.bus.post('game-event-sight', bname=bname, client=client,
+                pnames=None if seen is None else sorted(seen))
+
+    def set_viewers(self, event_dict):
+        ''' Let a client see a board through some pawns, None for all '''
+        bname = event_dict['bname']
+        client = event_dict.get('client')
+        pnames = event_dict.get('pnames')
+        if pnames is None:
+            self._viewers[bname].pop(client, None)
+            self._sights.pop((bname, client), None)
+            self._seen.pop((bname, client), None)
+        else:
+            visibility = self.get_visibility(bname)
+            if visibility is None:
+                LOGGER.warning("Board '%s' not found", bname)
+                return
+            self._viewers[bname][client] = frozenset(pnames)
+            sight = self._sights[bname, client] = visibility.get_sight(
+                    pnames)
+            self._seen[bname, client] = visibility.seen_pawns(sight)
+        self._post(bname, client)
+
+    def pawn_changed(self, event_dict):
+        ''' Update what the clients see after a pawn changed '''
+        bname = event_dict['bname']
+        pname = event_dict['pname']
+        viewers = self._viewers.get(bname)
+        if not viewers:
+            return
+        visibility = self.get_visibility(bname)
+        if visibility is None:
+            return
+        if pname not in visibility.board.pawns:
+            visibility.forget(pname)
+        for client, pnames in viewers.iteritems():
+            key = bname, client
+            seen = self._seen[key]
+            if pname in pnames:
+                # The client sees from somewhere else
+                sight = self._sights[key] = visibility.get_sight(pnames)
+                new_seen = visibility.seen_pawns(sight)
+            else:
+                new_seen = set(seen)
+                if visibility.sees(self._sights[key], pname):
+                    new_seen.add(pname)
+                else:
+                    new_seen.discard(pname)
+            if new_seen != seen:
+                self._seen[key] = new_seen
+                self._post(bname, client)
+
+    def del_board(self, event_dict):
+        ''' Forget a board '''
+        bname = event_dict['name']
+        self._visibility.pop(bname, None)
+        for client in self._viewers.pop(bname, {}):
+            self._sights.pop((bname, client), None)
+            self._seen.pop((bname, client), None)
+
+    def del_client(self, event_dict):
+        ''' Forget a client '''
+        client = event_dict['client']
+        for bname, viewers in self._viewers.items():
+            if viewers.pop(client, None) is not None:
+                self._sights.pop((bname, client), None)
+                self._seen.pop((bname, client), None)
@@ -0,0 +1,258 @@
+# yaranullin/loadgen.py
+#
+# Copyright (c) 2012 Marco Scopesi <marco.scopesi@gmail.com>
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+''' Synthetic load for a Yaranullin server.
+
+Many headless bots connect to a running server, join a board, and send a
+configurable mix of requests at a target rate. Every move carries the time
+it was sent, so the bots receiving its broadcast can measure the fan-out
+latency.
+
+'''
+
+import json
+import time
+import random
+import asyncore
+import collections
+import multiprocessing
+import logging
+
+from Queue import Empty
+
+LOGGER = logging.getLogger(__name__)
+
+from yaranullin import startup
+from yaranullin.network.base import _EndPoint
+from yaranullin.profiling import percentiles
+
+
+# Requests sent by the bots
+ACTIONS = ('move', 'new', 'resource')
+
+# Cells a bot moves a pawn at most, along each axis
+MOVE_DISTANCE = 3
+
+
+def parse_mix(mix):
+    ''' Parse a mix like 'move=8,new=1' into a list of (action, weight) '''
+    weights = []
+    for item in mix.split(','):
+        action, _, weight = item.partition('=')
+        action = action.strip()
+        if action not in ACTIONS:
+            raise ValueError("Unknown action '%s'" % action)
+        weights.append((action, float(weight or 1)))
+    return weights
+
+
+class Bot(_EndPoint):
+
+    ''' A client sending requests without any user interface '''
+
+    def __init__(self, name, options, stats):
+        _EndPoint.__init__(self)
+        self.name = name
+        self.options = options
+        self.stats = stats
+        self.random = random.Random(name)
+        self.pawns = []
+        # Where every pawn was sent last
+        self.positions = {}
+        self.next_time = time.time()
+        self.connect((options['host'], options['port']))
+
+    def send_event(self, event, **event_dict):
+        ''' Queue an event for the server '''
+        event_dict['event'] = event
+        self._add_to_out_buffer(json.dumps(event_dict))
+        self.stats['sent'] += 1
+        self.stats['sent-' + event] += 1
+
+    def join(self):
+        ''' Ask for the game and put a pawn on the board '''
+        self.send_event('game-request-update')
+        self.new_pawn()
+
+    def _random_pos(self):
+        size = self.options['board_size']
+        return (self.random.randrange(size), self.random.randrange(size))
+
+    def new_pawn(self):
+        ''' Create a new pawn of this bot '''
+        pname = '%s-%d' % (self.name, len(self.pawns))
+        self.pawns.append(pname)
+        self.positions[pname] = self._random_pos()
+        self.send_event('game-request-pawn-new', bname=self.options['board'],
+                pname=pname, initiative=self.random.randrange(30),
+                pos=self.positions[pname], size=(1, 1))
+
+    def move_pawn(self):
+        ''' Move one of the pawns of this bot a few cells away '''
+        # The server refuses the moves a pawn cannot walk
+        pname = self.random.choice(self.pawns)
+        last = self.options['board_size'] - 1
+        pos = tuple(min(max(coord + self.random.randint(-MOVE_DISTANCE,
+            MOVE_DISTANCE), 0), last) for coord in self.positions[pname])
+        self.positions[pname] = pos
+        self.send_event('game-request-pawn-move',
+                bname=self.options['board'], pname=pname, pos=pos,
+                sent=time.time())
+
+    def request_resource(self):
+        ''' Ask for a resource '''
+        self.send_event('resource-request', name=self.options['resource'])
+
+    def act(self, now):
+        ''' Send the next request if it is time to '''
+        if now < self.next_time:
+            return
+        self.next_time += self.random.expovariate(self.options['rate'])
+        actions = self.options['mix']
+        choice = self.random.uniform(0, sum(w for _, w in actions))
+        for action, weight in actions:
+            choice -= weight
+            if choice <= 0:
+                break
+        if action == 'move' and self.pawns:
+            self.move_pawn()
+        elif action == 'new':
+            self.new_pawn()
+        elif action == 'resource' and self.options['resource']:
+            self.request_resource()
+
+    def consume(self):
+        ''' Read the messages from the server '''
+        while True:
+            data = self._get_from_in_buffer()
+            if not data:
+                break
+            self.stats['received'] += 1
+            self.stats['received-bytes'] += len(data)
+            event_dict = json.loads(data)
+            if 'sent' in event_dict:
+                self.stats['latency'].append(time.time() -
+                        event_dict['sent'])
+
+    def handle_close(self):
+        self.stats['closed'] += 1
+        _EndPoint.handle_close(self)
+
+
+def _run_bots(index, num_bots, options, results):
+    ''' Run num_bots bots for the duration of the test '''
+    stats = collections.defaultdict(int)
+    stats['latency'] = []
+    bots = []
+    for i in xrange(num_bots):
+        bots.append(Bot('bot-%d-%d' % (index, i), options, stats))
+    # The board is created once per process, before any pawn
+    bots[0].send_event('game-request-board-new', name=options['board'],
+            size=(options['board_size'], options['board_size']))
+    for bot in bots:
+        bot.join()
+    end = time.time() + options['duration']
+    while True:
+        now = time.time()
+        if now >= end:
+            break
+        for bot in bots:
+            bot.act(now)
+        asyncore.poll(0.001)
+        for bot in bots:
+            bot.consume()
+    # Keep receiving for a while to collect the last broadcasts
+    drain = time.time() + 1
+    while time.time() < drain:
+        asyncore.poll(0.01)
+        for bot in bots:
+            bot.consume()
+    for bot in bots:
+        bot.close()
+    results.put(dict(stats))
+
+
+def _server_memory(pid):
+    ''' Return the resident memory of a process in kB, or None '''
+    try:
+        with open('/proc/%d/status' % pid) as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except (IOError, ValueError):
+        return
+
+
+def run(args):
+    ''' Put the load on a server and report what happened '''
+    startup.done()
+    options = dict(host=args.host, port=args.port, board=args.board,
+            board_size=args.board_size, rate=args.rate,
+            mix=parse_mix(args.mix), resource=args.resource,
+            duration=args.duration)
+    memory_before = _server_memory(args.server_pid) if args.server_pid \
+            else None
+    results = multiprocessing.Queue()
+    processes = []
+    per_process, remainder = divmod(args.clients, args.processes)
+    for index in xrange(args.processes):
+        num_bots = per_process + (1 if index < remainder else 0)
+        if not num_bots:
+            continue
+        process = multiprocessing.Process(target=_run_bots,
+                args=(index, num_bots, options, results))
+        process.start()
+        processes.append(process)
+    LOGGER.info('Started %d bots in %d processes', args.clients,
+            len(processes))
+    memory_peak = memory_before
+    totals = collections.defaultdict(int)
+    latency = []
+    done = 0
+    # The processes which died without their results
+    failed = set()
+    while done + len(failed) < len(processes):
+        # Sample the memory of the server while waiting for the bots
+        try:
+            stats = results.get(timeout=1)
+        except Empty:
+            if args.server_pid:
+                memory = _server_memory(args.server_pid)
+                if memory is not None:
+                    memory_peak = max(memory_peak, memory)
+            for process in processes:
+                if process.exitcode not in (None, 0) and \
+                        process not in failed:
+                    LOGGER.error('Bot process %s died with exit code %d',
+                            process.name, process.exitcode)
+                    failed.add(process)
+            continue
+        done += 1
+        latency.extend(stats.pop('latency'))
+        for key, value in stats.iteritems():
+            totals[key] += value
+    for process in processes:
+        process.join()
+    report = dict(clients=args.clients, processes=len(processes),
+            failed_processes=len(failed),
+            duration=args.duration, totals=dict(totals),
+            sent_per_second=totals['sent'] / float(args.duration),
+            received_per_second=totals['received'] / float(args.duration),
+            fanout_latency=percentiles(latency))
+    if args.server_pid:
+        report['server_memory_kb'] = dict(before=memory_before,
+                peak=memory_peak, after=_server_memory(args.server_pid))
+    print json.dumps(report, indent=2, sort_keys=True)
@@ -20,6 +20,16 @@ import logging
 LOGGER = logging.getLogger(__name__)
 
 from yaranullin.config import __version__, __platform__
+from yaranullin import startup
+
+
+def _positive_int(value):
+    ''' Argument type for the integers greater than zero '''
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError('%s is not a positive integer' %
+                value)
+    return number
 
 
 def main():
@@ -27,6 +37,16 @@ def main():
     parser = argparse.ArgumentParser(description='Launches Yaranullin')
     parser.add_argument('--debug', action='store_true',
                         help='Print debugging information')
+    parser.add_argument('--profile-events', action='store_true',
+                        help='Collect statistics about events and handlers')
+    parser.add_argument('--stats-interval', action='store', type=float,
+                        help='Log event statistics every STATS_INTERVAL '
+                        'seconds')
+    parser.add_argument('--stats-port', action='store', type=int,
+                        help='Serve event statistics as JSON on a local port')
+    parser.add_argument('--profile-startup', action='store_true',
+                        help='Log the time spent importing the modules and '
+                        'initializing before the main loop')
     parser.add_argument('--version', action='version',
                         version='Yaranullin ' + __version__ + ' on ' +
                         __platform__)
@@ -36,12 +56,89 @@ def main():
                         help='Specify the address of the server')
     client_parser.add_argument('--port', action='store', type=int,
                         help='Specify the port of the server')
+    client_parser.add_argument('--table', '-t', action='store', type=str,
+                        help='Join the table TABLE of a server hosting many')
+    client_parser.add_argument('--unix', action='store', type=str,
+                        help='Join a server of this machine through the Unix '
+                        'socket UNIX')
+    client_parser.add_argument('--local', action='store_true',
+                        help='Run the game in this process, without network')
+    client_parser.add_argument('--board', '-b', action='append', default=[],
+                        help='Board to load in the game run with --local')
     server_parser = subparsers.add_parser('server', help='Launch the server')
     server_parser.add_argument('--board', '-b', action='append', default=[],
                         help='Specify a board to load. More value can be '
                         'provided to load multiple boards')
+    server_parser.add_argument('--journal', action='store', type=str,
+                        help='Keep a journal of the game in JOURNAL and '
+                        'recover the game from it at startup')
+    server_parser.add_argument('--record', action='store', type=str,
+                        help='Record the network events to a log in RECORD')
+    server_parser.add_argument('--unix', action='store', type=str,
+                        help='Listen on the Unix socket UNIX instead of TCP, '
+                        'for clients on the same machine')
+    server_parser.add_argument('--table', '-t', action='append', default=[],
+                        help='Host a table named TABLE on the same port. More '
+                        'values can be provided to host many independent '
+                        'games; every table loads the given boards')
+    replay_parser = subparsers.add_parser('replay', help='Replay a session '
+                        'recorded by a server')
+    replay_parser.add_argument('log', help='Log recorded with server --record')
+    replay_parser.add_argument('--speed', '-s', action='store', type=float,
+                        default=1, help='Speed factor of the replay, 0 to '
+                        'replay as fast as possible')
+    replay_parser.add_argument('--start', action='store', type=float,
+                        default=0, help='Seconds of the log to replay as fast '
+                        'as possible before keeping the speed factor')
+    replay_parser.add_argument('--stop', action='store', type=float,
+                        help='Stop after this many seconds of the log')
+    replay_parser.add_argument('--host', action='store', type=str,
+                        default='127.0.0.1',
+                        help='Address of the server to replay the log to')
+    replay_parser.add_argument('--port', action='store', type=int,
+                        help='Port of the server to replay the log to; '
+                        'without it the log is replayed in this process')
+    replay_parser.add_argument('--board', '-b', action='append', default=[],
+                        help='Board to load before a replay in this process')
+    convert_parser = subparsers.add_parser('convert', help='Convert tmx '
+                        'boards to a binary board file or back')
+    convert_parser.add_argument('files', nargs='+', help='tmx files, or '
+                        'binary board files to turn into tmx files')
+    convert_parser.add_argument('--output', '-o', required=True,
+                        help='Binary board file to write (ending in .yrb) or '
+                        'folder for the tmx files')
+    load_parser = subparsers.add_parser('load', help='Put a synthetic '
+                        'load on a running server')
+    load_parser.add_argument('--host', action='store', type=str,
+                        default='127.0.0.1',
+                        help='Specify the address of the server')
+    load_parser.add_argument('--port', action='store', type=int,
+                        help='Specify the port of the server')
+    load_parser.add_argument('--clients', '-c', action='store', type=int,
+                        default=10, help='Number of bots')
+    load_parser.add_argument('--processes', '-p', action='store',
+                        type=_positive_int, default=1,
+                        help='Number of processes running the bots')
+    load_parser.add_argument('--duration', '-d', action='store', type=float,
+                        default=10, help='Duration of the test in seconds')
+    load_parser.add_argument('--rate', '-r', action='store', type=float,
+                        default=5, help='Requests per second of every bot')
+    load_parser.add_argument('--mix', action='store', default='move=1',
+                        help='Weights of the requests, e.g. '
+                        'move=8,new=1,resource=1')
+    load_parser.add_argument('--board', action='store', default='load-test',
+                        help='Name of the board used by the bots')
+    load_parser.add_argument('--board-size', action='store', type=int,
+                        default=100, help='Size of the board')
+    load_parser.add_argument('--resource', action='store',
+                        help='Name of the resource requested by the bots')
+    load_parser.add_argument('--server-pid', action='store', type=int,
+                        help='Pid of the server, to report its memory')
     args = parser.parse_args()
 
+    if args.profile_startup:
+        startup.enable()
+
     # Set logging level
     level = logging.INFO
     fmt = '%(levelname)s:%(message)s'
@@ -50,11 +147,29 @@ def main():
         level = logging.DEBUG
     logging.basicConfig(format=fmt, level=level)
 
+    # Enable the instrumentation of the event system
+    args.profiler = None
+    if args.profile_events or args.stats_interval or args.stats_port:
+        from yaranullin import profiling
+        args.profiler = profiling.start(args.stats_interval, args.stats_port)
+
+    startup.mark('setup')
+
     # Import the correct runner
     if args.cmd == 'client':
         from yaranullin.run_client import run
     elif args.cmd == 'server':
         from yaranullin.run_server import run
+    elif args.cmd == 'replay':
+        from yaranullin.replay import run
+    elif args.cmd == 'convert':
+        from yaranullin.game.binboard import run
+    elif args.cmd == 'load':
+        from yaranullin.loadgen import run
+        if args.port is None:
+            from yaranullin.config import CONFIG
+            args.port = CONFIG.getint('network', 'port')
+    startup.mark('import')
 
     # Run
     try:
@@ -14,9 +14,16 @@
 # ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
 # OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
 
-'''Base network classes.'''
+'''Base network classes.
+
+End points talk over TCP, over Unix domain sockets (when the address is a
+path) or, inside a single process, by handing the event dictionaries to each
+other without encoding them.
+
+'''
 
 import asyncore
+import weakref
 import struct
 import socket
 import json
@@ -25,19 +32,86 @@ import logging
 
 LOGGER = logging.getLogger(__name__)
 
-from yaranullin.event_system import post, connect
+from yaranullin.event_system import get_bus
 
 
 FORMAT = struct.Struct('!I')  # for messages up to 2**32 - 1 in length
 
 STATE_LEN, STATE_BODY = range(2)
 
+# When not None, a recorder of the messages crossing the end points (see
+# yaranullin.network.recording.Recorder)
+_RECORDER = None
+
+
+def start_recording(recorder):
+    ''' Report every message sent or received to 'recorder' '''
+    global _RECORDER
+    _RECORDER = recorder
+
+
+def stop_recording():
+    ''' Stop recording the messages '''
+    global _RECORDER
+    _RECORDER = None
+
+
+# Servers accepting end points of this process, by name
+_LOCAL_SERVERS = weakref.WeakValueDictionary()
+
+
+def register_local(name, server):
+    ''' Let the end points of this process join 'server' as 'name'
+
+    'server' must have an accept_local(end_point, table) method.
+
+    '''
+    _LOCAL_SERVERS[name] = server
+
+
+def get_local(name):
+    ''' Return the server registered as 'name' or None '''
+    return _LOCAL_SERVERS.get(name)
+
+
+def address_family(address):
+    ''' Return the socket family of an address: a path is a Unix socket '''
+    if isinstance(address, basestring):
+        return socket.AF_UNIX
+    return socket.AF_INET
+
+
+if hasattr(asyncore, 'file_dispatcher'):
+
+    class _WakeupDispatcher(asyncore.file_dispatcher):
+
+        '''Makes asyncore.poll() return when another thread posts.'''
+
+        def __init__(self, wakeup):
+            asyncore.file_dispatcher.__init__(self, wakeup.fileno())
+            self.wakeup = wakeup
+
+        def writable(self):
+            return False
+
+        def handle_read(self):
+            self.wakeup.drain()
+
+
+def wake_on_post(bus=None):
+    ''' Stop waiting for the network as soon as a thread posts on bus '''
+    if not hasattr(asyncore, 'file_dispatcher'):
+        # Without pipes in select() the events posted by the other threads
+        # wait for the timeout of asyncore.poll()
+        return None
+    return _WakeupDispatcher(get_bus(bus).enable_wakeup())
+
 
 class _EndPoint(asyncore.dispatcher):
 
     '''Sends and receives messages across the network.'''
 
-    def __init__(self, sock=None, sockets=None):
+    def __init__(self, sock=None, sockets=None, family=socket.AF_INET):
         LOGGER.debug("Creating network end point...")
         asyncore.dispatcher.__init__(self, sock, sockets)
         self._in_buffer = collections.deque()
@@ -46,15 +120,19 @@ class _EndPoint(asyncore.dispatcher):
         self.len_in_chunks = 0
         self.state = STATE_LEN
         self.lendata = 0
+        # Number of bytes waiting to be sent
+        self.out_bytes = 0
         # XXX remember IPv6...
-        if not sock:
-            self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
-        else:
+        if sock:
             self.set_socket(sock)
+        elif family is not None:
+            self.create_socket(family, socket.SOCK_STREAM)
+        # Without a family the end point has no socket (see EndPoint.link)
         LOGGER.debug("Creating network end point... done")
 
     def _add_to_out_buffer(self, message):
         self._out_buffer.append(FORMAT.pack(len(message)) + message)
+        self.out_bytes += FORMAT.size + len(message)
         LOGGER.debug("Appended message of length %d to the end " +
                 "point out queue", len(message))
 
@@ -80,12 +158,23 @@ class _EndPoint(asyncore.dispatcher):
         self.close()
         LOGGER.debug('Connection closed')
 
+    def close(self):
+        if self.socket is not None:
+            asyncore.dispatcher.close(self)
+
+    def reconnect(self, address):
+        '''Connect to address with a new socket of the right family.'''
+        self.close()
+        self.create_socket(address_family(address), socket.SOCK_STREAM)
+        self.connect(address)
+
     def writable(self):
         return self._out_buffer
 
     def handle_write(self):
         num_sent = self.send(self._out_buffer[0])
         LOGGER.debug("Sent %d bytes of %d", num_sent, len(self._out_buffer[0]))
+        self.out_bytes -= num_sent
         self._out_buffer[0] = self._out_buffer[0][num_sent:]
         if not self._out_buffer[0]:
             self._out_buffer.popleft()
@@ -128,9 +217,40 @@ class EndPoint(_EndPoint):
 
     '''Interface _EndPoint with Yaranullin's event system'''
 
-    def __init__(self, sock=None, sockets=None):
-        _EndPoint.__init__(self, sock, sockets)
-        connect('tick', self.process_queue)
+    # Identify the end point and its side in the recorded messages
+    uid = 0
+    is_server = False
+
+    # The end point of this process receiving the events, if any
+    peer = None
+
+    def __init__(self, sock=None, sockets=None, bus=None,
+            family=socket.AF_INET):
+        _EndPoint.__init__(self, sock, sockets, family)
+        self.bus = get_bus(bus)
+        self.bus.connect('tick', self.process_queue)
+
+    def link(self, peer):
+        '''Exchange events with an end point of this process.
+
+        The events are handed over as dictionaries, without encoding them or
+        going through a socket.
+
+        '''
+        for end_point in (self, peer):
+            if end_point.socket is not None:
+                _EndPoint.close(end_point)
+                end_point.socket = None
+        self.peer = peer
+        peer.peer = self
+
+    def close(self):
+        peer, self.peer = self.peer, None
+        _EndPoint.close(self)
+        if peer is not None and peer.peer is self:
+            # The other side of an in-process link sees the end point close
+            peer.peer = None
+            peer.handle_close()
 
     def check_in_event(self, event_dict):
         '''Check if an event can be posted on the local event manager.'''
@@ -149,19 +269,44 @@ class EndPoint(_EndPoint):
             data = _EndPoint._get_from_in_buffer(self)
             if not data:
                 break
-            event_dict = json.loads(data)
+            if isinstance(data, dict):
+                # From an end point of this process
+                event_dict = data
+            else:
+                if _RECORDER is not None:
+                    _RECORDER.write(self, data, True)
+                event_dict = json.loads(data)
             if not self.check_in_event(event_dict):
-                return
+                continue
             LOGGER.debug("Got event dictionary")
             event = event_dict['event']
-            post(event, event_dict)
+            self.bus.post(event, event_dict)
 
     def post(self, event_dict):
         '''Add an event to the queue of the end_point.'''
         event_dict = dict(event_dict)
         if not self.check_out_event(event_dict):
             return
-        self._add_to_out_buffer(json.dumps(event_dict))
+        if self.peer is not None:
+            self.peer._in_buffer.append(event_dict)
+            return
+        self._send_data(json.dumps(event_dict))
+
+    def post_encoded(self, event_dict, data):
+        '''Add an event already encoded as 'data' to the queue.'''
+        if not self.check_out_event(event_dict):
+            return
+        if self.peer is not None:
+            # The encoded data is shared by many end points, the
+            # dictionary is copied for each one
+            self.peer._in_buffer.append(dict(event_dict))
+            return
+        self._send_data(data)
+
+    def _send_data(self, data):
+        if _RECORDER is not None:
+            _RECORDER.write(self, data, False)
+        self._add_to_out_buffer(data)
         LOGGER.debug("Sent event dictionary")
 
 
@@ -20,8 +20,9 @@ import logging
 
 LOGGER = logging.getLogger(__name__)
 
-from yaranullin.event_system import connect, post
-from yaranullin.network.base import EndPoint
+from yaranullin.config import CONFIG
+from yaranullin.event_system import get_bus
+from yaranullin.network.base import EndPoint, get_local
 
 
 class ClientEndPoint(EndPoint):
@@ -33,22 +34,56 @@ class ClientEndPoint(EndPoint):
 
     """
 
-    def __init__(self):
-        EndPoint.__init__(self)
-        connect('join', self.join)
+    def __init__(self, bus=None):
+        EndPoint.__init__(self, bus=bus)
+        # Ask for the boards without their tiles, to fetch them in chunks
+        self.lazy_layers = CONFIG.getboolean('network', 'lazy-layers')
+        self.bus.connect('join', self.join)
         # Connect the events to send to the sever
-        connect('game-request-pawn-move', self.post)
-        connect('game-request-pawn-place', self.post)
-        connect('game-request-pawn-next', self.post)
-        connect('game-request-update', self.post)
-        connect('resource-request', self.post)
+        self.bus.connect('game-request-pawn-move', self.post)
+        self.bus.connect('game-request-pawn-place', self.post)
+        self.bus.connect('game-request-pawn-next', self.post)
+        self.bus.connect('game-request-update', self.post)
+        self.bus.connect('game-request-board-subscribe', self.post)
+        self.bus.connect('game-request-viewport', self.post)
+        self.bus.connect('game-request-tile-chunks', self.post)
+        self.bus.connect('game-request-pawn-range', self.post)
+        self.bus.connect('game-request-pawn-path', self.post)
+        self.bus.connect('game-request-sight', self.post)
+        self.bus.connect('game-request-pawn-spawn', self.post)
+        self.bus.connect('game-request-undo', self.post)
+        self.bus.connect('game-request-redo', self.post)
+        self.bus.connect('resource-request', self.post)
 
     def join(self, event_dict):
-        """Try to join a remote server."""
+        """Try to join a server.
+
+        The server can be in this process ('local' is the name it was
+        registered with), behind a Unix domain socket ('path') or at a
+        TCP address ('host' and 'port').
+
+        """
         # XXX We should reconnect if the connection goes down but
         # prevent a reconnection if connection is ok.
-        host = event_dict['host']
-        port = event_dict['port']
-        self.connect((host, port))
-        LOGGER.debug('Connecting to %s:%d', host, port)
-        post('game-request-update')
+        table = event_dict.get('table')
+        if event_dict.get('local') is not None:
+            server = get_local(event_dict['local'])
+            if server is None:
+                LOGGER.error("No server named '%s' in this process",
+                        event_dict['local'])
+                return
+            server.accept_local(self, table)
+            LOGGER.debug("Joined local server '%s'", event_dict['local'])
+            table = None
+        elif event_dict.get('path') is not None:
+            self.reconnect(event_dict['path'])
+            LOGGER.debug('Connecting to %s', event_dict['path'])
+        else:
+            host = event_dict['host']
+            port = event_dict['port']
+            self.connect((host, port))
+            LOGGER.debug('Connecting to %s:%d', host, port)
+        if table is not None:
+            # The server hosts many tables: choose one first
+            self.post(dict(event='table-join', table=table))
+        self.bus.post('game-request-update', lazy_layers=self.lazy_layers)
@@ -0,0 +1,100 @@
+# yaranullin/network/recording.py
+#
+# Copyright (c) 2012 Marco Scopesi <marco.scopesi@gmail.com>
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+''' Recording of the events crossing the network end points.
+
+A log starts with MAGIC and holds a record for every message sent or
+received: a header with the time, the direction of the message, the uid of
+the end point and the length of the message, followed by the message itself
+(the JSON encoded event dictionary).
+
+'''
+
+import json
+import time
+import struct
+import collections
+import logging
+
+LOGGER = logging.getLogger(__name__)
+
+
+MAGIC = 'YRNREC\x00\x01'
+
+HEADER = struct.Struct('!dBII')
+
+# Directions of a message
+TO_SERVER, TO_CLIENT = range(2)
+
+# Maximum time (in seconds) the records stay in the buffers of the log
+FLUSH_INTERVAL = 1.0
+
+Record = collections.namedtuple('Record', 'time direction client event_dict')
+
+
+class Recorder(object):
+
+    ''' Append the messages of the end points to a log '''
+
+    def __init__(self, path):
+        self.path = path
+        self.records = 0
+        self._last_flush = time.time()
+        self._file = open(path, 'wb')
+        self._file.write(MAGIC)
+        LOGGER.info("Recording the network events to '%s'", path)
+
+    def write(self, end_point, data, incoming):
+        ''' Record a message sent or received by an end point '''
+        if self._file is None:
+            return
+        if incoming == end_point.is_server:
+            direction = TO_SERVER
+        else:
+            direction = TO_CLIENT
+        now = time.time()
+        self._file.write(HEADER.pack(now, direction, end_point.uid,
+            len(data)))
+        self._file.write(data)
+        self.records += 1
+        if now - self._last_flush >= FLUSH_INTERVAL:
+            # Lose at most the last second of a crashed session
+            self._file.flush()
+            self._last_flush = now
+
+    def close(self):
+        ''' Close the log '''
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            LOGGER.info("Recorded %d network events", self.records)
+
+
+def read_log(path):
+    ''' Yield the records of a log '''
+    with open(path, 'rb') as log:
+        if log.read(len(MAGIC)) != MAGIC:
+            raise ValueError("'%s' is not a log of network events" % path)
+        while True:
+            header = log.read(HEADER.size)
+            if len(header) < HEADER.size:
+                break
+            time_, direction, client, length = HEADER.unpack(header)
+            data = log.read(length)
+            if len(data) < length:
+                LOGGER.warning("Truncated record at the end of '%s'", path)
+                break
+            yield Record(time_, direction, client, json.loads(data))
@@ -0,0 +1,75 @@
+# yaranullin/network/resource.py
+#
+# Copyright (c) 2012 Marco Scopesi <marco.scopesi@gmail.com>
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+''' Chunked transfer of resources.
+
+A resource is never sent as a whole: it is read from disk one chunk at a
+time and every chunk travels inside its own 'resource-chunk' event, so the
+messages of the game can be interleaved with the transfer.
+
+'''
+
+import os
+import base64
+import logging
+
+LOGGER = logging.getLogger(__name__)
+
+
+CHUNK_SIZE = 65536
+
+
+def find_resource(name, folders):
+    ''' Return the path of the resource 'name' or None '''
+    for folder in folders:
+        folder = os.path.abspath(folder)
+        path = os.path.abspath(os.path.join(folder, name))
+        # Never serve a file outside the given folders
+        if not path.startswith(folder + os.sep):
+            LOGGER.warning("Refusing to serve resource '%s'", name)
+            return
+        if os.path.isfile(path):
+            return path
+
+
+class ResourceStream(object):
+
+    ''' Read a resource from disk one chunk at a time '''
+
+    def __init__(self, name, path, offset=0):
+        self.name = name
+        self._file = open(path, 'rb')
+        self.size = os.fstat(self._file.fileno()).st_size
+        self.offset = max(0, min(offset, self.size))
+        self._file.seek(self.offset)
+        self.done = False
+
+    def next_chunk(self):
+        ''' Return the event dictionary of the next chunk '''
+        data = self._file.read(CHUNK_SIZE)
+        chunk = dict(event='resource-chunk', name=self.name,
+                offset=self.offset, size=self.size,
+                data=base64.b64encode(data))
+        self.offset += len(data)
+        if self.offset >= self.size:
+            # An empty resource is sent as a single empty chunk
+            self.close()
+        return chunk
+
+    def close(self):
+        ''' Close the underlying file '''
+        self._file.close()
+        self.done = True
@@ -15,42 +15,659 @@
 # OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
 
 
+import os
+import stat
+import time
+import json
 import socket
 import asyncore
+import itertools
+import collections
+import weakref
 import logging
 
+from xml.etree import ElementTree
+
 LOGGER = logging.getLogger(__name__)
 
-from yaranullin.event_system import connect
-from yaranullin.network.base import EndPoint
+from yaranullin.config import YR_SAVE_DIR, YR_FONT_DIR, CONFIG
+from yaranullin.event_system import get_bus
+from yaranullin.network.base import EndPoint, _EndPoint, address_family
+from yaranullin.network.resource import ResourceStream, find_resource
+from yaranullin.game.spatial import SpatialIndex, overlaps
+
+
+# Folders where the server looks for the resources requested by clients
+RESOURCE_DIRS = (YR_SAVE_DIR, YR_FONT_DIR)
+
+# The requests tagged with the uid of the client sending them: only that
+# client needs the answer, and the moves of the clients are limited by the
+# game
+CLIENT_REQUESTS = frozenset(['game-request-update',
+    'game-request-tile-chunks', 'game-request-pawn-range',
+    'game-request-pawn-path', 'game-request-sight',
+    'game-request-pawn-move'])
+
+_UIDS = itertools.count(1)
+
+
+def _remove_stale_socket(path):
+    """Remove a Unix socket left by a server that did not quit cleanly.
+
+    Nothing is removed if the path is not a socket or a server still
+    accepts connections on it: binding then fails.
+
+    """
+    try:
+        if not stat.S_ISSOCK(os.stat(path).st_mode):
+            return
+    except OSError:
+        return
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except socket.error:
+        LOGGER.info('Removing stale socket %s', path)
+        os.remove(path)
+    finally:
+        probe.close()
+
+
+def _is_pair(value):
+    """Return True if value is a pair of integers, as a pos or a size."""
+    return (isinstance(value, (list, tuple)) and len(value) == 2 and
+            all(isinstance(item, (int, long)) for item in value))
+
+
+def _hide_pawns(tmx_string, seen):
+    """Return a tmx string without the pawns that are not in seen."""
+    tmx_map = ElementTree.fromstring(tmx_string)
+    for objectgroup in tmx_map.findall('objectgroup'):
+        if objectgroup.attrib.get('name') != 'pawns':
+            continue
+        for pawn in objectgroup.findall('object'):
+            if pawn.attrib.get('name') not in seen:
+                objectgroup.remove(pawn)
+    return ElementTree.tostring(tmx_map)
+
+
+def _area(pos, size, margin):
+    """Return the area seen from a viewport, margin included."""
+    return ((pos[0] - margin, pos[1] - margin),
+            (size[0] + 2 * margin, size[1] + 2 * margin))
+
+# Attribute holding the board of the events routed to the subscribers
+_BOARD_KEYS = {
+    'game-event-pawn-moved': 'bname',
+    'game-event-pawn-next': 'bname',
+    'game-event-pawn-updated': 'bname',
+    'game-event-board-change': 'name',
+}
+
+
+class Router(object):
+
+    """Route the events of the game to the end points
+
+    An end point subscribes to a set of boards and only gets the events
+    about them; until it subscribes it gets the events of every board. Every
+    event is encoded once and the same string is queued to all the end
+    points receiving it.
+
+    The positions of the pawns are not sent as soon as they change: only
+    the latest position of every pawn is sent, at most once every
+    coalesce_window seconds. An end point with a viewport on a board only
+    gets the moves of the pawns near it, with an enter or leave event when
+    a pawn crosses its border. An end point seeing a board through some
+    pawns (see yaranullin.game.visibility) only gets the pawns they see.
+
+    """
+
+    def __init__(self, bus=None):
+        self.bus = get_bus(bus)
+        self._end_points = weakref.WeakValueDictionary()
+        # Subscribers of every board, and end points getting all boards
+        self._subscribers = collections.defaultdict(weakref.WeakSet)
+        self._everything = weakref.WeakSet()
+        self._moves = collections.OrderedDict()
+        self._last_flush = 0
+        # Minimum time (in seconds) between two broadcasts of pawn positions
+        self.coalesce_window = CONFIG.getfloat('network', 'coalesce-window')
+        # Cells around the viewport of a client where it still sees the pawns
+        self.viewport_margin = CONFIG.getint('network', 'viewport-margin')
+        # Position of the pawns of every board, only the boards of the game
+        # have one: the names sent by the clients are never added
+        self._index = {}
+        self.bus.connect('game-event-board-new', self.add_board)
+        self.bus.connect('game-event-pawn-new', self.add_pawn)
+        self.bus.connect('game-event-pawn-del', self.del_pawn)
+        self.bus.connect('game-event-board-del', self.del_board)
+        self.bus.connect('game-event-pawn-moved', self.post_move)
+        self.bus.connect('game-event-update', self.route_update)
+        self.bus.connect('game-event-pawn-next', self.route)
+        self.bus.connect('game-event-pawn-updated', self.route)
+        self.bus.connect('game-event-board-change', self.route)
+        self.bus.connect('game-event-tile-chunk', self.route)
+        self.bus.connect('game-event-pawn-range', self.route)
+        self.bus.connect('game-event-pawn-path', self.route)
+        self.bus.connect('game-event-sight', self.set_sight)
+        self.bus.connect('resource-update', self.route)
+        self.bus.connect('tick', self.tick)
+
+    def add(self, end_point):
+        """Send to a new end point the events of every board."""
+        self._end_points[end_point.uid] = end_point
+        self._everything.add(end_point)
+
+    def accept_local(self, end_point, table=None):
+        """Link a client end point of this process to a new end point."""
+        server_end_point = ServerEndPoint(None, self)
+        server_end_point.link(end_point)
+        LOGGER.debug('Accepted local client %d', server_end_point.uid)
+        return server_end_point
+
+    def remove(self, end_point):
+        """Stop sending events to an end point."""
+        self._end_points.pop(end_point.uid, None)
+        self._everything.discard(end_point)
+        for subscribers in self._subscribers.itervalues():
+            subscribers.discard(end_point)
+
+    def subscribe(self, end_point, names):
+        """Send to an end point only the events of the boards in names."""
+        self._everything.discard(end_point)
+        for bname, subscribers in self._subscribers.items():
+            subscribers.discard(end_point)
+            if not subscribers:
+                del self._subscribers[bname]
+        if names is None:
+            self._everything.add(end_point)
+        else:
+            for bname in names:
+                self._subscribers[bname].add(end_point)
+        end_point.boards = None if names is None else frozenset(names)
+
+    def _targets(self, event_dict):
+        """Return the end points receiving an event."""
+        client = event_dict.get('client')
+        if client is not None:
+            end_point = self._end_points.get(client)
+            return [end_point] if end_point is not None else []
+        key = _BOARD_KEYS.get(event_dict['event'])
+        if key is None or key not in event_dict:
+            # Not about a single board
+            return self._end_points.values()
+        targets = list(self._everything)
+        targets.extend(self._subscribers.get(event_dict[key], ()))
+        return targets
+
+    def _send(self, event_dict):
+        targets = self._targets(event_dict)
+        if targets:
+            data = json.dumps(event_dict)
+            for end_point in targets:
+                end_point.post_encoded(event_dict, data)
+
+    def route(self, event_dict):
+        """Send an event, after the pending pawn moves."""
+        if self._moves:
+            self.flush_moves()
+        self._send(event_dict)
+
+    def route_update(self, event_dict):
+        """Send every end point the boards it subscribed to.
+
+        The pawns out of the viewport or the sight of an end point are
+        removed from its boards, so it never gets them.
+
+        """
+        if self._moves:
+            self.flush_moves()
+        bnames = set(event_dict.get('tmxs', ()))
+        bnames.update(event_dict.get('moves', ()))
+        # End points getting the same boards and seeing the same pawns
+        # share the same update
+        groups = collections.defaultdict(list)
+        for end_point in self._targets(event_dict):
+            boards = end_point.boards
+            hidden = []
+            for bname in sorted(bnames):
+                if boards is not None and bname not in boards:
+                    continue
+                seen = self._seen(end_point, bname)
+                if seen is not None:
+                    hidden.append((bname, frozenset(seen)))
+            groups[boards, tuple(hidden)].append(end_point)
+        for (boards, hidden), end_points in groups.iteritems():
+            update = event_dict
+            if boards is not None or hidden:
+                update = dict(event_dict)
+                for key in ('tmxs', 'moves'):
+                    if key in update:
+                        update[key] = dict((bname, value) for bname, value
+                                in update[key].iteritems() if boards is None
+                                or bname in boards)
+                for bname, seen in hidden:
+                    if bname in update.get('tmxs', ()):
+                        update['tmxs'][bname] = _hide_pawns(
+                                update['tmxs'][bname], seen)
+                    if bname in update.get('moves', ()):
+                        update['moves'][bname] = [move for move in
+                                update['moves'][bname] if move['pname'] in
+                                seen]
+            data = json.dumps(update)
+            for end_point in end_points:
+                end_point.post_encoded(update, data)
+                for bname, seen in hidden:
+                    end_point.visible[bname] = set(seen)
+
+    def add_board(self, event_dict):
+        """Add an empty index for a new board."""
+        self._index.setdefault(event_dict['name'], SpatialIndex())
+
+    def add_pawn(self, event_dict):
+        """Add a new pawn to the index."""
+        index = self._index.setdefault(event_dict['bname'], SpatialIndex())
+        index.add(event_dict['pname'], event_dict['pos'], event_dict['size'])
+
+    def del_pawn(self, event_dict):
+        """Remove a pawn from the index and from the viewports."""
+        bname = event_dict['bname']
+        pname = event_dict['pname']
+        index = self._index.get(bname)
+        if index is not None:
+            index.remove(pname)
+        for end_point in self._end_points.values():
+            visible = end_point.visible.get(bname)
+            if visible:
+                visible.discard(pname)
+
+    def del_board(self, event_dict):
+        """Forget the pawns of a board."""
+        bname = event_dict['name']
+        self._index.pop(bname, None)
+        for end_point in self._end_points.values():
+            end_point.viewports.pop(bname, None)
+            end_point.sights.pop(bname, None)
+            end_point.visible.pop(bname, None)
+
+    def _sees(self, end_point, bname, pname, item):
+        """Return True if an end point sees a pawn at item (pos, size)."""
+        viewport = end_point.viewports.get(bname)
+        if viewport is not None and not overlaps(item[0], item[1],
+                *_area(viewport[0], viewport[1], self.viewport_margin)):
+            return False
+        sight = end_point.sights.get(bname)
+        return sight is None or pname in sight
+
+    def _seen(self, end_point, bname):
+        """Return the pawns of a board seen by an end point, None for all."""
+        index = self._index.get(bname)
+        viewport = end_point.viewports.get(bname)
+        sight = end_point.sights.get(bname)
+        if index is None or (viewport is None and sight is None):
+            return None
+        if viewport is None:
+            seen = set(index.keys())
+        else:
+            seen = index.query(*_area(viewport[0], viewport[1],
+                self.viewport_margin))
+        if sight is not None:
+            seen &= sight
+        return seen
+
+    def _update_visible(self, end_point, bname):
+        """Send the pawns entering and leaving the sight of an end point."""
+        index = self._index.get(bname)
+        if index is None:
+            return
+        # Without a viewport or a sight the end point got every pawn
+        visible = end_point.visible.get(bname)
+        if visible is None:
+            visible = set(index.keys())
+        seen = self._seen(end_point, bname)
+        if seen is None:
+            end_point.visible.pop(bname, None)
+            seen = set(index.keys())
+        else:
+            end_point.visible[bname] = seen
+        for pname in seen - visible:
+            pos, size = index.get(pname)
+            end_point.post(dict(event='game-event-pawn-enter', bname=bname,
+                pname=pname, pos=pos, size=size))
+        for pname in visible - seen:
+            end_point.post(dict(event='game-event-pawn-leave', bname=bname,
+                pname=pname))
+
+    def set_viewport(self, end_point, bname, pos, size):
+        """Send an end point only the pawns near an area of a board.
+
+        With a None size, the end point gets every pawn again.
+
+        """
+        if bname not in self._index:
+            LOGGER.warning("Viewport on unknown board '%s' from client %d",
+                    bname, end_point.uid)
+            return
+        if size is None:
+            end_point.viewports.pop(bname, None)
+        else:
+            end_point.viewports[bname] = pos, size
+        self._update_visible(end_point, bname)
+
+    def set_sight(self, event_dict):
+        """Send an end point only the pawns seen by its pawns."""
+        end_point = self._end_points.get(event_dict['client'])
+        if end_point is None:
+            return
+        bname = event_dict['bname']
+        pnames = event_dict['pnames']
+        if self._moves:
+            # Send the moves seen with the old sight first
+            self.flush_moves()
+        if pnames is None:
+            end_point.sights.pop(bname, None)
+        else:
+            end_point.sights[bname] = set(pnames)
+        self._update_visible(end_point, bname)
+
+    def post_move(self, event_dict):
+        """Queue the new position of a pawn, replacing the previous one."""
+        bname = event_dict['bname']
+        pname = event_dict['pname']
+        index = self._index.setdefault(bname, SpatialIndex())
+        if pname in index:
+            index.move(pname, event_dict['pos'], event_dict.get('size'))
+        elif event_dict.get('size') is not None:
+            index.add(pname, event_dict['pos'], event_dict['size'])
+        # The pawn goes after the pawns moved since its previous move
+        self._moves.pop((bname, pname), None)
+        self._moves[bname, pname] = event_dict
+
+    def _send_move(self, event_dict):
+        """Send a move, or an enter or leave event to the viewports."""
+        bname = event_dict['bname']
+        pname = event_dict['pname']
+        index = self._index.get(bname)
+        item = index.get(pname) if index is not None else None
+        # Every kind of event is encoded once
+        encoded = {}
+        for end_point in self._targets(event_dict):
+            visible = end_point.visible.get(bname)
+            if visible is None:
+                kind = 'moved'
+            else:
+                if item is not None and self._sees(end_point, bname, pname,
+                        item):
+                    kind = 'moved' if pname in visible else 'enter'
+                    visible.add(pname)
+                elif pname in visible:
+                    kind = 'leave'
+                    visible.discard(pname)
+                else:
+                    continue
+            if kind not in encoded:
+                if kind == 'moved':
+                    sent = event_dict
+                elif kind == 'enter':
+                    sent = dict(event='game-event-pawn-enter', bname=bname,
+                            pname=pname, pos=item[0], size=item[1])
+                else:
+                    sent = dict(event='game-event-pawn-leave', bname=bname,
+                            pname=pname)
+                encoded[kind] = sent, json.dumps(sent)
+            end_point.post_encoded(*encoded[kind])
+
+    def flush_moves(self):
+        """Send the latest position of every moved pawn."""
+        moves = self._moves.values()
+        self._moves.clear()
+        self._last_flush = time.time()
+        for event_dict in moves:
+            self._send_move(event_dict)
+
+    def tick(self):
+        """Send the pending moves once per coalescing window."""
+        if self._moves and (time.time() - self._last_flush >=
+                self.coalesce_window):
+            self.flush_moves()
 
 
 class ServerEndPoint(EndPoint):
 
-    """End point wrapper for the server"""
+    """End point wrapper for the server
+
+    Events with a 'client' attribute are sent only to the end point with
+    that uid. Without a socket the end point serves a client of this process
+    (see Router.accept_local).
+
+    """
+
+    is_server = True
+
+    def __init__(self, sock, router=None, bus=None):
+        if router is None:
+            router = Router(bus)
+        EndPoint.__init__(self, sock, bus=router.bus, family=None)
+        self.uid = next(_UIDS)
+        self.overflow_since = None
+        self.max_out_bytes = 0
+        # Above high_watermark queued bytes, the updates of the game are not
+        # sent anymore to the client; as soon as its queue goes below
+        # low_watermark it gets a fresh snapshot. A client that stays above
+        # high_watermark for more than lag_timeout seconds is disconnected.
+        self.high_watermark = CONFIG.getint('network', 'high-watermark')
+        self.low_watermark = CONFIG.getint('network', 'low-watermark')
+        self.lag_timeout = CONFIG.getfloat('network', 'lag-timeout')
+        self.dropped = 0
+        self.snapshots = 0
+        # Boards this end point subscribed to, None for all
+        self.boards = None
+        # Area seen of some boards, pawns seen by the pawns of the client,
+        # and the pawns known inside them
+        self.viewports = {}
+        self.sights = {}
+        self.visible = {}
+        self._streams = collections.deque()
+        self.router = router
+        router.add(self)
+
+    def check_in_event(self, event_dict):
+        '''Serve resource requests without posting them.'''
+        event = event_dict['event']
+        if event == 'resource-request':
+            self.stream_resource(event_dict['name'],
+                    event_dict.get('offset', 0))
+            return False
+        if event == 'game-request-board-subscribe':
+            names = event_dict.get('names')
+            added = self.boards is not None and (names is None or
+                    not self.boards.issuperset(names))
+            self.router.subscribe(self, names)
+            if added:
+                # The client does not know the new boards yet
+                self.bus.post('game-request-update', client=self.uid)
+            return False
+        if event == 'game-request-viewport':
+            bname = event_dict.get('bname')
+            pos = event_dict.get('pos')
+            size = event_dict.get('size')
+            if not isinstance(bname, basestring) or (size is not None and
+                    not (_is_pair(pos) and _is_pair(size))):
+                LOGGER.warning('Invalid viewport from client %d: %r',
+                        self.uid, event_dict)
+                return False
+            self.router.set_viewport(self, bname, pos, size)
+            return False
+        if event == 'game-request-sight':
+            pnames = event_dict.get('pnames')
+            if not isinstance(event_dict.get('bname'), basestring) or \
+                    not isinstance(pnames, list) or not all(
+                            isinstance(pname, basestring) for pname in pnames):
+                # Only the game can let a client see every pawn again
+                LOGGER.warning('Invalid sight from client %d: %r', self.uid,
+                        event_dict)
+                return False
+        if event in CLIENT_REQUESTS:
+            event_dict['client'] = self.uid
+        return True
+
+    def check_out_event(self, event_dict):
+        '''Drop the events addressed to other clients or superseded.'''
+        client = event_dict.get('client')
+        if client is not None and client != self.uid:
+            return False
+        if (self.overflow_since is not None and
+                event_dict['event'].startswith('game-event-')):
+            # A fresh snapshot will replace it
+            self.dropped += 1
+            return False
+        return True
+
+    def stats(self):
+        '''Return a dictionary describing the output queue.'''
+        return dict(client=self.uid, queued=self.out_bytes,
+                max_queued=self.max_out_bytes, dropped=self.dropped,
+                snapshots=self.snapshots,
+                overflow=self.overflow_since is not None)
+
+    def _check_backpressure(self):
+        '''Compare the queued bytes with the watermarks.'''
+        if self.out_bytes > self.max_out_bytes:
+            self.max_out_bytes = self.out_bytes
+        if self.overflow_since is None:
+            if self.out_bytes > self.high_watermark:
+                self.overflow_since = time.time()
+                LOGGER.warning("Client %d is lagging behind: %d bytes "
+                        "queued", self.uid, self.out_bytes)
+                self.bus.post('network-backpressure', client=self.uid,
+                        state='high', queued=self.out_bytes)
+        elif self.out_bytes <= self.low_watermark:
+            self.overflow_since = None
+            self.snapshots += 1
+            LOGGER.info("Client %d caught up, sending a snapshot", self.uid)
+            self.bus.post('network-backpressure', client=self.uid, state='low',
+                    queued=self.out_bytes)
+            self.bus.post('game-request-update', client=self.uid)
+        elif time.time() - self.overflow_since > self.lag_timeout:
+            reason = ("more than %d bytes queued for %d seconds" %
+                    (self.high_watermark, self.lag_timeout))
+            LOGGER.warning("Disconnecting client %d: %s", self.uid, reason)
+            self.bus.post('network-client-dropped', client=self.uid,
+                    reason=reason)
+            self.handle_close()
 
-    def __init__(self, sock):
-        EndPoint.__init__(self, sock)
-        connect('game-event-update', self.post)
-        connect('game-event-pawn-next', self.post)
-        connect('game-event-pawn-updated', self.post)
-        connect('game-event-board-change', self.post)
-        connect('resource-update', self.post)
+    def stream_resource(self, name, offset=0):
+        '''Start sending the resource 'name' from the given offset.'''
+        path = find_resource(name, RESOURCE_DIRS)
+        if path is None:
+            LOGGER.warning("Requested resource '%s' not found", name)
+            self.post(dict(event='resource-missing', name=name))
+            return
+        for stream in self._streams:
+            if stream.name == name:
+                LOGGER.debug("Resource '%s' is already being sent", name)
+                return
+        try:
+            stream = ResourceStream(name, path, offset)
+        except IOError:
+            LOGGER.exception("Unable to open resource '%s'", name)
+            self.post(dict(event='resource-missing', name=name))
+        else:
+            self._streams.append(stream)
+            LOGGER.debug("Sending resource '%s' from offset %d", name,
+                    stream.offset)
+
+    def _pump_streams(self):
+        '''Queue one chunk per resource if nothing else is waiting.'''
+        if self._out_buffer:
+            return
+        for _ in xrange(len(self._streams)):
+            stream = self._streams.popleft()
+            self.post(stream.next_chunk())
+            if not stream.done:
+                self._streams.append(stream)
+            else:
+                LOGGER.debug("Resource '%s' sent", stream.name)
+
+    def post(self, event_dict):
+        '''Add an event to the queue and check the watermarks.'''
+        EndPoint.post(self, event_dict)
+        self._check_backpressure()
+
+    def post_encoded(self, event_dict, data):
+        '''Add an encoded event to the queue and check the watermarks.'''
+        EndPoint.post_encoded(self, event_dict, data)
+        self._check_backpressure()
+
+    def process_queue(self):
+        '''Process the event queue and send pending resource chunks.'''
+        EndPoint.process_queue(self)
+        self._check_backpressure()
+        if self._streams:
+            self._pump_streams()
+
+    def handle_close(self):
+        for stream in self._streams:
+            stream.close()
+        self._streams.clear()
+        self.router.remove(self)
+        self.bus.post('network-client-closed', client=self.uid)
+        EndPoint.handle_close(self)
 
 
 class Server(asyncore.dispatcher):
 
     """Handle server and create end points"""
 
-    def __init__(self, server_address):
+    def __init__(self, server_address, bus=None):
         asyncore.dispatcher.__init__(self)
+        self._listen(server_address)
+        self.end_points = weakref.WeakSet()
+        self.router = Router(bus)
+
+    def _listen(self, server_address):
         # XXX Remember IPv6
-        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.set_reuse_addr()
-        self.bind(server_address)
-        LOGGER.debug('Server listening on port %d', server_address[1])
+        # Path and inode of the Unix socket, removed when the server closes
+        self._unix_socket = None
+        family = address_family(server_address)
+        self.create_socket(family, socket.SOCK_STREAM)
+        if family == socket.AF_UNIX:
+            _remove_stale_socket(server_address)
+            LOGGER.debug('Server listening on %s', server_address)
+        else:
+            self.set_reuse_addr()
+            LOGGER.debug('Server listening on port %d', server_address[1])
+        try:
+            self.bind(server_address)
+        except socket.error:
+            # Do not leave the socket in the asyncore map
+            self.close()
+            raise
+        if family == socket.AF_UNIX:
+            self._unix_socket = (server_address,
+                    os.stat(server_address).st_ino)
         self.listen(5)
 
+    def close(self):
+        '''Stop listening and remove the Unix socket.'''
+        asyncore.dispatcher.close(self)
+        if self._unix_socket is not None:
+            path, inode = self._unix_socket
+            self._unix_socket = None
+            try:
+                # Another server may have taken the path meanwhile
+                if os.stat(path).st_ino == inode:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def accept_local(self, end_point, table=None):
+        '''Serve an end point of this process.'''
+        server_end_point = self.router.accept_local(end_point)
+        self.end_points.add(server_end_point)
+        return server_end_point
+
     def log_info(self, message, type='info'):
         try:
             log = getattr(LOGGER, type)
@@ -64,4 +681,89 @@ class Server(asyncore.dispatcher):
         if client_info is None:
             return
         LOGGER.debug('Accept connection from %s', client_info[1])
-        ServerEndPoint(sock=client_info[0])
+        self.end_points.add(ServerEndPoint(client_info[0], self.router))
+
+    def stats(self):
+        '''Return the statistics of every connected end point.'''
+        return [end_point.stats() for end_point in self.end_points]
+
+
+class _WaitingEndPoint(_EndPoint):
+
+    """A connection to the lobby that did not choose its table yet"""
+
+    def __init__(self, sock, lobby):
+        _EndPoint.__init__(self, sock)
+        self.lobby = lobby
+
+    def handle_read(self):
+        _EndPoint.handle_read(self)
+        data = self._get_from_in_buffer()
+        if data is None:
+            return
+        try:
+            event_dict = json.loads(data)
+            table = event_dict['table']
+        except (ValueError, KeyError, TypeError):
+            table = None
+            event_dict = {}
+        router = None
+        if event_dict.get('event') == 'table-join':
+            router = self.lobby.get_router(table)
+        if router is None:
+            LOGGER.warning("Closing connection asking for table '%s'",
+                    table)
+            self.close()
+            return
+        # Hand the socket over to an end point of the table
+        sock = self.socket
+        self.del_channel()
+        end_point = ServerEndPoint(sock, router)
+        end_point._in_buffer.extend(self._in_buffer)
+        end_point.in_chunks.extend(self.in_chunks)
+        end_point.len_in_chunks = self.len_in_chunks
+        end_point.state = self.state
+        end_point.lendata = self.lendata
+        self.lobby.end_points.add(end_point)
+        LOGGER.info("Client %d joined table '%s'", end_point.uid, table)
+
+
+class Lobby(Server):
+
+    """Accept the clients of many tables on a single port
+
+    The first message of a client must be a 'table-join' event with the name
+    of a table; the connection is then handed to the router of that table.
+
+    """
+
+    def __init__(self, server_address, tables):
+        asyncore.dispatcher.__init__(self)
+        self._listen(server_address)
+        self.end_points = weakref.WeakSet()
+        # Tables by name, every one with a 'router'
+        self.tables = tables
+
+    def get_router(self, name):
+        '''Return the router of a table or None.'''
+        table = self.tables.get(name)
+        if table is not None:
+            return table.router
+
+    def accept_local(self, end_point, table=None):
+        '''Serve an end point of this process at a table.'''
+        router = self.get_router(table)
+        if router is None:
+            LOGGER.warning("No table '%s' for a local client", table)
+            end_point.handle_close()
+            return
+        server_end_point = router.accept_local(end_point)
+        self.end_points.add(server_end_point)
+        return server_end_point
+
+    def handle_accept(self):
+        client_info = self.accept()
+        if client_info is None:
+            return
+        LOGGER.debug('Accept connection from %s', client_info[1])
+        _WaitingEndPoint(client_info[0], self)
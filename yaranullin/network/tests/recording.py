@@ -0,0 +1,78 @@
+# yaranullin/network/tests/recording.py
+#
+# Copyright (c) 2012 Marco Scopesi <marco.scopesi@gmail.com>
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+import os
+import sys
+import json
+import tempfile
+import unittest
+
+if __name__ == '__main__':
+    sys.path.insert(0, ".")
+
+from yaranullin.network.recording import Recorder, read_log, TO_SERVER, \
+        TO_CLIENT
+
+
+class _FakeEndPoint(object):
+
+    def __init__(self, uid, is_server):
+        self.uid = uid
+        self.is_server = is_server
+
+
+class TestRecording(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_read_log(self):
+        recorder = Recorder(self.path)
+        server = _FakeEndPoint(3, True)
+        client = _FakeEndPoint(0, False)
+        move = json.dumps({'event': 'game-request-pawn-move'})
+        moved = json.dumps({'event': 'game-event-pawn-moved'})
+        recorder.write(server, move, True)
+        recorder.write(server, moved, False)
+        recorder.write(client, move, False)
+        recorder.close()
+        records = list(read_log(self.path))
+        self.assertEqual([(r.direction, r.client) for r in records],
+                [(TO_SERVER, 3), (TO_CLIENT, 3), (TO_SERVER, 0)])
+        self.assertEqual(records[1].event_dict['event'],
+                'game-event-pawn-moved')
+        self.assertTrue(records[0].time <= records[2].time)
+
+    def test_truncated_log(self):
+        recorder = Recorder(self.path)
+        recorder.write(_FakeEndPoint(1, True), '{"event": "quit"}', True)
+        recorder.close()
+        with open(self.path, 'ab') as log:
+            log.write('\x00' * 5)
+        self.assertEqual(len(list(read_log(self.path))), 1)
+
+    def test_not_a_log(self):
+        with open(self.path, 'wb') as log:
+            log.write('garbage')
+        self.assertRaises(ValueError, list, read_log(self.path))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+# yaranullin/network/tests/resource.py
+#
+# Copyright (c) 2012 Marco Scopesi <marco.scopesi@gmail.com>
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+if __name__ == '__main__':
+    sys.path.insert(0, ".")
+
+from yaranullin import cache
+from yaranullin.network.resource import ResourceStream, find_resource, \
+        CHUNK_SIZE
+
+
+class TestResourceStream(unittest.TestCase):
+
+    def setUp(self):
+        self.src = tempfile.mkdtemp()
+        self.dst = tempfile.mkdtemp()
+        self.old_cache_dir = cache.YR_CACHE_DIR
+        cache.YR_CACHE_DIR = self.dst
+        self.data = os.urandom(CHUNK_SIZE * 2 + 100)
+        with open(os.path.join(self.src, 'map.png'), 'wb') as file_:
+            file_.write(self.data)
+
+    def tearDown(self):
+        cache.YR_CACHE_DIR = self.old_cache_dir
+        shutil.rmtree(self.src)
+        shutil.rmtree(self.dst)
+
+    def test_find_resource(self):
+        path = find_resource('map.png', [self.src])
+        self.assertEqual(os.path.join(self.src, 'map.png'), path)
+        self.assertIsNone(find_resource('missing.png', [self.src]))
+        self.assertIsNone(find_resource('../map.png', [self.src]))
+
+    def test_stream(self):
+        stream = ResourceStream('map.png', os.path.join(self.src, 'map.png'))
+        chunks = []
+        while not stream.done:
+            chunks.append(stream.next_chunk())
+        self.assertEqual(3, len(chunks))
+        for chunk in chunks:
+            cache.write_chunk(chunk)
+        with open(os.path.join(self.dst, 'map.png'), 'rb') as file_:
+            self.assertEqual(self.data, file_.read())
+
+    def test_resume(self):
+        path = os.path.join(self.src, 'map.png')
+        stream = ResourceStream('map.png', path)
+        cache.write_chunk(stream.next_chunk())
+        stream.close()
+        # Transfer interrupted: resume from what is on disk
+        self.assertEqual(CHUNK_SIZE, cache._partial_size('map.png'))
+        stream = ResourceStream('map.png', path,
+                cache._partial_size('map.png'))
+        while not stream.done:
+            cache.write_chunk(stream.next_chunk())
+        self.assertFalse(os.path.exists(cache._partial_path('map.png')))
+        with open(os.path.join(self.dst, 'map.png'), 'rb') as file_:
+            self.assertEqual(self.data, file_.read())
+
+
+if __name__ == '__main__':
+    unittest.main()
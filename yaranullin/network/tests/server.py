@@ -0,0 +1,342 @@
+# yaranullin/network/tests/server.py
+#
+# Copyright (c) 2012 Marco Scopesi <marco.scopesi@gmail.com>
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+import sys
+import json
+import socket
+import unittest
+
+if __name__ == '__main__':
+    sys.path.insert(0, ".")
+
+from yaranullin.event_system import post, process_queue, _QUEUE, _EVENTS, \
+        EventBus
+from yaranullin.network import server
+from yaranullin.network.base import FORMAT
+from yaranullin.network.server import ServerEndPoint, Lobby
+
+
+class TestServerEndPoint(unittest.TestCase):
+
+    def setUp(self):
+        _QUEUE.clear()
+        _EVENTS.clear()
+        self.sock, self.peer = socket.socketpair()
+        self.end_point = ServerEndPoint(self.sock)
+
+    def tearDown(self):
+        self.end_point.close()
+        self.peer.close()
+        _QUEUE.clear()
+        _EVENTS.clear()
+
+    def sent_events(self):
+        return [json.loads(msg[4:]) for msg in self.end_point._out_buffer]
+
+    def test_coalesce_moves(self):
+        self.end_point.router.coalesce_window = 0
+        for pos in ((1, 1), (2, 2), (3, 3)):
+            self.end_point.router.post_move(dict(
+                event='game-event-pawn-moved', bname='b', pname='p',
+                pos=pos))
+        self.end_point.router.post_move(dict(event='game-event-pawn-moved',
+            bname='b', pname='q', pos=(5, 5)))
+        self.assertEqual(0, len(self.end_point._out_buffer))
+        post('tick')
+        process_queue()
+        sent = self.sent_events()
+        self.assertEqual(2, len(sent))
+        self.assertEqual([3, 3], sent[0]['pos'])
+        self.assertEqual([5, 5], sent[1]['pos'])
+
+    def test_latest_move_last(self):
+        self.end_point.router.coalesce_window = 0
+        for pname, pos in (('p', (1, 1)), ('q', (5, 5)), ('p', (2, 2))):
+            self.end_point.router.post_move(dict(
+                event='game-event-pawn-moved', bname='b', pname=pname,
+                pos=pos))
+        post('tick')
+        process_queue()
+        self.assertEqual([('q', [5, 5]), ('p', [2, 2])], [(event['pname'],
+            event['pos']) for event in self.sent_events()])
+
+    def test_window(self):
+        self.end_point.router.coalesce_window = 3600
+        self.end_point.router.flush_moves()
+        self.end_point.router.post_move(dict(event='game-event-pawn-moved',
+            bname='b', pname='p', pos=(1, 1)))
+        post('tick')
+        process_queue()
+        self.assertEqual(0, len(self.end_point._out_buffer))
+        # Other events are never sent before the pending moves
+        self.end_point.router.route(dict(event='game-event-pawn-next'))
+        events = [event['event'] for event in self.sent_events()]
+        self.assertEqual(['game-event-pawn-moved', 'game-event-pawn-next'],
+                events)
+
+    def test_addressed(self):
+        self.end_point.post(dict(event='game-event-update', tmxs={},
+            client=self.end_point.uid + 1))
+        self.assertEqual(0, len(self.end_point._out_buffer))
+        self.end_point.post(dict(event='game-event-update', tmxs={},
+            client=self.end_point.uid))
+        self.assertEqual(1, len(self.end_point._out_buffer))
+
+    def test_missing_resource(self):
+        self.end_point.check_in_event(dict(event='resource-request',
+            name='no-such-resource.png'))
+        self.assertEqual([dict(event='resource-missing',
+            name='no-such-resource.png')], self.sent_events())
+
+    def test_backpressure(self):
+        self.end_point.high_watermark = 100
+        self.end_point.low_watermark = 50
+        big = 'x' * 200
+        self.end_point.post(dict(event='resource-update', name='a',
+            resource=big))
+        self.assertIsNotNone(self.end_point.overflow_since)
+        # Updates of the game are dropped while over the watermark
+        self.end_point.post(dict(event='game-event-pawn-next'))
+        self.assertEqual(1, self.end_point.stats()['dropped'])
+        # Simulate the client catching up
+        self.end_point._out_buffer.clear()
+        self.end_point.out_bytes = 0
+        _QUEUE.clear()
+        self.end_point._check_backpressure()
+        self.assertIsNone(self.end_point.overflow_since)
+        requests = [ev for ev in _QUEUE if ev['event'] ==
+                'game-request-update']
+        self.assertEqual(self.end_point.uid, requests[0]['client'])
+
+
+class TestRouter(unittest.TestCase):
+
+    def setUp(self):
+        _QUEUE.clear()
+        _EVENTS.clear()
+        self.router = server.Router()
+        self.socks = []
+        self.end_points = []
+        for _ in xrange(2):
+            sock, peer = socket.socketpair()
+            self.socks.extend((sock, peer))
+            self.end_points.append(ServerEndPoint(sock, self.router))
+
+    def tearDown(self):
+        for end_point in self.end_points:
+            end_point.close()
+        for sock in self.socks:
+            sock.close()
+        _QUEUE.clear()
+        _EVENTS.clear()
+
+    def sent_events(self, end_point):
+        events = [json.loads(msg[4:]) for msg in end_point._out_buffer]
+        end_point._out_buffer.clear()
+        return events
+
+    def test_subscriptions(self):
+        subscriber, other = self.end_points
+        self.router.subscribe(subscriber, ['a'])
+        for bname in ('a', 'b'):
+            self.router.route(dict(event='game-event-pawn-next',
+                bname=bname))
+        self.assertEqual(['a'], [event['bname'] for event in
+            self.sent_events(subscriber)])
+        self.assertEqual(['a', 'b'], [event['bname'] for event in
+            self.sent_events(other)])
+        # Events about no board go to everybody
+        self.router.route(dict(event='resource-update', name='x',
+            resource=''))
+        self.assertEqual(1, len(self.sent_events(subscriber)))
+
+    def test_update(self):
+        subscriber, other = self.end_points
+        self.router.subscribe(subscriber, ['a'])
+        self.router.route_update(dict(event='game-event-update',
+            tmxs={'a': '<a/>', 'b': '<b/>'}, moves={'b': []}))
+        update = self.sent_events(subscriber)[0]
+        self.assertEqual({'a': '<a/>'}, update['tmxs'])
+        self.assertEqual({}, update['moves'])
+        update = self.sent_events(other)[0]
+        self.assertEqual(['a', 'b'], sorted(update['tmxs']))
+
+    def test_update_hides_pawns(self):
+        viewer, other = self.end_points
+        for pname, pos in (('hero', (0, 0)), ('orc', (9, 9))):
+            self.router.add_pawn(dict(bname='b', pname=pname, pos=pos,
+                size=(1, 1)))
+        self.router.set_sight(dict(bname='b', client=viewer.uid,
+            pnames=['hero']))
+        self.sent_events(viewer)
+        tmx = ('<map><objectgroup name="pawns"><object name="hero"/>'
+                '<object name="orc"/></objectgroup></map>')
+        self.router.route_update(dict(event='game-event-update',
+            tmxs={'b': tmx}, moves={'b': [dict(pname='hero', pos=(0, 0)),
+                dict(pname='orc', pos=(9, 9))]}))
+        update, = self.sent_events(viewer)
+        self.assertNotIn('orc', update['tmxs']['b'])
+        self.assertIn('hero', update['tmxs']['b'])
+        self.assertEqual(['hero'], [move['pname'] for move in
+            update['moves']['b']])
+        self.assertEqual(set(['hero']), viewer.visible['b'])
+        update, = self.sent_events(other)
+        self.assertEqual(tmx, update['tmxs']['b'])
+
+    def test_sight_request(self):
+        viewer = self.end_points[0]
+        for pnames in (None, 'hero', [1]):
+            self.assertFalse(viewer.check_in_event(dict(
+                event='game-request-sight', bname='b', pnames=pnames)))
+        event_dict = dict(event='game-request-sight', bname='b',
+                pnames=['hero'])
+        self.assertTrue(viewer.check_in_event(event_dict))
+        self.assertEqual(viewer.uid, event_dict['client'])
+
+    def test_subscribe_request(self):
+        subscriber = self.end_points[0]
+        request = dict(event='game-request-board-subscribe', names=['a'])
+        self.assertFalse(subscriber.check_in_event(dict(request)))
+        self.assertEqual(frozenset(['a']), subscriber.boards)
+        # Only a new board needs an update
+        self.assertEqual(0, len(_QUEUE))
+        request['names'] = ['a', 'b']
+        subscriber.check_in_event(request)
+        self.assertEqual(subscriber.uid, list(_QUEUE)[0]['client'])
+
+
+    def test_viewport(self):
+        self.router.coalesce_window = 0
+        self.router.viewport_margin = 1
+        viewer, other = self.end_points
+        for pname, pos in (('near', (2, 2)), ('far', (50, 50))):
+            self.router.add_pawn(dict(bname='b', pname=pname, pos=pos,
+                size=(1, 1)))
+        self.router.set_viewport(viewer, 'b', (0, 0), (5, 5))
+        self.assertEqual([('game-event-pawn-leave', 'far')],
+                [(event['event'], event['pname']) for event in
+                    self.sent_events(viewer)])
+        for pname, pos in (('near', (30, 30)), ('far', (5, 5))):
+            self.router.post_move(dict(event='game-event-pawn-moved',
+                bname='b', pname=pname, pos=pos))
+        self.router.flush_moves()
+        events = [(event['event'], event['pname']) for event in
+                self.sent_events(viewer)]
+        self.assertEqual([('game-event-pawn-leave', 'near'),
+            ('game-event-pawn-enter', 'far')], events)
+        # Without a viewport every move is sent
+        self.assertEqual(2, len(self.sent_events(other)))
+        self.router.post_move(dict(event='game-event-pawn-moved',
+            bname='b', pname='near', pos=(31, 31)))
+        self.router.flush_moves()
+        self.assertEqual([], self.sent_events(viewer))
+
+    def test_invalid_viewport(self):
+        viewer = self.end_points[0]
+        for request in (dict(bname='b', size=(5, 5)),
+                dict(bname='b', pos='x', size=(5, 5)),
+                dict(bname=['b'], pos=(0, 0), size=(5, 5))):
+            request['event'] = 'game-request-viewport'
+            self.assertFalse(viewer.check_in_event(request))
+        self.assertEqual({}, viewer.viewports)
+        # Unknown boards are not added to the index
+        viewer.check_in_event(dict(event='game-request-viewport',
+            bname='nowhere', pos=(0, 0), size=(5, 5)))
+        self.assertEqual({}, viewer.viewports)
+        self.assertNotIn('nowhere', self.router._index)
+
+    def test_sight(self):
+        viewer, other = self.end_points
+        for pname, pos in (('hero', (0, 0)), ('orc', (9, 9))):
+            self.router.add_pawn(dict(bname='b', pname=pname, pos=pos,
+                size=(1, 1)))
+        self.router.set_sight(dict(bname='b', client=viewer.uid,
+            pnames=['hero']))
+        self.assertEqual([('game-event-pawn-leave', 'orc')],
+                [(event['event'], event['pname']) for event in
+                    self.sent_events(viewer)])
+        self.router.post_move(dict(event='game-event-pawn-moved',
+            bname='b', pname='orc', pos=(1, 1)))
+        self.router.flush_moves()
+        # The game did not say the orc is seen yet
+        self.assertEqual([], self.sent_events(viewer))
+        self.assertEqual(1, len(self.sent_events(other)))
+        self.router.set_sight(dict(bname='b', client=viewer.uid,
+            pnames=['hero', 'orc']))
+        event = self.sent_events(viewer)[0]
+        self.assertEqual(('game-event-pawn-enter', 'orc', [1, 1]),
+                (event['event'], event['pname'], event['pos']))
+        self.router.set_sight(dict(bname='b', client=viewer.uid,
+            pnames=None))
+        self.assertEqual([], self.sent_events(viewer))
+        self.assertNotIn('b', viewer.visible)
+
+
+class Table(object):
+
+    def __init__(self, name):
+        self.bus = EventBus(name)
+        self.router = server.Router(self.bus)
+
+
+class TestLobby(unittest.TestCase):
+
+    def setUp(self):
+        self.tables = dict(red=Table('red'), blue=Table('blue'))
+        self.lobby = Lobby(('127.0.0.1', 0), self.tables)
+
+    def tearDown(self):
+        for end_point in list(self.lobby.end_points):
+            end_point.close()
+        self.lobby.close()
+        # Unittest keeps the test cases: let go of the routers
+        del self.tables, self.lobby
+
+    def send(self, sock, event_dict):
+        message = json.dumps(event_dict)
+        sock.sendall(FORMAT.pack(len(message)) + message)
+
+    def test_join(self):
+        sock, peer = socket.socketpair()
+        waiting = server._WaitingEndPoint(sock, self.lobby)
+        self.send(peer, dict(event='table-join', table='blue'))
+        self.send(peer, dict(event='game-request-update'))
+        while not self.lobby.end_points:
+            waiting.handle_read()
+        end_point, = self.lobby.end_points
+        self.assertIs(self.tables['blue'].router, end_point.router)
+        # The rest of the messages go to the bus of the table
+        while not end_point._in_buffer:
+            end_point.handle_read()
+        end_point.process_queue()
+        self.assertEqual(['game-request-update'], [event_dict['event'] for
+            event_dict in self.tables['blue'].bus.queue])
+        self.assertFalse(self.tables['red'].bus.queue)
+        peer.close()
+
+    def test_unknown_table(self):
+        sock, peer = socket.socketpair()
+        waiting = server._WaitingEndPoint(sock, self.lobby)
+        self.send(peer, dict(event='table-join', table='green'))
+        waiting.handle_read()
+        waiting.handle_read()
+        self.assertFalse(self.lobby.end_points)
+        self.assertEqual('', peer.recv(1))
+        peer.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -15,86 +15,92 @@
 # OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
 
 
+import time
+import socket
+import asyncore
 import unittest
-import threading
-from time import sleep
+import multiprocessing
 
-from ..server import ServerNetworkSpinner
-from ..client import ClientNetworkSpinner
-from ...event_system import EventManager, Event, Listener
+from yaranullin.event_system import connect, post, process_queue, _QUEUE, \
+        _EVENTS
+from yaranullin.network.client import ClientEndPoint
 
 
-class DummyListener(Listener):
+def _free_port():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
 
-    events = []
 
-    def handle_game_request_pawn_next(self, ev_type, **kargs):
+def _serve(port):
+    ''' Run a server with an empty game '''
+    from yaranullin.network.server import Server
+    from yaranullin.game.game_wrapper import GameWrapper
+    Server(('127.0.0.1', port))
+    game = GameWrapper()
+    stop = False
+    while not stop:
+        post('tick')
+        stop = process_queue()
+        asyncore.poll(0.002)
 
-        event = Event(ev_type, **kargs)
-        self.events.append(event)
 
+class DummyListener(object):
 
-class DummyListener2(Listener):
+    def __init__(self):
+        self.events = []
+        connect('game-event-update', self.handle_game_event_update)
 
-    events = []
-
-    def handle_game_event_update(self, ev_type, **kargs):
-
-        print 'dummy listener got event'
-        event = Event(ev_type, **kargs)
-        print event.__dict__
-        self.events.append(event)
+    def handle_game_event_update(self, event_dict):
+        self.events.append(event_dict)
 
 
 class test_network(unittest.TestCase):
 
     def setUp(self):
-
-        # Server
-        em = EventManager()
-        self.dummy = DummyListener(em)
-        spinner = ServerNetworkSpinner(em, ('', 44444))
-        self.spinner_server_thread = threading.Thread(target=spinner.run)
-        self.spinner_server_thread.start()
-        self.event_manager_server = em
-        self.server_spinner = spinner
-        # Client
-        em = EventManager()
-        spinner = ClientNetworkSpinner(em)
-        self.dummy2 = DummyListener2(em)
-        self.spinner_client_thread = threading.Thread(target=spinner.run)
-        self.spinner_client_thread.start()
-        em.post(Event('join', host='127.0.0.1', port=44444))
-        self.event_manager_client = em
-        self.client_spinner = spinner
-
-#    def test_client_to_server(self):
-#        """Test the transmission of a simple 'test' event."""
-#        test_event = Event('game-request-pawn-next', id=1024)
-#        self.event_manager_client.post(test_event)
-#        sleep(2)
-#        self.assertEqual(1, len(self.dummy.events))
-#        self.assertEqual(test_event.ev_type, self.dummy.events[0].ev_type)
-#        self.assertEqual(test_event.id, self.dummy.events[0].id)
+        _QUEUE.clear()
+        _EVENTS.clear()
+        self.port = _free_port()
+        self.server = multiprocessing.Process(target=_serve,
+                args=(self.port, ))
+        self.server.start()
+        # Wait for the server to accept connections
+        deadline = time.time() + 5
+        while True:
+            try:
+                socket.create_connection(('127.0.0.1', self.port)).close()
+                break
+            except socket.error:
+                if time.time() > deadline:
+                    raise
+                time.sleep(0.05)
+        self.client = ClientEndPoint()
+        self.dummy = DummyListener()
+
+    def spin(self, condition, timeout=5):
+        deadline = time.time() + timeout
+        while not condition() and time.time() < deadline:
+            post('tick')
+            process_queue()
+            asyncore.poll(0.002)
 
     def test_server_to_client(self):
-        """Test the transmission of a simple 'test' event."""
-        test_event = Event('game-event-update', id=2048)
-        self.event_manager_server.post(test_event)
-        sleep(2)
-        self.assertEqual(1, len(self.dummy2.events))
-        self.assertEqual(test_event.ev_type, self.dummy2.events[0].ev_type)
-        self.assertEqual(test_event.id, self.dummy2.events[0].id)
+        """Test the transmission of a 'game-event-update' event."""
+        post('join', host='127.0.0.1', port=self.port)
+        self.spin(lambda: self.dummy.events)
+        self.assertEqual(1, len(self.dummy.events))
+        self.assertEqual('game-event-update', self.dummy.events[0]['event'])
+        self.assertEqual({}, self.dummy.events[0]['tmxs'])
 
     def tearDown(self):
+        self.client.close()
+        self.server.terminate()
+        self.server.join()
+        _QUEUE.clear()
+        _EVENTS.clear()
+
 
-        # Client
-        em = self.event_manager_client
-        spinner = self.spinner_client_thread
-        em.post(Event('quit'))
-        spinner.join()
-        # Server
-        em = self.event_manager_server
-        spinner = self.spinner_server_thread
-        em.post(Event('quit'))
-        spinner.join()
+if __name__ == '__main__':
+    unittest.main()
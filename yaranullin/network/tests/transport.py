@@ -0,0 +1,142 @@
+# yaranullin/network/tests/transport.py
+#
+# Copyright (c) 2012 Marco Scopesi <marco.scopesi@gmail.com>
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+import os
+import sys
+import time
+import shutil
+import socket
+import asyncore
+import tempfile
+import unittest
+
+if __name__ == '__main__':
+    sys.path.insert(0, ".")
+
+from yaranullin.event_system import EventBus
+from yaranullin.network.base import register_local
+from yaranullin.network.client import ClientEndPoint
+from yaranullin.network.server import Router, Server
+
+
+class TestTransports(unittest.TestCase):
+
+    def setUp(self):
+        self.server_bus = EventBus('server')
+        self.client_bus = EventBus('client')
+        self.requests = []
+        self.events = []
+        self.server_bus.connect('game-request-update', self.on_request)
+        self.client_bus.connect('game-event-pawn-next', self.on_event)
+        self.client = ClientEndPoint(self.client_bus)
+
+    def tearDown(self):
+        self.client.close()
+        # Unittest keeps the test cases: let go of the callbacks
+        del self.server_bus, self.client_bus, self.client
+
+    def on_request(self, event_dict):
+        self.requests.append(event_dict)
+
+    def on_event(self, event_dict):
+        self.events.append(event_dict)
+
+    def step(self, poll=0):
+        for bus in (self.client_bus, self.server_bus):
+            bus.post('tick')
+            bus.process_queue()
+        asyncore.poll(poll)
+
+    def test_local(self):
+        router = Router(self.server_bus)
+        register_local('test', router)
+        self.client_bus.post('join', local='test')
+        for _ in range(3):
+            self.step()
+        self.assertEqual(1, len(self.requests))
+        end_point, = router._end_points.values()
+        self.assertEqual(end_point.uid, self.requests[0]['client'])
+        # The events reach the client as they are, tuples included
+        end_point.post(dict(event='game-event-pawn-next', pos=(1, 2)))
+        self.step()
+        self.assertEqual([(1, 2)], [event['pos'] for event in self.events])
+        # The requests of the game reach the server
+        requests = []
+        events = ('game-request-pawn-range', 'game-request-pawn-path',
+                'game-request-sight', 'game-request-pawn-spawn',
+                'game-request-undo', 'game-request-redo')
+        for event in events:
+            self.server_bus.connect(event, self.on_request)
+            self.client_bus.post(event, bname='b', pname='p', pos=(1, 1),
+                    pnames=['p'])
+        self.step()
+        self.step()
+        self.assertEqual(sorted(events), sorted(event['event'] for event in
+            self.requests[1:]))
+        # Closing the client closes its end point on the server
+        self.client.close()
+        self.assertFalse(router._end_points)
+        del end_point
+
+    def test_unix(self):
+        folder = tempfile.mkdtemp()
+        path = os.path.join(folder, 'yaranullin.sock')
+        server = Server(path, self.server_bus)
+        try:
+            self.client_bus.post('join', path=path)
+            deadline = time.time() + 5
+            while not self.requests and time.time() < deadline:
+                self.step(0.01)
+            self.assertEqual(1, len(self.requests))
+            end_point, = server.end_points
+            end_point.post(dict(event='game-event-pawn-next', pos=(1, 2)))
+            while not self.events and time.time() < deadline:
+                self.step(0.01)
+            self.assertEqual([[1, 2]], [event['pos'] for event in
+                self.events])
+            end_point.close()
+            del end_point
+        finally:
+            server.close()
+            del server
+            shutil.rmtree(folder)
+
+    def test_unix_path(self):
+        folder = tempfile.mkdtemp()
+        path = os.path.join(folder, 'yaranullin.sock')
+        try:
+            # Not a socket: it is left alone and binding fails
+            with open(path, 'w') as file_:
+                file_.write('data')
+            self.assertRaises(socket.error, Server, path, self.server_bus)
+            self.assertTrue(os.path.isfile(path))
+            os.remove(path)
+            # A socket nobody listens on is replaced
+            stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            stale.bind(path)
+            stale.close()
+            server = Server(path, self.server_bus)
+            # A live server keeps its socket
+            self.assertRaises(socket.error, Server, path, self.server_bus)
+            server.close()
+            self.assertFalse(os.path.exists(path))
+            del server
+        finally:
+            shutil.rmtree(folder)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,243 @@
+# yaranullin/profiling.py
+#
+# Copyright (c) 2012 Marco Scopesi <marco.scopesi@gmail.com>
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+''' Instrumentation of the event system.
+
+An EventProfiler collects, for every type of event and every handler, the
+number of calls and the time spent, as well as the time spent by the events
+inside the queue. Statistics can be read as a dictionary, logged
+periodically or served as JSON on a local port.
+
+'''
+
+import json
+import time
+import socket
+import asyncore
+import collections
+import logging
+
+LOGGER = logging.getLogger(__name__)
+
+from yaranullin.event_system import get_bus, enable_profiling
+
+
+# Key of the time an event was queued at, inside the event itself
+ENQUEUED = '_enqueued'
+
+
+def percentiles(samples):
+    ''' Return a summary of a list of durations, in milliseconds '''
+    if not samples:
+        return {}
+    samples = sorted(samples)
+    last = len(samples) - 1
+    return dict(
+        p50=samples[last // 2] * 1000,
+        p90=samples[last * 9 // 10] * 1000,
+        p99=samples[last * 99 // 100] * 1000,
+        max=samples[-1] * 1000)
+
+
+class _Timing(object):
+
+    ''' Call count, total time and latest samples of something timed '''
+
+    def __init__(self, samples):
+        self.calls = 0
+        self.total = 0.0
+        self.samples = collections.deque(maxlen=samples)
+
+    def add(self, duration):
+        ''' Add a sample '''
+        self.calls += 1
+        self.total += duration
+        self.samples.append(duration)
+
+    def snapshot(self):
+        ''' Return the statistics as a dictionary '''
+        stats = dict(calls=self.calls, total=self.total * 1000)
+        stats.update(percentiles(self.samples))
+        return stats
+
+
+class EventProfiler(object):
+
+    ''' Collect statistics about events and handlers
+
+    Only the latest 'samples' durations of every event and handler are kept
+    to compute the percentiles.
+
+    '''
+
+    def __init__(self, samples=1024):
+        self._samples = samples
+        self._sources = {}
+        self._last_log = time.time()
+        self.reset()
+
+    def reset(self):
+        ''' Forget all the statistics '''
+        self.posted_count = collections.Counter()
+        self.coalesced_count = collections.Counter()
+        self.max_depth = 0
+        self.queue_latency = collections.defaultdict(
+                lambda: _Timing(self._samples))
+        self.events = collections.defaultdict(
+                lambda: _Timing(self._samples))
+        self.handlers = collections.defaultdict(
+                lambda: _Timing(self._samples))
+        self.started = time.time()
+
+    def add_source(self, name, source):
+        ''' Add 'source()' to the snapshots under 'name' '''
+        self._sources[name] = source
+
+    def posting(self, event_dict):
+        ''' An event is going to be queued
+
+        The time is kept inside the event, so it leaves with it and a
+        coalesced event carries the time of the latest post.
+
+        '''
+        event_dict[ENQUEUED] = time.time()
+
+    def posted(self, event_dict, queued, depth):
+        ''' An event has been posted '''
+        event = event_dict['event']
+        self.posted_count[event] += 1
+        if not queued:
+            self.coalesced_count[event] += 1
+        if depth > self.max_depth:
+            self.max_depth = depth
+
+    def dequeued(self, event_dict):
+        ''' An event is going to be processed '''
+        try:
+            enqueued = event_dict.pop(ENQUEUED)
+        except KeyError:
+            # Posted before the profiler was enabled
+            return
+        self.queue_latency[event_dict['event']].add(time.time() - enqueued)
+
+    def handled(self, event, handler, duration):
+        ''' A handler has been called '''
+        self.handlers[handler.name].add(duration)
+
+    def processed(self, event, duration):
+        ''' All the handlers of an event have been called '''
+        self.events[event].add(duration)
+
+    def snapshot(self):
+        ''' Return all the statistics as a dictionary '''
+        events = {}
+        for event, count in self.posted_count.iteritems():
+            events[event] = dict(posted=count,
+                    coalesced=self.coalesced_count[event])
+        for event, timing in self.queue_latency.iteritems():
+            events.setdefault(event, {})['queue'] = timing.snapshot()
+        for event, timing in self.events.iteritems():
+            events.setdefault(event, {})['handlers'] = timing.snapshot()
+        handlers = dict((name, timing.snapshot()) for name, timing in
+                self.handlers.iteritems())
+        snapshot = dict(time=time.time(), since=self.started,
+                max_depth=self.max_depth, events=events, handlers=handlers)
+        for name, source in self._sources.iteritems():
+            snapshot[name] = source()
+        return snapshot
+
+    def summary(self, top=3):
+        ''' Return a line with the slowest handlers '''
+        slowest = sorted(self.handlers.iteritems(),
+                key=lambda item: item[1].total, reverse=True)[:top]
+        handlers = ', '.join('%s %d calls %.1f ms' % (name, timing.calls,
+            timing.total * 1000) for name, timing in slowest)
+        return 'max queue depth %d; slowest handlers: %s' % (self.max_depth,
+                handlers or 'none')
+
+    def log_every(self, interval, bus=None):
+        ''' Log a summary every 'interval' seconds
+
+        The summary is logged on the ticks of bus: a profiler shared by many
+        buses can be connected to each of them.
+
+        '''
+        self._log_interval = interval
+        get_bus(bus).connect('tick', self._tick)
+
+    def _tick(self):
+        ''' Log the summary if the interval has elapsed '''
+        now = time.time()
+        if now - self._last_log >= self._log_interval:
+            self._last_log = now
+            LOGGER.info('Event statistics: %s', self.summary())
+
+
+class _StatsReply(asyncore.dispatcher_with_send):
+
+    ''' Send a snapshot and close the connection '''
+
+    def __init__(self, sock, data):
+        asyncore.dispatcher_with_send.__init__(self, sock)
+        self.out_buffer = data
+
+    def handle_read(self):
+        # Ignore everything the client sends
+        self.recv(4096)
+
+    def handle_write(self):
+        self.initiate_send()
+        if not self.out_buffer:
+            self.close()
+
+
+class StatsServer(asyncore.dispatcher):
+
+    ''' Serve the snapshot of a profiler as JSON on a local port '''
+
+    def __init__(self, profiler, port):
+        asyncore.dispatcher.__init__(self)
+        self.profiler = profiler
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.set_reuse_addr()
+        self.bind(('127.0.0.1', port))
+        self.listen(5)
+        LOGGER.info('Serving event statistics on port %d', port)
+
+    def log_info(self, message, type='info'):
+        try:
+            log = getattr(LOGGER, type)
+        except AttributeError:
+            pass
+        else:
+            log(message)
+
+    def handle_accept(self):
+        client_info = self.accept()
+        if client_info is None:
+            return
+        _StatsReply(client_info[0], json.dumps(self.profiler.snapshot()))
+
+
+def start(log_interval=None, port=None):
+    ''' Enable profiling, logging and serving the statistics if asked '''
+    profiler = EventProfiler()
+    enable_profiling(profiler)
+    if log_interval:
+        profiler.log_every(log_interval)
+    if port:
+        profiler.stats_server = StatsServer(profiler, port)
+    return profiler
@@ -0,0 +1,177 @@
+# yaranullin/replay.py
+#
+# Copyright (c) 2012 Marco Scopesi <marco.scopesi@gmail.com>
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+''' Replay of a recorded session.
+
+The messages sent to the server in a log recorded with 'server --record' are
+sent again, either to a headless GameWrapper in this process or to a real
+server, keeping their original timing scaled by a speed factor or as fast as
+possible. The records before a given offset are replayed as fast as possible
+too, to bring the game to the state it had at that moment.
+
+'''
+
+import json
+import time
+import asyncore
+import collections
+import logging
+
+LOGGER = logging.getLogger(__name__)
+
+from yaranullin import startup
+from yaranullin.event_system import post, process_queue
+from yaranullin.network.base import _EndPoint
+from yaranullin.network.recording import read_log, TO_SERVER
+from yaranullin.network.server import CLIENT_REQUESTS
+from yaranullin.profiling import percentiles
+
+
+def _pace(records, speed, start, stop, idle):
+    ''' Yield (lag, record) as soon as every record is due
+
+    The records before 'start' seconds from the beginning of the log, and
+    all of them if speed is 0, are yielded at once. The function 'idle' is
+    called with the time to wait until the next record.
+
+    '''
+    first = None
+    begin = None
+    for record in records:
+        if record.direction != TO_SERVER:
+            continue
+        if first is None:
+            first = record.time
+        offset = record.time - first
+        if stop is not None and offset > stop:
+            break
+        if not speed or offset < start:
+            yield 0, record
+            continue
+        if begin is None:
+            begin = time.time() - (offset - start) / speed
+        due = begin + (offset - start) / speed
+        while True:
+            now = time.time()
+            if now >= due:
+                break
+            idle(due - now)
+        yield now - due, record
+
+
+def replay_game(records, speed=0, start=0, stop=None, game_wrapper=None,
+        boards=()):
+    ''' Replay the records on a headless GameWrapper and return a report '''
+    if game_wrapper is None:
+        from yaranullin.game.game_wrapper import GameWrapper
+        game_wrapper = GameWrapper()
+    game_wrapper.load_from_files(boards)
+    process_queue()
+    counts = collections.defaultdict(int)
+    lags = []
+    handling = collections.defaultdict(list)
+    began = time.time()
+    for lag, record in _pace(records, speed, start, stop, time.sleep):
+        event_dict = record.event_dict
+        event = event_dict['event']
+        if event in CLIENT_REQUESTS:
+            # Tagged like the server does, so that the moves are checked
+            event_dict['client'] = record.client
+        counts[event] += 1
+        lags.append(lag)
+        started = time.time()
+        post(event, event_dict)
+        process_queue()
+        handling[event].append(time.time() - started)
+    elapsed = time.time() - began
+    return dict(events=sum(counts.itervalues()), counts=dict(counts),
+            elapsed=elapsed, lag=percentiles(lags),
+            handling=dict((event, percentiles(samples)) for event, samples
+                in handling.iteritems()))
+
+
+class _ReplayClient(_EndPoint):
+
+    ''' Send the recorded messages of a client to a real server '''
+
+    def __init__(self, address, stats):
+        _EndPoint.__init__(self)
+        self.stats = stats
+        self.connect(address)
+
+    def send_event(self, event_dict):
+        ''' Queue an event for the server '''
+        self._add_to_out_buffer(json.dumps(event_dict))
+        self.stats['sent'] += 1
+
+    def consume(self):
+        ''' Read the messages from the server '''
+        while True:
+            data = self._get_from_in_buffer()
+            if not data:
+                break
+            self.stats['received'] += 1
+            self.stats['received-bytes'] += len(data)
+
+
+def replay_server(records, address, speed=0, start=0, stop=None):
+    ''' Replay the records on a server and return a report
+
+    Every client of the log gets its own connection.
+
+    '''
+    stats = collections.defaultdict(int)
+    clients = {}
+    lags = []
+
+    def idle(timeout):
+        asyncore.poll(min(timeout, 0.01))
+        for client in clients.itervalues():
+            client.consume()
+
+    began = time.time()
+    for lag, record in _pace(records, speed, start, stop, idle):
+        client = clients.get(record.client)
+        if client is None:
+            client = clients[record.client] = _ReplayClient(address, stats)
+        lags.append(lag)
+        client.send_event(record.event_dict)
+        if not speed:
+            # Do not queue the whole log before sending anything
+            idle(0)
+    # Keep receiving for a while to collect the last answers
+    drain = time.time() + 1
+    while time.time() < drain:
+        idle(0.01)
+    elapsed = time.time() - began
+    for client in clients.itervalues():
+        client.close()
+    return dict(events=stats['sent'], clients=len(clients),
+            elapsed=elapsed, lag=percentiles(lags), totals=dict(stats))
+
+
+def run(args):
+    ''' Replay a log and print a report '''
+    records = read_log(args.log)
+    startup.done()
+    if args.port is not None:
+        report = replay_server(records, (args.host, args.port), args.speed,
+                args.start, args.stop)
+    else:
+        report = replay_game(records, args.speed, args.start, args.stop,
+                boards=args.board)
+    report['speed'] = args.speed
+    print json.dumps(report, indent=2, sort_keys=True)
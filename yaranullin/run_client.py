@@ -16,24 +16,45 @@
 
 import asyncore
 
-from yaranullin.config import CONFIG
-from yaranullin.event_system import post, process_queue
+# Importing the cache connects it to the resource events
+from yaranullin import cache, startup
+from yaranullin.config import CONFIG, create_dirs
+from yaranullin.event_system import post, process_queue, enable_offload
+from yaranullin.network.base import wake_on_post, register_local
 from yaranullin.network.client import ClientEndPoint
 from yaranullin.game.game_wrapper import DummyGameWrapper
 
 
-# Initialize network
-ClientEndPoint()
-HOST = CONFIG.get('network', 'host')
-PORT = CONFIG.getint('network', 'port')
-GAME = DummyGameWrapper()
-
-
 def run(args):
     ''' Main loop for the client '''
-    post('join', host=HOST, port=PORT)
+    create_dirs()
+    budget = CONFIG.getfloat('events', 'time-budget')
+    # Only weak references to the callbacks are kept: the end point and the
+    # game must live as long as the loop
+    end_point = ClientEndPoint()
+    game = DummyGameWrapper()
+    enable_offload(CONFIG.getint('events', 'workers'),
+            CONFIG.getint('events', 'max-offloaded'))
+    wake_on_post()
+    table = None
+    if args.local:
+        # Host the game in this process and skip the network
+        from yaranullin.scheduler import Table
+        table = Table('local', args.board,
+                CONFIG.getfloat('game', 'snapshot-interval'))
+        register_local('local', table.router)
+        post('join', local='local')
+    elif args.unix:
+        post('join', path=args.unix, table=args.table)
+    else:
+        post('join', host=args.host or CONFIG.get('network', 'host'),
+                port=args.port or CONFIG.getint('network', 'port'),
+                table=args.table)
+    startup.done()
     stop = False
     while not stop:
+        if table is not None:
+            table.step(budget)
         post('tick')
-        stop = process_queue()
+        stop = process_queue(budget=budget)
         asyncore.poll(0.002)
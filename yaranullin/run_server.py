@@ -14,24 +14,110 @@
 # ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
 # OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
 
+import os
 import asyncore
 
-from yaranullin.config import CONFIG
-from yaranullin.event_system import post, process_queue
-from yaranullin.network.server import Server
+from yaranullin import startup
+from yaranullin.config import CONFIG, create_dirs
+from yaranullin.event_system import default_bus, enable_profiling, \
+        enable_offload
+from yaranullin.network.base import start_recording, stop_recording, \
+        wake_on_post
+from yaranullin.network.recording import Recorder
+from yaranullin.network.server import Server, Lobby
 from yaranullin.game.game_wrapper import GameWrapper
+from yaranullin.game.journal import Journal
+from yaranullin.scheduler import Table, Scheduler
 
 HOST = ''
-PORT = CONFIG.getint('network', 'port')
-Server((HOST, PORT))
-GAME = GameWrapper()
 
 
-def run(args):
-    ''' Main loop for the server '''
-    GAME.load_from_files(args.board)
+def _address(args):
+    ''' Return the address to listen on '''
+    return args.unix or (HOST, CONFIG.getint('network', 'port'))
+
+
+def _open_journal(folder, game, bus):
+    ''' Recover a game from its journal and keep journaling it '''
+    # The boards loaded from the files must exist before the journal
+    # brings them to their latest state
+    bus.process_queue()
+    journal = Journal(folder, CONFIG.getfloat('journal', 'commit-interval'),
+            CONFIG.getint('journal', 'snapshot-every'), bus)
+    if journal.recover():
+        journal.restore(game)
+    # Apply the restored changes before recording the new ones
+    bus.process_queue()
+    game.reset_histories()
+    journal.start(game.game)
+    return journal
+
+
+def _run_tables(args):
+    ''' Host many tables on a single port '''
+    scheduler = Scheduler(CONFIG.getfloat('events', 'time-slice'))
+    snapshot_interval = CONFIG.getfloat('game', 'snapshot-interval')
+    workers = CONFIG.getint('events', 'workers')
+    max_offloaded = CONFIG.getint('events', 'max-offloaded')
+    pool = None
+    for name in args.table:
+        table = Table(name, args.board, snapshot_interval)
+        # The tables share the worker threads
+        pool = enable_offload(workers, max_offloaded, table.bus, pool)
+        wake_on_post(table.bus)
+        if args.journal is not None:
+            _open_journal(os.path.join(args.journal, name), table.game,
+                    table.bus)
+        if args.profiler is not None:
+            enable_profiling(args.profiler, table.bus)
+            if args.stats_interval:
+                args.profiler.log_every(args.stats_interval, table.bus)
+        scheduler.add(table)
+    lobby = Lobby(_address(args), scheduler.tables)
+    if args.profiler is not None:
+        args.profiler.add_source('network', lobby.stats)
+    startup.done()
+    scheduler.run()
+
+
+def _run_game(args):
+    ''' Host a single game '''
+    bus = default_bus()
+    budget = CONFIG.getfloat('events', 'time-budget')
+    enable_offload(CONFIG.getint('events', 'workers'),
+            CONFIG.getint('events', 'max-offloaded'), bus)
+    wake_on_post(bus)
+    server = Server(_address(args), bus)
+    game = GameWrapper(bus)
+    game.enable_snapshots(CONFIG.getfloat('game', 'snapshot-interval'))
+    game.load_from_files(args.board)
+    bus.process_queue()
+    game.reset_histories()
+    if args.journal is not None:
+        _open_journal(args.journal, game, bus)
+    if args.profiler is not None:
+        args.profiler.add_source('network', server.stats)
+    startup.done()
     stop = False
     while not stop:
-        post('tick')
-        stop = process_queue()
+        bus.post('tick')
+        stop = bus.process_queue(budget=budget)
         asyncore.poll(0.01)
+
+
+def run(args):
+    ''' Main loop for the server '''
+    create_dirs()
+    recorder = None
+    if args.record is not None:
+        recorder = Recorder(args.record)
+        start_recording(recorder)
+    try:
+        if args.table:
+            _run_tables(args)
+        else:
+            _run_game(args)
+    finally:
+        if recorder is not None:
+            stop_recording()
+            recorder.close()
@@ -0,0 +1,100 @@
+# yaranullin/scheduler.py
+#
+# Copyright (c) 2012 Marco Scopesi <marco.scopesi@gmail.com>
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+''' Many independent games in a single process.
+
+Every table has its own event bus, game and router. The scheduler runs the
+tables cooperatively: in every round each table processes its events for
+the same slice of time, and the table going first changes every round so
+that a busy table cannot starve the ones after it.
+
+'''
+
+import time
+import asyncore
+import collections
+import logging
+
+LOGGER = logging.getLogger(__name__)
+
+from yaranullin.event_system import EventBus
+from yaranullin.game.game_wrapper import GameWrapper
+from yaranullin.network.server import Router
+
+
+class Table(object):
+
+    ''' A game with its own event bus '''
+
+    def __init__(self, name, boards=(), snapshot_interval=None):
+        self.name = name
+        self.bus = EventBus(name)
+        self.game = GameWrapper(self.bus)
+        self.router = Router(self.bus)
+        self.stopped = False
+        if snapshot_interval is not None:
+            self.game.enable_snapshots(snapshot_interval)
+        self.game.load_from_files(boards)
+        self.bus.process_queue()
+        self.game.reset_histories()
+
+    def step(self, budget=None):
+        ''' Process the events of the table for at most budget seconds '''
+        self.bus.post('tick')
+        if self.bus.process_queue(budget=budget):
+            LOGGER.info("Table '%s' stopped", self.name)
+            self.stopped = True
+        return self.stopped
+
+
+class Scheduler(object):
+
+    ''' Run many tables with fair time slices '''
+
+    def __init__(self, time_slice=0.005):
+        self.time_slice = time_slice
+        self.tables = collections.OrderedDict()
+        # Index of the table going first in the next round
+        self._first = 0
+
+    def add(self, table):
+        ''' Add a table '''
+        if table.name in self.tables:
+            raise ValueError("Table '%s' already exists" % table.name)
+        self.tables[table.name] = table
+
+    def remove(self, name):
+        ''' Remove a table '''
+        return self.tables.pop(name, None)
+
+    def step(self):
+        ''' Give every table a time slice; return the time spent '''
+        started = time.time()
+        tables = self.tables.values()
+        if not tables:
+            return 0
+        first = self._first % len(tables)
+        self._first = first + 1
+        for table in tables[first:] + tables[:first]:
+            if table.step(self.time_slice):
+                self.remove(table.name)
+        return time.time() - started
+
+    def run(self, poll=0.01):
+        ''' Run the tables until every one of them has stopped '''
+        while self.tables:
+            self.step()
+            asyncore.poll(poll)
@@ -0,0 +1,110 @@
+# yaranullin/startup.py
+#
+# Copyright (c) 2012 Marco Scopesi <marco.scopesi@gmail.com>
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+''' Timings of the startup of Yaranullin.
+
+With main.py --profile-startup, the time spent importing every module and
+initializing the runner is logged once the main loop is about to start.
+This module must not import anything from Yaranullin.
+
+'''
+
+import sys
+import time
+import __builtin__
+import logging
+
+LOGGER = logging.getLogger(__name__)
+
+
+class StartupProfiler(object):
+
+    ''' Measure the phases of the startup and the imports '''
+
+    def __init__(self):
+        self.started = self._last = time.time()
+        self.phases = []
+        # Inclusive import time of every module
+        self.imports = {}
+        self._import = None
+
+    def watch_imports(self):
+        ''' Time the modules imported from now on '''
+        self._import = original = __builtin__.__import__
+        imports = self.imports
+
+        def _timed_import(name, *args, **kargs):
+            if name in sys.modules:
+                return original(name, *args, **kargs)
+            started = time.time()
+            try:
+                return original(name, *args, **kargs)
+            finally:
+                imports.setdefault(name, time.time() - started)
+
+        __builtin__.__import__ = _timed_import
+
+    def unwatch_imports(self):
+        ''' Stop timing the imports '''
+        if self._import is not None:
+            __builtin__.__import__ = self._import
+            self._import = None
+
+    def mark(self, phase):
+        ''' Record the time spent since the previous phase '''
+        now = time.time()
+        self.phases.append((phase, now - self._last))
+        self._last = now
+
+    def report(self, top=10):
+        ''' Log the phases and the slowest imports '''
+        for phase, duration in self.phases:
+            LOGGER.info('Startup: %s took %.1f ms', phase, duration * 1000)
+        slowest = sorted(self.imports.iteritems(), key=lambda item: item[1],
+                reverse=True)[:top]
+        for name, duration in slowest:
+            LOGGER.info('Startup: import %s took %.1f ms', name,
+                    duration * 1000)
+        LOGGER.info('Startup: ready in %.1f ms', (self._last - self.started)
+                * 1000)
+
+
+_PROFILER = None
+
+
+def enable():
+    ''' Start profiling the startup '''
+    global _PROFILER
+    _PROFILER = StartupProfiler()
+    _PROFILER.watch_imports()
+    return _PROFILER
+
+
+def mark(phase):
+    ''' Record a phase of the startup, if it is profiled '''
+    if _PROFILER is not None:
+        _PROFILER.mark(phase)
+
+
+def done():
+    ''' Mark the end of the startup and log the report '''
+    global _PROFILER
+    if _PROFILER is None:
+        return
+    profiler, _PROFILER = _PROFILER, None
+    profiler.mark('init')
+    profiler.unwatch_imports()
+    profiler.report()
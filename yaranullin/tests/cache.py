@@ -0,0 +1,169 @@
+# yaranullin/tests/cache.py
+#
+# Copyright (c) 2012 Marco Scopesi <marco.scopesi@gmail.com>
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+import os
+import sys
+import base64
+import shutil
+import tempfile
+import unittest
+
+if __name__ == '__main__':
+    sys.path.insert(0, ".")
+
+from yaranullin import cache
+from yaranullin.event_system import _QUEUE, process_queue, connect
+
+LOADS = []
+
+
+@cache.cache
+def load_text(name):
+    ''' Simple cached loader '''
+    LOADS.append(name)
+    with open(os.path.join(cache.YR_CACHE_DIR, name)) as file_:
+        return file_.read()
+
+
+class TestCache(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.old_cache_dir = cache.YR_CACHE_DIR
+        cache.YR_CACHE_DIR = self.folder
+        _QUEUE.clear()
+        del LOADS[:]
+
+    def tearDown(self):
+        cache.YR_CACHE_DIR = self.old_cache_dir
+        cache._REQUESTED.clear()
+        cache._PENDING.clear()
+        shutil.rmtree(self.folder)
+        _QUEUE.clear()
+
+    def requests(self):
+        return [ev['name'] for ev in _QUEUE if ev['event'] ==
+                'resource-request']
+
+    def test_missing(self):
+        pending = load_text('missing.txt')
+        self.assertIsInstance(pending, cache.PendingResource)
+        self.assertFalse(pending.done())
+        # Further lookups neither hit the disk nor ask the server again
+        self.assertIs(pending, load_text('missing.txt'))
+        self.assertEqual(['missing.txt'], self.requests())
+        self.assertEqual(['missing.txt'], LOADS)
+
+    def test_resolve(self):
+        results = []
+        pending = load_text('late.txt')
+        pending.add_done_callback(lambda pending: results.append(
+            pending.result()))
+        with open(os.path.join(self.folder, 'late.txt'), 'w') as file_:
+            file_.write('content')
+        cache.resource_ready({'name': 'late.txt'})
+        self.assertTrue(pending.done())
+        self.assertEqual(['content'], results)
+        self.assertEqual('content', load_text('late.txt'))
+
+    def test_missing_on_server(self):
+        results = []
+        pending = load_text('gone.txt')
+        pending.add_done_callback(lambda pending: results.append(
+            pending.result()))
+        cache.resource_missing({'name': 'gone.txt'})
+        self.assertTrue(pending.done())
+        self.assertEqual([None], results)
+        # The next lookup asks the server again
+        self.assertIsNot(pending, load_text('gone.txt'))
+        self.assertEqual(['gone.txt', 'gone.txt'], self.requests())
+
+    def test_prefetch(self):
+        with open(os.path.join(self.folder, 'here.png'), 'w') as file_:
+            file_.write('')
+        cache.prefetch({'names': ['here.png', 'a.png', 'b.png']})
+        cache.prefetch({'names': ['a.png']})
+        self.assertEqual(['a.png', 'b.png'], sorted(self.requests()))
+
+
+class TestCacheWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.old_cache_dir = cache.YR_CACHE_DIR
+        cache.YR_CACHE_DIR = self.folder
+        _QUEUE.clear()
+        # Other tests may have disconnected every callback
+        connect('resource-ready', cache.resource_ready)
+
+    def tearDown(self):
+        cache.YR_CACHE_DIR = self.old_cache_dir
+        cache._REQUESTED.clear()
+        cache._PENDING.clear()
+        shutil.rmtree(self.folder)
+        _QUEUE.clear()
+
+    def test_update(self):
+        pending = load_text('map.tmx')
+        cache.update_cache({'name': 'map.tmx', 'resource': u'<map/>\n'})
+        self.assertTrue(cache._WRITER.flush(5))
+        # Written in binary mode, without leftovers
+        self.assertEqual(['map.tmx'], os.listdir(self.folder))
+        with open(os.path.join(self.folder, 'map.tmx'), 'rb') as file_:
+            self.assertEqual('<map/>\n', file_.read())
+        # The writer thread announces the resource to the loop thread
+        self.assertFalse(pending.done())
+        process_queue()
+        self.assertTrue(pending.done())
+        self.assertEqual('<map/>\n', pending.result())
+
+    def test_bigger_than_limit(self):
+        writer = cache.CacheWriter(max_in_flight=4)
+        for index in range(3):
+            writer.write('big-%d' % index, 'x' * 10)
+            self.assertLessEqual(writer.in_flight(), 10)
+        self.assertTrue(writer.flush(5))
+        self.assertEqual(['big-0', 'big-1', 'big-2'],
+                sorted(os.listdir(self.folder)))
+
+    def test_chunk_outside_cache(self):
+        cache.write_chunk({'name': '../escaped', 'offset': 0, 'size': 2,
+                'data': base64.b64encode('xx')})
+        cache.update_cache({'name': '../escaped', 'resource': 'xx'})
+        self.assertTrue(cache._WRITER.flush(5))
+        self.assertFalse(os.path.exists(os.path.join(self.folder,
+            '..', 'escaped')))
+        self.assertEqual([], os.listdir(self.folder))
+
+    def test_chunk_truncate(self):
+        with open(os.path.join(self.folder, 'map.tmx.part'), 'wb') as file_:
+            file_.write('a much longer leftover')
+        cache.write_chunk({'name': 'map.tmx', 'offset': 0, 'size': 6,
+                'data': base64.b64encode('<map/>')})
+        with open(os.path.join(self.folder, 'map.tmx'), 'rb') as file_:
+            self.assertEqual('<map/>', file_.read())
+
+    def test_write_durably(self):
+        path = os.path.join(self.folder, 'sub', 'file')
+        cache.write_durably(path, 'old')
+        cache.write_durably(path, 'new')
+        with open(path, 'rb') as file_:
+            self.assertEqual('new', file_.read())
+        self.assertEqual(['file'], os.listdir(os.path.dirname(path)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+# yaranullin/tests/config.py
+#
+# Copyright (c) 2012 Marco Scopesi <marco.scopesi@gmail.com>
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+import sys
+import subprocess
+import unittest
+
+if __name__ == '__main__':
+    sys.path.insert(0, ".")
+
+from yaranullin import config, startup
+
+
+class TestConfig(unittest.TestCase):
+
+    def test_cached(self):
+        self.assertIs(config.get_config(), config.get_config())
+        self.assertEqual(config.get_config().getint('network', 'port'),
+                config.CONFIG.getint('network', 'port'))
+
+    def test_read_only(self):
+        self.assertRaises(AttributeError, getattr, config.CONFIG, 'set')
+
+    def test_import_does_not_parse(self):
+        # A new interpreter, where nothing was imported yet
+        code = ('import sys; import yaranullin.run_server, '
+                'yaranullin.run_client, yaranullin.network.server, '
+                'yaranullin.game.game_wrapper; '
+                'from yaranullin import config; '
+                'sys.exit(config._CONFIG is not None)')
+        self.assertEqual(0, subprocess.call([sys.executable, '-c', code]))
+
+
+class TestStartup(unittest.TestCase):
+
+    def test_imports(self):
+        profiler = startup.StartupProfiler()
+        profiler.watch_imports()
+        try:
+            sys.modules.pop('colorsys', None)
+            import colorsys
+        finally:
+            profiler.unwatch_imports()
+        profiler.mark('import')
+        self.assertIn('colorsys', profiler.imports)
+        self.assertEqual(['import'], [phase for phase, _ in
+            profiler.phases])
+
+
+if __name__ == '__main__':
+    unittest.main()
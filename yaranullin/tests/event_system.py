@@ -15,6 +15,8 @@
 # OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
 
 import sys
+import select
+import threading
 import unittest
 import collections
 
@@ -23,7 +25,8 @@ if __name__ == '__main__':
 
 from yaranullin.weakcallback import WeakCallback
 from yaranullin.event_system import connect, disconnect, post, _EVENTS, \
-        _QUEUE, process_queue
+        _QUEUE, process_queue, EventQueue, EventBus, default_bus, get_bus, \
+        enable_offload, disable_offload
 
 Q = collections.deque()
 
@@ -79,5 +82,195 @@ class TestEvents(unittest.TestCase):
         self.failUnlessEqual(event_dict, Q.popleft())
 
 
+class TestEventQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.queue = EventQueue()
+
+    def test_priority(self):
+        post('mouse-motion', pos=(0, 0), rel=(1, 1), queue=self.queue)
+        post('test', queue=self.queue)
+        post('quit', queue=self.queue)
+        events = [self.queue.popleft()['event'] for _ in range(3)]
+        self.assertEqual(['quit', 'test', 'mouse-motion'], events)
+        self.assertFalse(self.queue)
+
+    def test_dependent_requests(self):
+        post('test', queue=self.queue)
+        post('game-request-board-new', name='b', size=(8, 8),
+                queue=self.queue)
+        post('game-request-pawn-new', bname='b', pname='p', pos=(1, 1),
+                size=(1, 1), queue=self.queue)
+        post('game-request-pawn-move', bname='b', pname='p', pos=(2, 2),
+                queue=self.queue)
+        post('game-request-pawn-move', bname='b', pname='q', pos=(3, 3),
+                queue=self.queue)
+        post('game-request-pawn-del', bname='b', pname='p', queue=self.queue)
+        events = [self.queue.popleft() for _ in range(6)]
+        self.assertEqual([('test', None), ('game-request-board-new', None),
+            ('game-request-pawn-move', 'q'), ('game-request-pawn-new', 'p'),
+            ('game-request-pawn-move', 'p'), ('game-request-pawn-del', 'p')],
+            [(event_dict['event'], event_dict.get('pname')) for event_dict
+                in events])
+        # Once the bulk load is processed, moves go first again
+        post('test', queue=self.queue)
+        post('game-request-pawn-move', bname='b', pname='p', pos=(2, 2),
+                queue=self.queue)
+        self.assertEqual('game-request-pawn-move',
+                self.queue.popleft()['event'])
+
+    def test_coalesce(self):
+        post('game-event-pawn-moved', bname='b', pname='p', pos=(1, 1),
+                queue=self.queue)
+        post('game-event-pawn-moved', bname='b', pname='q', pos=(2, 2),
+                queue=self.queue)
+        post('game-event-pawn-moved', bname='b', pname='p', pos=(3, 3),
+                queue=self.queue)
+        self.assertEqual(2, len(self.queue))
+        event_dict = self.queue.popleft()
+        self.assertEqual(('p', (3, 3)), (event_dict['pname'],
+            event_dict['pos']))
+        # Once the event is out of the queue, it cannot be coalesced
+        post('game-event-pawn-moved', bname='b', pname='p', pos=(4, 4),
+                queue=self.queue)
+        self.assertEqual(2, len(self.queue))
+
+    def test_coalesce_in_order(self):
+        post('game-event-pawn-moved', bname='b', pname='p', pos=(5, 5),
+                queue=self.queue)
+        post('game-event-pawn-del', bname='b', pname='p', queue=self.queue)
+        post('game-event-pawn-new', bname='b', pname='p', pos=(5, 5),
+                size=(1, 1), queue=self.queue)
+        post('game-event-pawn-moved', bname='b', pname='p', pos=(6, 6),
+                queue=self.queue)
+        events = [self.queue.popleft() for _ in range(3)]
+        self.assertFalse(self.queue)
+        self.assertEqual(['game-event-pawn-del', 'game-event-pawn-new',
+            'game-event-pawn-moved'], [event_dict['event'] for event_dict
+                in events])
+        self.assertEqual((6, 6), events[2]['pos'])
+
+    def test_merge(self):
+        post('mouse-motion', pos=(1, 1), rel=(1, 1), queue=self.queue)
+        post('mouse-motion', pos=(3, 2), rel=(2, 1), queue=self.queue)
+        event_dict = self.queue.popleft()
+        self.assertEqual((3, 2), event_dict['pos'])
+        self.assertEqual((3, 2), event_dict['rel'])
+
+    def test_budget(self):
+        connect('test', func_handler)
+        for _ in range(10):
+            post('test', queue=self.queue)
+        process_queue(self.queue, budget=-1)
+        self.assertEqual(9, len(self.queue))
+        disconnect('test', func_handler)
+
+
+class TestEventBus(unittest.TestCase):
+
+    def setUp(self):
+        _QUEUE.clear()
+        _EVENTS.clear()
+        Q.clear()
+
+    def test_get_bus(self):
+        bus = EventBus('table')
+        self.assertIs(bus, get_bus(bus))
+        self.assertIs(default_bus(), get_bus())
+
+    def test_isolation(self):
+        bus = EventBus('table')
+        other = EventBus('other')
+        bus.connect('test', func_handler)
+        bus.post('test', value=1)
+        other.post('test', value=2)
+        post('test', value=3)
+        self.assertEqual(1, len(bus.queue))
+        self.assertFalse(_EVENTS['test'])
+        other.process_queue()
+        process_queue()
+        self.assertFalse(Q)
+        bus.process_queue()
+        self.assertEqual([{'value': 1}], list(Q))
+        bus.disconnect('test', func_handler)
+        self.assertFalse(bus.events['test'])
+
+
+class Writer(object):
+
+    def __init__(self, bus):
+        self.bus = bus
+        self.threads = []
+
+    def write(self, event_dict):
+        self.threads.append(threading.current_thread())
+        self.bus.post('written', name=event_dict['name'])
+
+
+class TestThreads(unittest.TestCase):
+
+    def setUp(self):
+        self.bus = EventBus('threads')
+        self.received = []
+        self.bus.connect('written', self.on_written)
+
+    def tearDown(self):
+        # Unittest keeps the test cases: let go of the callbacks
+        del self.bus
+
+    def on_written(self, event_dict):
+        self.received.append(event_dict['name'])
+
+    def test_post_from_thread(self):
+        wakeup = self.bus.enable_wakeup()
+        thread = threading.Thread(target=self.bus.post, args=('written',),
+                kwargs=dict(name='a'))
+        thread.start()
+        thread.join()
+        self.assertFalse(self.bus.queue)
+        self.assertEqual([wakeup.fileno()],
+                select.select([wakeup.fileno()], [], [], 1)[0])
+        self.bus.process_queue()
+        self.assertEqual(['a'], self.received)
+        self.assertEqual([], select.select([wakeup.fileno()], [], [], 0)[0])
+        wakeup.close()
+
+    def test_offload(self):
+        writer = Writer(self.bus)
+        self.bus.connect('write', writer.write, offload=True)
+        # Without a pool the handler runs on the loop thread
+        self.bus.post('write', name='a')
+        self.bus.process_queue()
+        self.assertEqual(['a'], self.received)
+        pool = enable_offload(2, bus=self.bus)
+        try:
+            self.bus.post('write', name='b')
+            self.bus.process_queue()
+            self.assertTrue(pool.join(5))
+            self.assertNotEqual(threading.current_thread(),
+                    writer.threads[-1])
+            # The event posted by the worker comes back to this thread
+            self.assertEqual(['a'], self.received)
+            self.bus.process_queue()
+            self.assertEqual(['a', 'b'], self.received)
+        finally:
+            disable_offload(self.bus)
+
+    def test_shared_pool(self):
+        other = EventBus('other')
+        writer = Writer(other)
+        other.connect('write', writer.write, offload=True)
+        pool = enable_offload(2, bus=self.bus)
+        try:
+            self.assertIs(pool, enable_offload(bus=other, pool=pool))
+            other.post('write', name='a')
+            other.process_queue()
+            self.assertTrue(pool.join(5))
+            self.assertNotEqual(threading.current_thread(),
+                    writer.threads[-1])
+        finally:
+            disable_offload(self.bus)
+
+
 if __name__ == '__main__':
     unittest.main()
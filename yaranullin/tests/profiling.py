@@ -0,0 +1,84 @@
+# yaranullin/tests/profiling.py
+#
+# Copyright (c) 2012 Marco Scopesi <marco.scopesi@gmail.com>
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+import sys
+import unittest
+
+if __name__ == '__main__':
+    sys.path.insert(0, ".")
+
+from yaranullin.event_system import connect, post, process_queue, \
+        enable_profiling, disable_profiling, _QUEUE, _EVENTS, EventBus
+from yaranullin.profiling import EventProfiler, ENQUEUED
+
+
+def handler(event_dict):
+    ''' Simple function handler '''
+
+
+class TestProfiler(unittest.TestCase):
+
+    def setUp(self):
+        _QUEUE.clear()
+        _EVENTS.clear()
+        self.profiler = EventProfiler()
+        enable_profiling(self.profiler)
+
+    def tearDown(self):
+        disable_profiling()
+        _EVENTS.clear()
+
+    def test_snapshot(self):
+        connect('test', handler)
+        for _ in range(3):
+            post('test')
+        post('tick')
+        post('tick')
+        process_queue()
+        snapshot = self.profiler.snapshot()
+        self.assertEqual(3, snapshot['events']['test']['posted'])
+        self.assertEqual(3, snapshot['events']['test']['queue']['calls'])
+        self.assertEqual(1, snapshot['events']['tick']['coalesced'])
+        self.assertEqual(4, snapshot['max_depth'])
+        name = 'yaranullin.tests.profiling.handler'
+        self.assertEqual(3, snapshot['handlers'][name]['calls'])
+        self.assertIn('p99', snapshot['handlers'][name])
+        self.assertIn(name, self.profiler.summary())
+
+    def test_latency_in_event(self):
+        connect('tick', handler)
+        post('tick')
+        post('tick')
+        # The time leaves the profiler with the events never processed
+        self.assertIn(ENQUEUED, _QUEUE.popleft())
+        post('tick')
+        process_queue()
+        snapshot = self.profiler.snapshot()
+        self.assertEqual(1, snapshot['events']['tick']['queue']['calls'])
+
+    def test_log_on_bus(self):
+        bus = EventBus('table')
+        enable_profiling(self.profiler, bus)
+        self.profiler.log_every(0, bus)
+        self.profiler._last_log = 0
+        # The summary is logged on the ticks of the table bus
+        bus.post('tick')
+        bus.process_queue()
+        self.assertNotEqual(0, self.profiler._last_log)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+# yaranullin/tests/replay.py
+#
+# Copyright (c) 2012 Marco Scopesi <marco.scopesi@gmail.com>
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+import sys
+import time
+import unittest
+
+if __name__ == '__main__':
+    sys.path.insert(0, ".")
+
+from yaranullin.event_system import disconnect
+from yaranullin.game.game_wrapper import GameWrapper
+from yaranullin.network.recording import Record, TO_SERVER, TO_CLIENT
+from yaranullin.replay import replay_game, _pace
+
+
+def _records(step=0.125):
+    events = [
+        {'event': 'game-request-board-new', 'name': 'Dungeon',
+            'size': (10, 10)},
+        {'event': 'game-request-pawn-new', 'bname': 'Dungeon',
+            'pname': 'Dragon', 'initiative': 10, 'pos': (1, 1),
+            'size': (1, 1)},
+        {'event': 'game-event-pawn-new', 'bname': 'Dungeon'},
+        {'event': 'game-request-pawn-move', 'bname': 'Dungeon',
+            'pname': 'Dragon', 'pos': (4, 5)},
+    ]
+    records = []
+    for i, event_dict in enumerate(events):
+        direction = TO_SERVER
+        if event_dict['event'].startswith('game-event-'):
+            direction = TO_CLIENT
+        records.append(Record(100 + i * step, direction, 1, event_dict))
+    return records
+
+
+class TestReplay(unittest.TestCase):
+
+    def tearDown(self):
+        disconnect()
+
+    def test_replay_game(self):
+        game_wrapper = GameWrapper()
+        report = replay_game(_records(), game_wrapper=game_wrapper)
+        # The messages sent to the clients are not replayed
+        self.assertEqual(report['events'], 3)
+        pawn = game_wrapper.game.boards['Dungeon'].pawns['Dragon']
+        self.assertEqual(pawn.pos, (4, 5))
+
+    def test_client_moves_checked(self):
+        game_wrapper = GameWrapper()
+        game_wrapper.max_range = 2
+        replay_game(_records(), game_wrapper=game_wrapper)
+        # The recorded move is too far for a client
+        pawn = game_wrapper.game.boards['Dungeon'].pawns['Dragon']
+        self.assertEqual(pawn.pos, (1, 1))
+
+    def test_stop(self):
+        game_wrapper = GameWrapper()
+        report = replay_game(_records(), stop=0.2, game_wrapper=game_wrapper)
+        self.assertEqual(report['events'], 2)
+        pawn = game_wrapper.game.boards['Dungeon'].pawns['Dragon']
+        self.assertEqual(pawn.pos, (1, 1))
+
+    def test_pace(self):
+        waits = []
+
+        def idle(timeout):
+            waits.append(timeout)
+            time.sleep(timeout)
+
+        began = time.time()
+        # The last 0.25 seconds of the log at twice the speed
+        paced = list(_pace(_records(), 2, 0.125, None, idle))
+        self.assertEqual(len(paced), 3)
+        self.assertTrue(waits)
+        self.assertTrue(0.12 <= time.time() - began < 0.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
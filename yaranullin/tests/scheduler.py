@@ -0,0 +1,94 @@
+# yaranullin/tests/scheduler.py
+#
+# Copyright (c) 2012 Marco Scopesi <marco.scopesi@gmail.com>
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+import sys
+import unittest
+
+if __name__ == '__main__':
+    sys.path.insert(0, ".")
+
+from yaranullin.scheduler import Table, Scheduler
+
+
+class FakeTable(object):
+
+    def __init__(self, name, order, steps=None):
+        self.name = name
+        self.order = order
+        self.steps = steps
+
+    def step(self, budget=None):
+        self.order.append(self.name)
+        if self.steps is not None:
+            self.steps -= 1
+            return self.steps <= 0
+        return False
+
+
+class TestScheduler(unittest.TestCase):
+
+    def test_rotation(self):
+        order = []
+        scheduler = Scheduler()
+        for name in 'abc':
+            scheduler.add(FakeTable(name, order))
+        for _ in range(3):
+            scheduler.step()
+        self.assertEqual(list('abcbcacab'), order)
+
+    def test_duplicate(self):
+        scheduler = Scheduler()
+        scheduler.add(FakeTable('a', []))
+        self.assertRaises(ValueError, scheduler.add, FakeTable('a', []))
+
+    def test_stopped(self):
+        order = []
+        scheduler = Scheduler()
+        scheduler.add(FakeTable('a', order, steps=1))
+        scheduler.add(FakeTable('b', order, steps=3))
+        scheduler.run(poll=0)
+        self.assertEqual(list('abbb'), order)
+        self.assertFalse(scheduler.tables)
+
+
+class TestTable(unittest.TestCase):
+
+    def test_independent(self):
+        scheduler = Scheduler()
+        red = Table('red')
+        blue = Table('blue')
+        scheduler.add(red)
+        scheduler.add(blue)
+        red.bus.post('game-request-board-new', name='Dungeon', size=(5, 5))
+        blue.bus.post('game-request-board-new', name='Cave', size=(3, 3))
+        scheduler.step()
+        self.assertEqual(['Dungeon'], red.game.game.boards.keys())
+        self.assertEqual(['Cave'], blue.game.game.boards.keys())
+
+    def test_quit(self):
+        scheduler = Scheduler()
+        red = Table('red')
+        blue = Table('blue')
+        scheduler.add(red)
+        scheduler.add(blue)
+        red.bus.post('quit')
+        scheduler.step()
+        self.assertTrue(red.stopped)
+        self.assertEqual(['blue'], scheduler.tables.keys())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -44,6 +44,27 @@ class TestWeakCallback(unittest.TestCase):
         del weak_t2
         self.assertEqual(0, len(WeakCallback._map))
 
+    def test_distinct_owners(self):
+        test1 = Test()
+        test2 = Test()
+        self.assertIsNot(WeakCallback(test1.t), WeakCallback(test2.t))
+
+    def test_dispatch(self):
+        test = Test()
+        weak_t = WeakCallback(test.t)
+        self.assertEqual(0, weak_t.nargs)
+        self.assertTrue(weak_t.dispatch({}))
+        del test
+        self.assertFalse(weak_t.dispatch({}))
+
+    def test_track(self):
+        test = Test()
+        weak_t = WeakCallback(test.t)
+        container = set([weak_t])
+        weak_t.track(container)
+        del test
+        self.assertEqual(set(), container)
+
 
 if __name__ == '__main__':
     unittest.main()
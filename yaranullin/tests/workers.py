@@ -0,0 +1,94 @@
+# yaranullin/tests/workers.py
+#
+# Copyright (c) 2012 Marco Scopesi <marco.scopesi@gmail.com>
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+import sys
+import time
+import threading
+import unittest
+
+if __name__ == '__main__':
+    sys.path.insert(0, ".")
+
+from yaranullin.weakcallback import WeakCallback
+from yaranullin.workers import WorkerPool
+
+
+class Recorder(object):
+
+    def __init__(self):
+        self.values = []
+        self.threads = set()
+
+    def handle(self, event_dict):
+        # Give the other workers a chance to overtake this one
+        time.sleep(0.001)
+        self.values.append(event_dict['value'])
+        self.threads.add(threading.current_thread().name)
+
+
+class TestWorkerPool(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = WorkerPool(workers=3, max_pending=4)
+
+    def tearDown(self):
+        self.pool.close()
+
+    def test_order(self):
+        first, second = Recorder(), Recorder()
+        for value in range(20):
+            self.pool.submit(WeakCallback(first.handle), dict(value=value))
+            self.pool.submit(WeakCallback(second.handle), dict(value=value))
+        self.assertTrue(self.pool.join(5))
+        self.assertEqual(range(20), first.values)
+        self.assertEqual(range(20), second.values)
+        self.assertNotIn(threading.current_thread().name, first.threads)
+
+    def test_bounded(self):
+        release = threading.Event()
+
+        class Blocked(object):
+            def handle(self):
+                release.wait()
+
+        blocked = Blocked()
+        for _ in range(4):
+            self.pool.submit(WeakCallback(blocked.handle), {})
+        submitted = threading.Event()
+
+        def submit():
+            self.pool.submit(WeakCallback(blocked.handle), {})
+            submitted.set()
+
+        thread = threading.Thread(target=submit)
+        thread.start()
+        # The fifth event waits for a free slot
+        self.assertFalse(submitted.wait(0.05))
+        release.set()
+        self.assertTrue(submitted.wait(5))
+        thread.join()
+        self.assertTrue(self.pool.join(5))
+
+    def test_failure(self):
+        recorder = Recorder()
+        self.pool.submit(WeakCallback(recorder.handle), {})
+        self.pool.submit(WeakCallback(recorder.handle), dict(value=1))
+        self.assertTrue(self.pool.join(5))
+        self.assertEqual([1], recorder.values)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -19,41 +19,98 @@
 This is needed because it is impossible to directly save a weak reference to
 a bound method (i.e. using weakref.ref).
 
+The function of a bound method and a weak reference to its owner are stored
+separately, so that calling the callback does not need to build a new bound
+method every time.
+
 '''
 
 import inspect
 import weakref
 
 
+def _get_key(callback):
+    ''' Return a key identifying the callback '''
+    try:
+        obj = callback.im_self
+    except AttributeError:
+        return id(callback), None
+    if obj is None:
+        # Unbound method
+        return id(callback.im_func), None
+    return id(callback.im_func), id(obj)
+
+
 class WeakCallback(object):
 
     ''' Store a weak reference to a method or function
 
     For a given callback returns always the same instance of WeakCallback.
 
+    As soon as the owner of a bound method dies, the WeakCallback removes
+    itself from every container passed to track().
+
     '''
 
     _map = weakref.WeakValueDictionary()
 
     def __new__(cls, callback):
-        cb_id = hash(callback)
-        if cb_id in cls._map:
-            return cls._map[cb_id]
         if (not inspect.ismethod(callback) and not
                 inspect.isfunction(callback)):
             raise TypeError("'%s' is not a method or function" %
                     str(type(callback)))
-        obj = object.__new__(cls, callback)
-        cls._map[cb_id] = obj
+        # The key is made of ids and not of hashes, to avoid collisions
+        # between different objects. The ids of a dead owner cannot be
+        # reused before its WeakCallback is purged from the map.
+        key = _get_key(callback)
+        try:
+            return cls._map[key]
+        except KeyError:
+            pass
+        obj = object.__new__(cls)
+        obj._setup(callback, key)
+        cls._map[key] = obj
         return obj
 
-    def __init__(self, callback):
-        try:
-            self._obj = weakref.ref(callback.im_self)
-            self._func = callback.im_func
-        except AttributeError:
+    def _setup(self, callback, key):
+        ''' Initialize a new instance '''
+        self._key = key
+        self._containers = []
+        self_ref = weakref.ref(self)
+
+        def on_death(_):
+            wrapper = self_ref()
+            if wrapper is not None:
+                wrapper._purge()
+
+        if key[1] is None:
             self._obj = None
-            self._func = callback
+            self._func = getattr(callback, 'im_func', callback)
+            self.name = '%s.%s' % (self._func.__module__,
+                    self._func.__name__)
+            bound = 0
+        else:
+            self._obj = weakref.ref(callback.im_self, on_death)
+            self._func = callback.im_func
+            self.name = '%s.%s.%s' % (self._func.__module__,
+                    type(callback.im_self).__name__, self._func.__name__)
+            bound = 1
+        args, _, _, _ = inspect.getargspec(self._func)
+        self.nargs = len(args) - bound
+
+    def _purge(self):
+        ''' Remove a dead callback from the map and from all containers '''
+        if self._map.get(self._key) is self:
+            del self._map[self._key]
+        for container_ref in self._containers:
+            container = container_ref()
+            if container is not None:
+                container.discard(self)
+        del self._containers[:]
+
+    def track(self, container):
+        ''' Remove this callback from 'container' when it dies '''
+        self._containers.append(weakref.ref(container))
 
     def __call__(self):
         ''' Return a reference to the callback or None '''
@@ -66,4 +123,26 @@ class WeakCallback(object):
             if obj is None:
                 return None
             else:
-                return getattr(obj, self._func.__name__)
+                return self._func.__get__(obj, type(obj))
+
+    def dispatch(self, event_dict):
+        ''' Call the callback, return False if it is dead
+
+        The event dictionary is passed only if the callback expects an
+        argument.
+
+        '''
+        if self._obj is None:
+            args = ()
+        else:
+            obj = self._obj()
+            if obj is None:
+                return False
+            args = (obj, )
+        if self.nargs == 1:
+            args += (event_dict, )
+        elif self.nargs != 0:
+            raise TypeError("Bad number of arguments for callback '%s'" %
+                    repr(self._func))
+        self._func(*args)
+        return True
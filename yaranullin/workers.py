@@ -0,0 +1,127 @@
+# yaranullin/workers.py
+#
+# Copyright (c) 2012 Marco Scopesi <marco.scopesi@gmail.com>
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+''' A bounded pool of threads running event handlers.
+
+Handlers doing disk or heavy work can be offloaded from the loop thread.
+The events of a handler are run one at a time and in the order they were
+posted, like they would be on the loop thread; different handlers run in
+parallel. The events they post are marshalled back to the loop thread by
+the event bus.
+
+'''
+
+import time
+import Queue
+import threading
+import collections
+import logging
+
+LOGGER = logging.getLogger(__name__)
+
+
+class WorkerPool(object):
+
+    ''' Run offloaded handlers in a fixed number of threads '''
+
+    def __init__(self, workers=4, max_pending=256):
+        self.max_pending = max_pending
+        self._lock = threading.Condition(threading.Lock())
+        # Events waiting for every handler, and the handlers having events
+        # but no worker running them
+        self._lanes = {}
+        self._ready = Queue.Queue()
+        self._pending = 0
+        self._closed = False
+        self._threads = []
+        for index in xrange(workers):
+            thread = threading.Thread(target=self._work,
+                    name='handler-worker-%d' % index)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, handler, event_dict):
+        ''' Queue an event for a handler (a WeakCallback)
+
+        If max_pending events are already waiting, block until a worker is
+        done with one of them: a slow disk must slow down the loop instead
+        of filling the memory.
+
+        '''
+        with self._lock:
+            while self._pending >= self.max_pending and not self._closed:
+                self._lock.wait()
+            if self._closed:
+                return False
+            self._pending += 1
+            lane = self._lanes.get(handler)
+            if lane is None:
+                self._lanes[handler] = collections.deque([event_dict])
+                self._ready.put(handler)
+            else:
+                lane.append(event_dict)
+        return True
+
+    def pending(self):
+        ''' Return the number of events not yet handled '''
+        with self._lock:
+            return self._pending
+
+    def join(self, timeout=None):
+        ''' Wait until every queued event has been handled '''
+        deadline = None if timeout is None else time.time() + timeout
+        with self._lock:
+            while self._pending:
+                if deadline is None:
+                    self._lock.wait()
+                    continue
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self._lock.wait(remaining)
+            return not self._pending
+
+    def close(self):
+        ''' Stop the workers once they are done with the queued events '''
+        with self._lock:
+            self._closed = True
+            self._lock.notify_all()
+        for _ in self._threads:
+            self._ready.put(None)
+
+    def _work(self):
+        ''' Run the events of the ready handlers (worker thread) '''
+        while True:
+            handler = self._ready.get()
+            if handler is None:
+                break
+            with self._lock:
+                event_dict = self._lanes[handler].popleft()
+            try:
+                handler.dispatch(event_dict)
+            except Exception:
+                LOGGER.exception("Offloaded handler %s failed on event '%s'",
+                        repr(handler()), event_dict.get('event'))
+            with self._lock:
+                self._pending -= 1
+                if self._lanes[handler]:
+                    # Keep the order: the next event of this handler waits
+                    # for this one
+                    self._ready.put(handler)
+                else:
+                    del self._lanes[handler]
+                self._lock.notify_all()